@@ -1,11 +1,15 @@
+import os
 import time
 import socket
+import select
+import weakref
+import threading
 
 import requests
 from requests.packages.urllib3 import HTTPConnectionPool, HTTPSConnectionPool
 from requests.packages.urllib3.poolmanager import PoolManager, proxy_from_url
 from requests.packages.urllib3.connectionpool import VerifiedHTTPSConnection
-from requests.adapters import HTTPAdapter
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
 from requests.compat import urlparse
 
 from httplib import HTTPConnection
@@ -66,6 +70,223 @@ class AsyncTimeout(float):
 DEFAULT_TIMEOUT = AsyncTimeout(10).setConnectTimeout(10)
 
 
+class ConnectStats(object):
+    """ Connect latency and wakeup counts, so the connect engines can be compared. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.failed = 0
+        self.totalTime = 0.0
+        self.wakeups = 0
+
+    def record(self, elapsed, ok=True):
+        with self.lock:
+            if ok:
+                self.connects += 1
+                self.totalTime += elapsed
+            else:
+                self.failed += 1
+
+    def wake(self, count=1):
+        self.wakeups += count
+
+    def averageMs(self):
+        return self.connects and (self.totalTime / self.connects) * 1000 or 0
+
+    def log(self, logger, name):
+        logger('Connect engine ({0}): connects={1} failed={2} avg={3:.1f}ms wakeups={4}'.format(
+            name, self.connects, self.failed, self.averageMs(), self.wakeups
+        ))
+
+
+class _PendingConnect(object):
+    def __init__(self, sock, deadline, isCanceled):
+        self.sock = sock
+        self.deadline = deadline
+        self.isCanceled = isCanceled
+        self.error = None
+        self.event = threading.Event()
+
+    def finish(self, error=None):
+        self.error = error
+        self.event.set()
+
+
+class SelectorEngine(object):
+    """
+    Waits on many non-blocking connects from a single thread using epoll where it's
+    available and select() elsewhere. Connecting threads hand over their socket and
+    sleep until it's connected, failed, timed out or canceled, instead of each one
+    polling connect_ex() every 10ms. Connect deadlines and ABORT_FLAG_FUNCTION are
+    checked every POLL_INTERVAL.
+    """
+
+    POLL_INTERVAL = 0.05
+    WAIT_MARGIN = 1  # Seconds past its deadline a connecting thread waits on the engine thread
+
+    def __init__(self):
+        self.name = hasattr(select, 'epoll') and 'epoll' or 'select'
+        self.stats = ConnectStats()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._epoll = None
+        self._thread = None
+
+    def connect(self, sock, sa, timeout, isCanceled):
+        start = time.time()
+        status = sock.connect_ex(sa)
+        if status and status not in (errno.EISCONN, WIN_EISCONN):
+            if status not in (errno.EINPROGRESS, errno.EWOULDBLOCK, WIN_EWOULDBLOCK):
+                self.stats.record(0, False)
+                raise socket.error(status, os.strerror(status))
+
+            pending = _PendingConnect(sock, start + timeout.getConnectTimeout(), isCanceled)
+            self._add(pending)
+            if not pending.event.wait(timeout.getConnectTimeout() + self.WAIT_MARGIN):
+                # The engine thread should have timed it out by now, don't rely on it
+                with self._lock:
+                    self._finish(sock.fileno(), TimeoutException('connection timed out'))
+
+            if pending.error:
+                self.stats.record(0, False)
+                raise pending.error
+
+        self.stats.record(time.time() - start)
+
+    def _add(self, pending):
+        fd = pending.sock.fileno()
+        with self._lock:
+            self._pending[fd] = pending
+            if self._thread and self._thread.isAlive():
+                if self._epoll:
+                    self._epoll.register(fd, select.EPOLLOUT | select.EPOLLERR | select.EPOLLHUP)
+                return
+
+            if self.name == 'epoll':
+                self._epoll = select.epoll()
+                for fd in self._pending:
+                    self._epoll.register(fd, select.EPOLLOUT | select.EPOLLERR | select.EPOLLHUP)
+
+            self._thread = threading.Thread(target=self._run, name='CONNECT-ENGINE({0})'.format(self.name))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _finish(self, fd, error=None):
+        # Called with the lock held
+        pending = self._pending.pop(fd, None)
+        if not pending:
+            return
+
+        if self._epoll:
+            try:
+                self._epoll.unregister(fd)
+            except (IOError, ValueError):
+                pass
+
+        pending.finish(error)
+
+    def _poll(self):
+        if self._epoll:
+            return [fd for fd, event in self._epoll.poll(self.POLL_INTERVAL)]
+
+        with self._lock:
+            fds = self._pending.keys()
+
+        r, w, x = select.select([], fds, fds, self.POLL_INTERVAL)
+        return w + x
+
+    def _run(self):
+        try:
+            while self._step():
+                pass
+        except Exception as e:
+            # Don't leave connecting threads waiting on a thread that's gone, the next connect starts a new one
+            with self._lock:
+                for fd in self._pending.keys():
+                    self._finish(fd, socket.error('Connect engine failed: {0}'.format(e)))
+                self._stop()
+
+    def _stop(self):
+        # Called with the lock held
+        if self._epoll:
+            self._epoll.close()
+            self._epoll = None
+        self._thread = None
+
+    def _step(self):
+        with self._lock:
+            if not self._pending:
+                self._stop()
+                return False
+
+        try:
+            ready = self._poll()
+        except (select.error, IOError, ValueError):
+            # A socket was closed under us, let the checks below sort it out
+            ready = []
+
+        self.stats.wake()
+        now = time.time()
+        abort = ABORT_FLAG_FUNCTION()
+
+        with self._lock:
+            for fd in ready:
+                pending = self._pending.get(fd)
+                if not pending:
+                    continue
+                error = pending.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                self._finish(fd, error and socket.error(error, os.strerror(error)) or None)
+
+            for fd, pending in self._pending.items():
+                if abort or pending.isCanceled():
+                    self._finish(fd, CanceledException('Request canceled'))
+                elif now > pending.deadline:
+                    self._finish(fd, TimeoutException('connection timed out'))
+
+        return True
+
+
+# The engine used for connects, or None to poll each connect from its own thread
+ENGINE = None
+POLLED_STATS = ConnectStats()
+
+
+def setEngine(enabled):
+    global ENGINE
+    if enabled:
+        ENGINE = ENGINE or SelectorEngine()
+    else:
+        ENGINE = None
+
+
+# Per thread: who should be told about the connections the thread takes from a pool
+_OWNER = threading.local()
+
+
+def setConnectionOwner(owner):
+    """
+    Until cleared with None, each connection the calling thread takes from a pool is
+    passed to owner.setConnection(), so the owner can abort just that connection.
+    """
+    _OWNER.owner = owner
+
+
+def _claim(conn):
+    conn._canceled = False  # It may be back in the pool after a canceled request
+    owner = getattr(_OWNER, 'owner', None)
+    if owner:
+        owner.setConnection(conn)
+    return conn
+
+
+def logStats(logger):
+    if POLLED_STATS.connects or POLLED_STATS.failed:
+        POLLED_STATS.log(logger, 'polled')
+    if ENGINE:
+        ENGINE.stats.log(logger, ENGINE.name)
+
+
 class AsyncVerifiedHTTPSConnection(VerifiedHTTPSConnection):
     def __init__(self, *args, **kwargs):
         VerifiedHTTPSConnection.__init__(self, *args, **kwargs)
@@ -105,9 +326,18 @@ class AsyncVerifiedHTTPSConnection(VerifiedHTTPSConnection):
 
                 if source_address:
                     sock.bind(source_address)
-                for msg in self._connect(sock, sa):
-                    if self._canceled or ABORT_FLAG_FUNCTION():
-                        raise CanceledException('Request canceled')
+                if ENGINE:
+                    ENGINE.connect(sock, sa, timeout, self.isCanceled)
+                else:
+                    start = time.time()
+                    try:
+                        for msg in self._connect(sock, sa):
+                            if self._canceled or ABORT_FLAG_FUNCTION():
+                                raise CanceledException('Request canceled')
+                    except Exception:
+                        POLLED_STATS.record(0, False)
+                        raise
+                    POLLED_STATS.record(time.time() - start)
                 sock.setblocking(True)
                 return sock
 
@@ -115,15 +345,24 @@ class AsyncVerifiedHTTPSConnection(VerifiedHTTPSConnection):
                 err = _
                 if sock is not None:
                     sock.close()
+            except Exception:
+                # Canceled or timed out
+                if sock is not None:
+                    sock.close()
+                raise
 
         if err is not None:
             raise err
         else:
             raise socket.error("getaddrinfo returns an empty list")
 
+    def isCanceled(self):
+        return self._canceled
+
     def _connect(self, sock, sa):
         while not self._canceled and not ABORT_FLAG_FUNCTION():
             time.sleep(0.01)
+            POLLED_STATS.wake()
             self._check_timeout()  # this should be done at the beginning of each loop
             status = sock.connect_ex(sa)
             if not status or status in (errno.EISCONN, WIN_EISCONN):
@@ -160,6 +399,39 @@ class AsyncHTTPConnection(HTTPConnection):
         self._canceled = False
         self.deadline = 0
 
+    def connect(self):
+        if not ENGINE:
+            return HTTPConnection.connect(self)
+
+        timeout = AsyncTimeout.fromTimeout(self.timeout)
+        err = None
+        for af, socktype, proto, canonname, sa in socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM):
+            sock = None
+            try:
+                sock = socket.socket(af, socktype, proto)
+                sock.setblocking(False)
+                ENGINE.connect(sock, sa, timeout, self.isCanceled)
+                sock.settimeout(float(timeout))
+                self.sock = sock
+                break
+            except socket.error as _:
+                err = _
+                if sock is not None:
+                    sock.close()
+            except Exception:
+                # Canceled or timed out
+                if sock is not None:
+                    sock.close()
+                raise
+        else:
+            raise err or socket.error("getaddrinfo returns an empty list")
+
+        if self._tunnel_host:
+            self._tunnel()
+
+    def isCanceled(self):
+        return self._canceled
+
     def cancel(self):
         self._canceled = True
 
@@ -167,7 +439,8 @@ class AsyncHTTPConnection(HTTPConnection):
 class AsyncHTTPConnectionPool(HTTPConnectionPool):
     def __init__(self, *args, **kwargs):
         HTTPConnectionPool.__init__(self, *args, **kwargs)
-        self.connections = []
+        self.connections = weakref.WeakSet()  # Only for cancel(), connections the pool has dropped go with it
+        self.connectionsLock = threading.Lock()
 
     def _new_conn(self):
         """
@@ -187,19 +460,27 @@ class AsyncHTTPConnectionPool(HTTPConnectionPool):
             # Mark this connection as not reusable
             conn.auto_open = 0
 
-        self.connections.append(conn)
+        with self.connectionsLock:
+            self.connections.add(conn)
 
         return conn
 
+    def _get_conn(self, timeout=None):
+        return _claim(HTTPConnectionPool._get_conn(self, timeout))
+
     def cancel(self):
-        for c in self.connections:
+        with self.connectionsLock:
+            connections = list(self.connections)
+
+        for c in connections:
             c.cancel()
 
 
 class AsyncHTTPSConnectionPool(HTTPSConnectionPool):
     def __init__(self, *args, **kwargs):
         HTTPSConnectionPool.__init__(self, *args, **kwargs)
-        self.connections = []
+        self.connections = weakref.WeakSet()
+        self.connectionsLock = threading.Lock()
 
     def _new_conn(self):
         """
@@ -219,12 +500,19 @@ class AsyncHTTPSConnectionPool(HTTPSConnectionPool):
         extra_params['strict'] = self.strict
         connection = connection_class(host=actual_host, port=actual_port, timeout=self.timeout.connect_timeout, **extra_params)
 
-        self.connections.append(connection)
+        with self.connectionsLock:
+            self.connections.add(connection)
 
         return self._prepare_conn(connection)
 
+    def _get_conn(self, timeout=None):
+        return _claim(HTTPSConnectionPool._get_conn(self, timeout))
+
     def cancel(self):
-        for c in self.connections:
+        with self.connectionsLock:
+            connections = list(self.connections)
+
+        for c in connections:
             c.cancel()
 
 
@@ -255,9 +543,13 @@ class AsyncPoolManager(PoolManager):
 
 class AsyncHTTPAdapter(HTTPAdapter):
     def cancel(self):
-        for c in self.connections:
+        for c in self.pools():
             c.cancel()
 
+    def pools(self):
+        with self.connectionsLock:
+            return list(self.connections)
+
     def init_poolmanager(self, connections, maxsize, block=DEFAULT_POOLBLOCK):
         """Initializes a urllib3 PoolManager. This method should not be called
         from user code, and is only exposed for use when subclassing the
@@ -273,7 +565,8 @@ class AsyncHTTPAdapter(HTTPAdapter):
         self._pool_block = block
 
         self.poolmanager = AsyncPoolManager(num_pools=connections, maxsize=maxsize, block=block)
-        self.connections = []
+        self.connections = weakref.WeakSet()  # Pools the pool manager has evicted drop out on their own
+        self.connectionsLock = threading.Lock()
 
     def get_connection(self, url, proxies=None):
         """Returns a urllib3 connection for the given URL. This should not be
@@ -305,17 +598,38 @@ class AsyncHTTPAdapter(HTTPAdapter):
             url = parsed.geturl()
             conn = self.poolmanager.connection_from_url(url)
 
-        self.connections.append(conn)
+        with self.connectionsLock:
+            self.connections.add(conn)
         return conn
 
+    def connectionStats(self):
+        handshakes = 0
+        requests_ = 0
+        for c in self.pools():
+            handshakes += c.num_connections
+            requests_ += c.num_requests
+
+        return handshakes, requests_
+
 
 class Session(requests.Session):
-    def __init__(self, *args, **kwargs):
-        requests.Session.__init__(self, *args, **kwargs)
-        self.mount('https://', AsyncHTTPAdapter())
-        self.mount('http://', AsyncHTTPAdapter())
+    def __init__(self, pool_maxsize=DEFAULT_POOLSIZE):
+        requests.Session.__init__(self)
+        self.mount('https://', AsyncHTTPAdapter(pool_maxsize=pool_maxsize))
+        self.mount('http://', AsyncHTTPAdapter(pool_maxsize=pool_maxsize))
 
     def cancel(self):
         for v in self.adapters.values():
             v.close()
             v.cancel()
+
+    def connectionStats(self):
+        """Return (handshakes, requests) summed over every connection pool of this session."""
+        handshakes = 0
+        requests_ = 0
+        for v in self.adapters.values():
+            h, r = v.connectionStats()
+            handshakes += h
+            requests_ += r
+
+        return handshakes, requests_
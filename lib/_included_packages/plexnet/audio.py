@@ -145,8 +145,8 @@ class Track(Audio):
 
     @property
     def defaultThumb(self):
-        return self.__dict__.get('thumb') or self.__dict__.get('parentThumb') or self.get('grandparentThumb')
+        return self.get('thumb') or self.get('parentThumb') or self.get('grandparentThumb')
 
     @property
     def defaultArt(self):
-        return self.__dict__.get('art') or self.get('grandparentArt')
+        return self.get('art') or self.get('grandparentArt')
@@ -1,4 +1,4 @@
-import threading
+import threadutils
 
 
 class Callable(object):
@@ -45,9 +45,7 @@ class Callable(object):
         return cls._currID
 
     def deferCall(self, timeout=0.1):
-        timer = threading.Timer(timeout, self.onDeferCallTimer)
-        timer.name = 'ONDEFERCALLBACK-TIMER:{0}'.format(self.func)
-        timer.start()
+        threadutils.EXECUTOR.submit(self.onDeferCallTimer, delay=timeout, name='ONDEFERCALLBACK:{0}'.format(self.func))
 
     def onDeferCallTimer(self):
         self()
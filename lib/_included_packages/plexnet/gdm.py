@@ -1,6 +1,6 @@
 import threading
 import socket
-import traceback
+import select
 import time
 import util
 import netif
@@ -9,12 +9,25 @@ import plexconnection
 
 DISCOVERY_PORT = 32414
 WIN_NL = chr(13) + chr(10)
+SEARCH_PACKET = "M-SEARCH * HTTP/1.1" + WIN_NL + WIN_NL
+
+DISCOVERY_WINDOW = 5  # seconds a round collects replies before reporting them as a batch
+BROADCAST_INTERVAL = 0.5  # first re-broadcast, doubling after each one
+BROADCAST_MAX_INTERVAL = 60
+WAKE_INTERVAL = 1  # longest we sit in select() before checking for close()
 
 
 class GDMDiscovery(object):
     def __init__(self):
         self._close = False
         self.thread = None
+        self.lock = threading.Lock()
+        self.seen = {}
+        self.roundServers = {}
+        self.roundEnd = 0
+        self.nextBroadcast = 0
+        self.backoff = BROADCAST_INTERVAL
+        self.rebind = True
 
     # def isActive(self):
     #     util.LOG('GDMDiscovery().isActive() - NOT IMPLEMENTED')
@@ -25,7 +38,10 @@ class GDMDiscovery(object):
 
     def isActive(self):
         import plexapp
-        return plexapp.INTERFACE.getPreference("gdm_discovery", True) and self.thread and self.thread.isAlive()
+        # Active while a discovery round is collecting replies, the listener itself outlives the round
+        return bool(
+            plexapp.INTERFACE.getPreference("gdm_discovery", True) and self.thread and self.thread.isAlive() and self.roundEnd
+        )
 
     '''
     def discover(self):
@@ -121,59 +137,111 @@ class GDMDiscovery(object):
 
     def discover(self):
         import plexapp
-        if not plexapp.INTERFACE.getPreference("gdm_discovery", True) or self.isActive():
+        if not plexapp.INTERFACE.getPreference("gdm_discovery", True):
             return
 
-        self.thread = threading.Thread(target=self._discover)
-        self.thread.start()
+        with self.lock:
+            # A new discovery round: re-broadcast right away and collect replies for another window
+            self.roundServers = {}
+            self.roundEnd = time.time() + DISCOVERY_WINDOW
+            self.nextBroadcast = 0
+            self.backoff = BROADCAST_INTERVAL
+            self.rebind = True
 
-    def _discover(self):
-        ifaces = netif.getInterfaces()
-        sockets = []
-        self.servers = []
+            if self.thread and self.thread.isAlive():
+                return
 
-        packet = "M-SEARCH * HTTP/1.1" + WIN_NL + WIN_NL
+            self._close = False
+            self.thread = threading.Thread(target=self._listen, name='GDM-LISTENER')
+            self.thread.daemon = True
+            self.thread.start()
 
-        for i in ifaces:
+    def _bind(self, sockets):
+        for s, i in sockets:
+            s.close()
+
+        del sockets[:]
+
+        for i in netif.getInterfaces():
             if not i.broadcast:
                 continue
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.settimeout(0.01)  # 10ms
-            s.bind((i.ip, 0))
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            try:
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                s.bind((i.ip, 0))
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                s.setblocking(False)
+            except socket.error:
+                util.ERROR()
+                continue
+
             sockets.append((s, i))
 
-        success = False
+    def _broadcast(self, sockets):
+        for s, i in sockets:
+            util.DEBUG_LOG('  o-> Broadcasting to {0}: {1}'.format(i.name, i.broadcast))
+            try:
+                s.sendto(SEARCH_PACKET, (i.broadcast, DISCOVERY_PORT))
+            except socket.error:
+                util.ERROR()
 
-        for attempt in (0, 1):
-            for s, i in sockets:
-                if self._close:
-                    return
-                util.DEBUG_LOG('  o-> Broadcasting to {0}: {1}'.format(i.name, i.broadcast))
-                try:
-                    s.sendto(packet, (i.broadcast, DISCOVERY_PORT))
-                    success = True
-                except:
-                    util.ERROR()
+    def _listen(self):
+        import plexapp
 
-            if success:
-                break
+        sockets = []
+        bySocket = {}
 
-        end = time.time() + 5
+        try:
+            while not self._close and plexapp.INTERFACE.getPreference("gdm_discovery", True):
+                now = time.time()
+
+                with self.lock:
+                    if self.rebind:
+                        self.rebind = False
+                        self._bind(sockets)
+                        bySocket = dict(sockets)
+
+                    broadcast = now >= self.nextBroadcast
+                    if broadcast:
+                        self.nextBroadcast = now + self.backoff
+                        self.backoff = min(self.backoff * 2, BROADCAST_MAX_INTERVAL)
+
+                    finished = self.roundEnd and now >= self.roundEnd
+
+                if broadcast:
+                    self._broadcast(sockets)
+
+                if finished:
+                    self.discoveryFinished()
+
+                timeout = max(0, min(self.nextBroadcast, self.roundEnd or self.nextBroadcast) - time.time())
+
+                if not bySocket:
+                    time.sleep(min(timeout, WAKE_INTERVAL))
+                    continue
 
-        while time.time() < end:
-            for s, i in sockets:
-                if self._close:
-                    return
                 try:
-                    message, address = s.recvfrom(4096)
-                    self.onSocketEvent(message, address)
-                except socket.timeout:
-                    pass
-                except:
-                    traceback.print_exc()
+                    readable = select.select(bySocket.keys(), [], [], min(timeout, WAKE_INTERVAL))[0]
+                except (select.error, socket.error):
+                    util.ERROR()
+                    with self.lock:
+                        self.rebind = True
+                    continue
+
+                for s in readable:
+                    try:
+                        message, address = s.recvfrom(4096)
+                    except socket.error:
+                        continue
+
+                    try:
+                        self.onSocketEvent(message, address)
+                    except:
+                        util.ERROR()
+        finally:
+            for s, i in sockets:
+                s.close()
 
-        self.discoveryFinished()
+            util.DEBUG_LOG('GDM listener stopped')
 
     def onSocketEvent(self, message, addr):
         util.DEBUG_LOG('Received GDM message:\n' + str(message))
@@ -208,17 +276,36 @@ class GDMDiscovery(object):
                 )
             )
 
-        self.servers.append(server)
+        signature = (name, tuple(c.address for c in server.connections))
 
-    def discoveryFinished(self, *args, **kwargs):
-        # Time's up, report whatever we found
-        self.close()
+        with self.lock:
+            if self.roundEnd:
+                self.roundServers[machineID] = server
+
+            if self.seen.get(machineID) == signature:
+                return
 
-        if self.servers:
-            util.LOG("Finished GDM discovery, found {0} server(s)".format(len(self.servers)))
+            self.seen[machineID] = signature
+
+        # New or changed since we last heard from it, so don't wait for the round to finish
+        util.DEBUG_LOG("GDM: pushing {0} to the server manager".format(repr(name)))
+        import plexapp
+        plexapp.SERVERMANAGER.updateFromDiscovery(server)
+
+    def discoveryFinished(self, *args, **kwargs):
+        # The round's window is up, report whatever answered so servers that went away get dropped.
+        # The listener keeps running and pushing anything new that shows up later.
+        with self.lock:
+            servers = self.roundServers.values()
+            self.roundServers = {}
+            self.roundEnd = 0
+            found = set(s.uuid for s in servers)
+            self.seen = dict((uuid, sig) for uuid, sig in self.seen.items() if uuid in found)
+
+        if servers:
+            util.LOG("Finished GDM discovery, found {0} server(s)".format(len(servers)))
             import plexapp
-            plexapp.SERVERMANAGER.updateFromConnectionType(self.servers, plexconnection.PlexConnection.SOURCE_DISCOVERED)
-            self.servers = None
+            plexapp.SERVERMANAGER.updateFromConnectionType(servers, plexconnection.PlexConnection.SOURCE_DISCOVERED)
 
     def close(self):
         self._close = True
@@ -1,9 +1,12 @@
 import sys
 import os
 import re
+import time
+import threading
 import traceback
 import requests
 import socket
+import StringIO
 import threadutils
 import urllib
 import mimetypes
@@ -11,8 +14,11 @@ import plexobjects
 from xml.etree import ElementTree
 
 import asyncadapter
+import exceptions
 
 import callback
+import profiler
+import responsedecoder
 import util
 
 
@@ -22,6 +28,10 @@ status_codes = requests.status_codes._codes
 
 DEFAULT_TIMEOUT = asyncadapter.AsyncTimeout(10).setConnectTimeout(10)
 
+POOL_MAXSIZE = 8            # Max keep-alive connections kept per host
+POOL_IDLE_TIMEOUT = 120     # Seconds a pooled session may sit unused before it's closed
+POOL_SWEEP_INTERVAL = 30    # Minimum seconds between idle session sweeps
+
 
 def GET(*args, **kwargs):
     return requests.get(*args, headers=util.BASE_HEADERS.copy(), timeout=util.TIMEOUT, **kwargs)
@@ -39,6 +49,235 @@ def Session():
     return s
 
 
+class PooledSession(object):
+    def __init__(self, key):
+        self.key = key
+        self.session = asyncadapter.Session(pool_maxsize=POOL_MAXSIZE)
+        self.session.headers = util.BASE_HEADERS.copy()
+        self.session.timeout = util.TIMEOUT
+        self.lastUsed = time.time()
+
+    def touch(self):
+        self.lastUsed = time.time()
+        return self.session
+
+    def isIdle(self, now):
+        return now - self.lastUsed > POOL_IDLE_TIMEOUT
+
+    def close(self):
+        self.session.cancel()
+
+
+class SessionRegistry(object):
+    """
+    Keeps one keep-alive session per (server uuid, connection address) so that
+    reachability probes, timeline updates and queries to the same host reuse
+    already established TCP/TLS connections instead of handshaking every time.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._lastSweep = time.time()
+        self._retiredHandshakes = 0
+        self._retiredRequests = 0
+        self.evicted = 0
+
+    @staticmethod
+    def keyForUrl(url, uuid=None):
+        parsed = asyncadapter.urlparse(url)
+        return (uuid, '{0}://{1}'.format(parsed.scheme, parsed.netloc))
+
+    def getSession(self, url, uuid=None):
+        key = self.keyForUrl(url, uuid)
+        with self._lock:
+            self._sweep()
+            pooled = self._sessions.get(key)
+            if not pooled:
+                pooled = PooledSession(key)
+                self._sessions[key] = pooled
+
+            return pooled.touch()
+
+    def closeServer(self, uuid):
+        with self._lock:
+            for key in [k for k in self._sessions if k[0] == uuid]:
+                self._retire(key)
+
+    def closeAll(self):
+        with self._lock:
+            for key in self._sessions.keys():
+                self._retire(key)
+
+    def _retire(self, key):
+        pooled = self._sessions.pop(key)
+        handshakes, requests_ = pooled.session.connectionStats()
+        self._retiredHandshakes += handshakes
+        self._retiredRequests += requests_
+        self.evicted += 1
+        pooled.close()
+
+    def _sweep(self):
+        now = time.time()
+        if now - self._lastSweep < POOL_SWEEP_INTERVAL:
+            return
+
+        self._lastSweep = now
+        for key in [k for k, p in self._sessions.items() if p.isIdle(now)]:
+            util.DEBUG_LOG('Closing idle pooled session: {0}'.format(key[1]))
+            self._retire(key)
+
+    def stats(self):
+        with self._lock:
+            hosts = {}
+            handshakes = self._retiredHandshakes
+            requests_ = self._retiredRequests
+            for key, pooled in self._sessions.items():
+                h, r = pooled.session.connectionStats()
+                hosts[key] = (h, r)
+                handshakes += h
+                requests_ += r
+
+        return {
+            'sessions': len(hosts),
+            'evicted': self.evicted,
+            'handshakes': handshakes,
+            'requests': requests_,
+            'reuse': requests_ and (1 - float(handshakes) / requests_) or 0.0,
+            'hosts': hosts
+        }
+
+    def logStats(self):
+        stats = self.stats()
+        util.DEBUG_LOG(
+            'Session pool: sessions={0} evicted={1} handshakes={2} requests={3} reuse={4:.0%}'.format(
+                stats['sessions'], stats['evicted'], stats['handshakes'], stats['requests'], stats['reuse']
+            )
+        )
+        for key, (h, r) in stats['hosts'].items():
+            util.DEBUG_LOG('  {0} ({1}): handshakes={2} requests={3}'.format(key[1], key[0], h, r))
+
+
+FOLLOW_TIMEOUT = 20  # seconds a coalesced request waits on the one in flight before sending its own
+FOLLOW_POLL = 0.1
+
+# Requests to these change state on the server, anything else that isn't a GET does too
+WRITE_PATHS = ('/:/',)
+
+
+class _Flight(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical concurrent requests. The first caller for a key does the
+    work while anyone asking for the same key before it's done waits for it and
+    gets the same result (or exception). With share() given, every caller of a
+    shared result gets its own copy made by it.
+
+    A waiting caller gives up and returns None once canceled() is true, and does the
+    work itself if the first caller hasn't finished within timeout seconds.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.saved = 0
+        self.timedOut = 0
+
+    def do(self, key, func, args=(), kwargs=None, timeout=FOLLOW_TIMEOUT, canceled=None, share=None):
+        kwargs = kwargs or {}
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight:
+                self.saved += 1
+                flight.followers += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                leader = True
+
+        if not leader:
+            return self._follow(flight, func, args, kwargs, timeout, canceled, share)
+
+        try:
+            flight.result = func(*args, **kwargs)
+        except:
+            flight.error = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+        # The original stays untouched for the followers to copy from, so the leader gets a copy as well
+        if share and flight.followers and flight.result is not None:
+            return share(flight.result)
+
+        return flight.result
+
+    def _follow(self, flight, func, args, kwargs, timeout, canceled, share):
+        deadline = time.time() + timeout
+        while not flight.event.wait(FOLLOW_POLL):
+            if canceled and canceled():
+                return None
+
+            if time.time() >= deadline:
+                with self._lock:
+                    self.timedOut += 1
+                util.DEBUG_LOG('Request coalescing: gave up waiting after {0}s'.format(timeout))
+                return func(*args, **kwargs)
+
+        if flight.error:
+            raise flight.error[0], flight.error[1], flight.error[2]
+
+        if share and flight.result is not None:
+            return share(flight.result)
+
+        return flight.result
+
+    def logStats(self):
+        util.DEBUG_LOG('Request coalescing: calls={0} saved={1} timedOut={2}'.format(self.calls, self.saved, self.timedOut))
+
+
+class WriteEpochs(object):
+    """
+    Counts the writes made to each server. Coalesced GETs include the count in their key,
+    so a GET sent after a write never shares the result of one that started before it.
+    """
+
+    def __init__(self):
+        self._epochs = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._epochs.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            self._epochs[key] = self._epochs.get(key, 0) + 1
+
+    @staticmethod
+    def isWrite(method, path):
+        return method not in (None, 'GET', 'HEAD') or path.startswith(WRITE_PATHS)
+
+
+def cloneElement(elem):
+    """ A copy of an ElementTree element and its children, several times faster than copy.deepcopy(). """
+    clone = elem.makeelement(elem.tag, dict(elem.attrib))
+    clone.text = elem.text
+    clone.tail = elem.tail
+    clone[:] = [cloneElement(child) for child in elem]
+    return clone
+
+
 class RequestContext(dict):
     def __getattr__(self, attr):
         return self.get(attr)
@@ -47,20 +286,34 @@ class RequestContext(dict):
         self[attr] = value
 
 
+# Executor lane for async requests by context.requestType, anything else is a UI fetch
+REQUEST_LANES = {
+    'reachability': threadutils.LANE_REACHABILITY,
+    'manual_connections': threadutils.LANE_REACHABILITY,
+    'timelineUpdate': threadutils.LANE_TIMELINE
+}
+
+
 class HttpRequest(object):
     _cancel = False
 
-    def __init__(self, url, method=None, forceCertificate=False):
+    def __init__(self, url, method=None, forceCertificate=False, serverUuid=None):
         self.server = None
         self.path = None
         self.hasParams = '?' in url
         self.ignoreResponse = False
-        self.session = asyncadapter.Session()
-        self.session.headers = util.BASE_HEADERS.copy()
+        self.session = SESSIONS.getSession(url, serverUuid)
+        self.writeKey = serverUuid or asyncadapter.urlparse(url).netloc
+        self.headers = util.BASE_HEADERS.copy()
+        self.inFlight = False
         self.currentResponse = None
+        self.connection = None
         self.method = method
         self.url = url
-        self.thread = None
+        self.job = None
+        self.coalesce = False
+        self.sentAt = None
+        self.elapsed = None
 
         # Use our specific plex.direct CA cert if applicable to improve performance
         # if forceCertificate or url[:5] == "https":  # TODO: ---------------------------------------------------------------------------------IMPLEMENT
@@ -75,8 +328,11 @@ class HttpRequest(object):
         plexapp.APP.delRequest(self)
 
     def startAsync(self, *args, **kwargs):
-        self.thread = threadutils.KillableThread(target=self._startAsync, args=args, kwargs=kwargs, name='HTTP-ASYNC:{0}'.format(self.url))
-        self.thread.start()
+        context = kwargs.get('context')
+        lane = REQUEST_LANES.get(context and context.requestType, threadutils.LANE_UI)
+        self.job = threadutils.EXECUTOR.submit(
+            self._startAsync, args, kwargs, lane=lane, name='HTTP-ASYNC:{0}'.format(util.cleanToken(self.url))
+        )
         return True
 
     def _startAsync(self, body=None, contentType=None, context=None):
@@ -85,21 +341,13 @@ class HttpRequest(object):
         if self._cancel:
             return
         try:
-            if self.method == 'PUT':
-                res = self.session.put(self.url, timeout=timeout, stream=True)
-            elif self.method == 'DELETE':
-                res = self.session.delete(self.url, timeout=timeout, stream=True)
-            elif self.method == 'HEAD':
-                res = self.session.head(self.url, timeout=timeout, stream=True)
-            elif self.method == 'POST' or body is not None:
+            if body is not None or self.method == 'POST':
                 if not contentType:
-                    self.session.headers["Content-Type"] = "application/x-www-form-urlencoded"
+                    self.headers["Content-Type"] = "application/x-www-form-urlencoded"
                 else:
-                    self.session.headers["Content-Type"] = mimetypes.guess_type(contentType)
+                    self.headers["Content-Type"] = mimetypes.guess_type(contentType)
 
-                res = self.session.post(self.url, data=body or None, timeout=timeout, stream=True)
-            else:
-                res = self.session.get(self.url, timeout=timeout, stream=True)
+            res = self._send(timeout, body or None)
             self.currentResponse = res
 
             if self._cancel:
@@ -119,6 +367,71 @@ class HttpRequest(object):
 
         self.removeAsPending()
 
+    def _send(self, timeout, body=None):
+        if WriteEpochs.isWrite(body is not None and 'POST' or self.method, asyncadapter.urlparse(self.url).path):
+            WRITES.bump(self.writeKey)
+            try:
+                return self._dispatch(timeout, body)
+            finally:
+                # Again once it's done, so GETs sent while it was in flight aren't shared after it either
+                WRITES.bump(self.writeKey)
+
+        if self.coalesce and body is None and self.method in (None, 'GET'):
+            key = (self.url, tuple(sorted(self.headers.items())), WRITES.get(self.writeKey))
+            return INFLIGHT.do(key, self._sendShared, (timeout,), canceled=lambda: self._cancel)
+
+        return self._dispatch(timeout, body)
+
+    def _sendShared(self, timeout):
+        res = self._dispatch(timeout)
+        with profiler.span('http.receive'):
+            res.content  # read the body now so every request sharing this response can use it, it's read only after this
+        return res
+
+    def _dispatch(self, timeout, body=None):
+        self.inFlight = True
+        self.sentAt = time.time()
+        asyncadapter.setConnectionOwner(self)
+        try:
+            with profiler.span('http.send'):
+                if self.method == 'PUT':
+                    res = self.session.put(self.url, headers=self.headers, timeout=timeout, stream=True)
+                elif self.method == 'DELETE':
+                    res = self.session.delete(self.url, headers=self.headers, timeout=timeout, stream=True)
+                elif self.method == 'HEAD':
+                    res = self.session.head(self.url, headers=self.headers, timeout=timeout, stream=True)
+                elif self.method == 'POST' or body is not None:
+                    res = self.session.post(self.url, data=body, headers=self.headers, timeout=timeout, stream=True)
+                else:
+                    res = self.session.get(self.url, headers=self.headers, timeout=timeout, stream=True)
+
+            self.elapsed = time.time() - self.sentAt
+            # Set before inFlight is cleared so cancel() always sees one or the other
+            self.currentResponse = res
+            return res
+        finally:
+            asyncadapter.setConnectionOwner(None)
+            self.inFlight = False
+
+    def setConnection(self, conn):
+        self.connection = conn
+        if self._cancel:
+            conn.cancel()
+
+    def roundTrip(self):
+        """
+        Seconds from sending the request to its response headers, or so far if there was no
+        response. Time spent queued for an executor worker isn't included. None if not sent.
+        """
+        if self.elapsed is not None:
+            return self.elapsed
+        return self.sentAt and time.time() - self.sentAt or None
+
+    def isReading(self):
+        """ Whether the streamed body of the response is still being (or waiting to be) read. """
+        res = self.currentResponse
+        return res is not None and not res._content_consumed and not getattr(res.raw, 'closed', False)
+
     def getWithTimeout(self, seconds=DEFAULT_TIMEOUT):
         return HttpObjectResponse(self.getPostWithTimeout(seconds), self.path, self.server)
 
@@ -130,14 +443,16 @@ class HttpRequest(object):
         res = self.getPostWithTimeout(seconds)
         if not res:
             return ''
-        return res.text.encode('utf8')
+        with profiler.span('http.receive'):
+            return res.text.encode('utf8')
 
     def postToStringWithTimeout(self, body=None, seconds=DEFAULT_TIMEOUT):
         self.method = 'POST'
         res = self.getPostWithTimeout(seconds, body)
         if not res:
             return ''
-        return res.text.encode('utf8')
+        with profiler.span('http.receive'):
+            return res.text.encode('utf8')
 
     def getPostWithTimeout(self, seconds=DEFAULT_TIMEOUT, body=None):
         if self._cancel:
@@ -145,17 +460,7 @@ class HttpRequest(object):
 
         self.logRequest(body, seconds, False)
         try:
-            if self.method == 'PUT':
-                res = self.session.put(self.url, timeout=seconds, stream=True)
-            elif self.method == 'DELETE':
-                res = self.session.delete(self.url, timeout=seconds, stream=True)
-            elif self.method == 'HEAD':
-                res = self.session.head(self.url, timeout=seconds, stream=True)
-            elif self.method == 'POST' or body is not None:
-                res = self.session.post(self.url, data=body, timeout=seconds, stream=True)
-            else:
-                res = self.session.get(self.url, timeout=seconds, stream=True)
-
+            res = self._send(seconds, body)
             self.currentResponse = res
 
             if self._cancel:
@@ -212,10 +517,29 @@ class HttpRequest(object):
 
     def cancel(self):
         self._cancel = True
-        self.session.cancel()
+        if self.job:
+            self.job.cancel()
+        if self.inFlight or self.isReading():
+            # Our connection is mid request or mid body, don't let it go back to the pool half read.
+            # Only that one is aborted, the pooled session stays up for other requests to the host.
+            self.abortConnection()
         self.removeAsPending()
         self.killSocket()
 
+    def abortConnection(self):
+        conn = self.connection
+        if not conn:
+            return
+
+        conn.cancel()  # Ends a connect that's still in progress
+        sock = conn.sock
+        if sock:
+            try:
+                # Wakes up a blocked read, and the pool drops the connection as soon as it sees it
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
     def addParam(self, encodedName, value):
         if self.hasParams:
             self.url += "&" + encodedName + "=" + urllib.quote_plus(value)
@@ -224,7 +548,7 @@ class HttpRequest(object):
             self.url += "?" + encodedName + "=" + urllib.quote_plus(value)
 
     def addHeader(self, name, value):
-        self.session.headers[name] = value
+        self.headers[name] = value
 
     def createRequestContext(self, requestType, callback_=None):
         context = RequestContext()
@@ -254,6 +578,8 @@ class HttpRequest(object):
 
 
 class HttpResponse(object):
+    decoder = responsedecoder.XMLDecoder.NAME
+
     def __init__(self, event):
         self.event = event
         if not self.event is None:
@@ -285,7 +611,7 @@ class HttpResponse(object):
 
     def getBodyXml(self):
         if not self.event is None:
-            return ElementTree.fromstring(self.getBodyString())
+            return responsedecoder.getDecoder(self.decoder).decode(self.event)
 
         return None
 
@@ -295,6 +621,108 @@ class HttpResponse(object):
         return self.event.headers.get(name)
 
 
+# What reading and parsing a streamed body can fail with once the response has started
+STREAM_ERRORS = (ElementTree.ParseError, requests.packages.urllib3.exceptions.HTTPError, socket.error, IOError)
+
+
+class ElementStream(object):
+    """
+    Incrementally parses a streamed XML response. The root element (with its
+    attributes) is available as soon as its start tag arrives and iterating yields
+    each direct child as soon as it's complete. Yielded children are detached from
+    the root, so the tree never holds more than the element being parsed.
+
+    A body that breaks off or turns out not to be XML raises BadRequest, like an
+    error status would, and the response is closed on every way out.
+    """
+
+    def __init__(self, response, onComplete=None):
+        self.response = response
+        self.root = None
+        self._onComplete = onComplete
+
+        response.raw.decode_content = True
+        source = response.raw
+        if onComplete:
+            source = _RecordingReader(source)
+        self._source = source
+        self._events = ElementTree.iterparse(source, events=('start', 'end'))
+
+        try:
+            for event, elem in self._events:
+                self.root = elem
+                break
+        except ElementTree.ParseError:
+            # Nothing usable, e.g. an empty body
+            self.close()
+        except STREAM_ERRORS, e:
+            self.close()
+            raise exceptions.BadRequest('Stream failed: {0}'.format(e))
+
+    @classmethod
+    def fromString(cls, data):
+        """ Stream an already downloaded body, e.g. one read back from the metadata cache. """
+        return cls(_StringResponse(data))
+
+    @property
+    def tag(self):
+        return self.root.tag
+
+    @property
+    def attrib(self):
+        return self.root.attrib
+
+    def __iter__(self):
+        if self.root is None:
+            return
+
+        depth = 1
+        try:
+            for event, elem in self._events:
+                if event == 'start':
+                    depth += 1
+                    continue
+
+                depth -= 1
+                if depth == 1:
+                    yield elem
+                    self.root.remove(elem)
+
+            if self._onComplete:
+                self._onComplete(self._source.getvalue())
+        except STREAM_ERRORS, e:
+            raise exceptions.BadRequest('Stream failed: {0}'.format(e))
+        finally:
+            self.close()
+
+    def close(self):
+        self.response.close()
+
+
+class _RecordingReader(object):
+    """ File-like wrapper that keeps a copy of everything read through it. """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.chunks = []
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        self.chunks.append(data)
+        return data
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+class _StringResponse(object):
+    def __init__(self, data):
+        self.raw = StringIO.StringIO(data)
+
+    def close(self):
+        self.raw.close()
+
+
 class HttpObjectResponse(HttpResponse, plexobjects.PlexContainer):
     def __init__(self, response, path, server=None):
         self.event = response
@@ -310,6 +738,11 @@ class HttpObjectResponse(HttpResponse, plexobjects.PlexContainer):
         self.items = plexobjects.listItems(server, path, data=data, container=self)
 
 
+SESSIONS = SessionRegistry()
+INFLIGHT = SingleFlight()
+WRITES = WriteEpochs()
+
+
 def addRequestHeaders(transferObj, headers=None):
     if isinstance(headers, dict):
         for header in headers:
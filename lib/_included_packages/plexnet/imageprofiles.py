@@ -0,0 +1,89 @@
+"""
+Canonical sizes for image transcodes.
+
+Every window asks for its own width and height, so one poster ends up transcoded by
+PMS (and stored in the image cache) at several sizes a few pixels apart. snap() moves
+a requested size up to the smallest bucket of the same shape that covers it, so those
+requests share one transcode and one URL. PMS fits the image inside the box, so the
+result is never smaller than what was asked for. Sizes that match no shape, or are
+bigger than its largest bucket, are left as they are.
+"""
+import threading
+
+import util
+import profiler
+
+ASPECT_TOLERANCE = 0.08  # How far a requested width/height ratio can be from a shape's and still use its buckets
+
+# Shape: (width/height, buckets smallest first)
+PROFILES = {
+    'square': (1.0, ((64, 64), (128, 128), (288, 288), (384, 384), (528, 528), (640, 640))),
+    'poster': (2 / 3.0, ((180, 270), (280, 420), (360, 540), (440, 660))),
+    'wide': (16 / 9.0, ((192, 108), (352, 198), (480, 270), (560, 315), (704, 396)))
+}
+
+
+class ImageProfiles(object):
+    def __init__(self, profiles):
+        self.profiles = profiles
+        self.lock = threading.Lock()
+        self.sizes = {}
+        self.snapped = 0
+        self.unmatched = 0
+
+    def bucket(self, width, height):
+        """ The canonical (width, height) for a requested size, or None if there isn't one. """
+        if width <= 0 or height <= 0:
+            return None
+
+        ratio = float(width) / height
+        for name, (aspect, buckets) in self.profiles.items():
+            if abs(ratio - aspect) / aspect > ASPECT_TOLERANCE:
+                continue
+
+            for bucket in buckets:
+                if bucket[0] >= width and bucket[1] >= height:
+                    return bucket
+
+            return None
+
+        return None
+
+    def snap(self, width, height):
+        try:
+            width, height = int(width), int(height)
+        except (TypeError, ValueError):
+            return width, height
+
+        bucket = self.bucket(width, height)
+
+        with self.lock:
+            self.sizes[(width, height)] = bucket
+            if bucket:
+                self.snapped += 1
+            else:
+                self.unmatched += 1
+
+        if not bucket:
+            profiler.count('image.profile.unmatched')
+            return width, height
+
+        profiler.count('image.profile.snapped')
+        return bucket
+
+    def stats(self):
+        with self.lock:
+            return {
+                'sizes': len(self.sizes),
+                'buckets': len(set(b or s for s, b in self.sizes.items())),
+                'snapped': self.snapped,
+                'unmatched': self.unmatched
+            }
+
+    def logStats(self):
+        util.LOG(
+            'Image profiles: {sizes} requested sizes served as {buckets}, {snapped} snapped, {unmatched} unmatched'.format(**self.stats())
+        )
+
+
+REGISTRY = ImageProfiles(PROFILES)
@@ -0,0 +1,298 @@
+"""
+Persistent on-disk cache for PMS metadata responses.
+
+Entries are keyed by server uuid + path (including its query string) + params + a
+hash of the token the request was made with, so one Plex Home user is never handed
+another's listings. They hold the decoded response body along with whatever we can revalidate it with: the
+ETag/Last-Modified headers for a conditional GET, and a caller supplied validator
+(e.g. a section's updatedAt) that lets a matching entry be used without touching
+the network at all, for up to VALIDATOR_MAX_AGE after the server last gave or
+confirmed it (a section's updatedAt doesn't change with watched state). The cache is capped by size and evicts least recently used
+entries first.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+import util
+
+INDEX_FILE = 'index.json'
+MAX_SIZE = 64 * 1024 * 1024  # bytes
+INDEX_SAVE_INTERVAL = 30  # seconds, stores in between only mark the index dirty
+VALIDATOR_MAX_AGE = 300  # seconds an entry matching its validator is used without asking the server
+
+
+class CacheEntry(object):
+    __slots__ = ('key', 'name', 'size', 'etag', 'lastModified', 'validator', 'decoder', 'atime', 'confirmed')
+
+    def __init__(self, key, name, size=0, etag=None, lastModified=None, validator=None, decoder=None, atime=None, confirmed=None):
+        self.key = key
+        self.name = name
+        self.size = size
+        self.etag = etag
+        self.lastModified = lastModified
+        self.validator = validator
+        self.decoder = decoder
+        self.atime = atime or time.time()
+        self.confirmed = confirmed or 0  # when the server last gave or confirmed this body
+
+    def confirmedWithin(self, seconds):
+        return time.time() - self.confirmed < seconds
+
+    def conditionalHeaders(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.lastModified:
+            headers['If-Modified-Since'] = self.lastModified
+
+        return headers
+
+    def serialize(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__ if k != 'key')
+
+    @classmethod
+    def deserialize(cls, key, obj):
+        return cls(key, **dict((str(k), v) for k, v in obj.items()))
+
+
+class MetadataCache(object):
+    def __init__(self):
+        self.path = None
+        self.maxSize = MAX_SIZE
+        self.size = 0
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evicted = 0
+        self._dirty = False
+        self._lastSave = 0
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def setPath(self, path):
+        with self.lock:
+            self.path = path
+            self.entries = {}
+            self.size = 0
+
+            if not path:
+                self.path = None
+                return
+
+            try:
+                if not os.path.exists(path):
+                    os.makedirs(path)
+            except OSError:
+                util.ERROR()
+                self.path = None
+                return
+
+            self._loadIndex()
+
+    def setMaxSize(self, size):
+        with self.lock:
+            self.maxSize = size
+            self._evict()
+
+    def key(self, uuid, path, params=None, token=None):
+        if params:
+            path += util.joinArgs(params)
+
+        if token:
+            if isinstance(token, unicode):
+                token = token.encode('utf8')
+            return u'{0}{1}|{2}'.format(uuid, path, hashlib.sha1(token).hexdigest()[:16])
+
+        return u'{0}{1}'.format(uuid, path)
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def load(self, entry, revalidated=False):
+        """ Read the cached body for entry, or None if it's gone missing. """
+        try:
+            with open(self._file(entry.name), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            self.remove(entry.key)
+            return None
+
+        with self.lock:
+            entry.atime = time.time()
+            self._dirty = True
+            if revalidated:
+                self.revalidated += 1
+            else:
+                self.hits += 1
+
+        return data
+
+    def store(self, key, data, etag=None, lastModified=None, validator=None, decoder=None):
+        if not self.enabled or not data:
+            return
+
+        size = len(data)
+        if size > self.maxSize:
+            return
+
+        entry = CacheEntry(
+            key, hashlib.sha1(key.encode('utf8')).hexdigest(), size, etag, lastModified, validator, decoder, confirmed=time.time()
+        )
+
+        with self.lock:
+            self.misses += 1
+            try:
+                tmp = self._file(entry.name) + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                if os.path.exists(self._file(entry.name)):
+                    os.remove(self._file(entry.name))
+                os.rename(tmp, self._file(entry.name))
+            except (IOError, OSError):
+                util.ERROR()
+                return
+
+            old = self.entries.get(key)
+            if old:
+                self.size -= old.size
+
+            self.entries[key] = entry
+            self.size += size
+            self._dirty = True
+            self._evict()
+            if time.time() - self._lastSave >= INDEX_SAVE_INTERVAL:
+                self._saveIndex()
+
+    def update(self, entry, validator=None):
+        """ An entry was confirmed current by the server, so remember the validator it was confirmed against. """
+        with self.lock:
+            entry.confirmed = time.time()
+            self._dirty = True
+            if validator is not None:
+                entry.validator = validator
+
+    def remove(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def invalidate(self, uuid, prefix=''):
+        """ Drop every entry for the server with uuid whose path starts with prefix. """
+        start = self.key(uuid, prefix)
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(start)]:
+                self._remove(key)
+            self._saveIndex()
+
+    def clear(self):
+        with self.lock:
+            for key in self.entries.keys():
+                self._remove(key)
+            self._saveIndex()
+
+    def save(self):
+        with self.lock:
+            if self._dirty:
+                self._saveIndex()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size': self.size,
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'evicted': self.evicted
+            }
+
+    def logStats(self):
+        if not self.enabled:
+            return
+
+        util.LOG(
+            'Metadata cache: {entries} entries, {size} bytes, {hits} hits, {revalidated} revalidated, '
+            '{misses} misses, {evicted} evicted'.format(**self.stats())
+        )
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if not entry:
+            return
+
+        self.size -= entry.size
+        self._dirty = True
+        try:
+            os.remove(self._file(entry.name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        if self.size <= self.maxSize:
+            return
+
+        for entry in sorted(self.entries.values(), key=lambda e: e.atime):
+            if self.size <= self.maxSize:
+                break
+            self._remove(entry.key)
+            self.evicted += 1
+
+    def _loadIndex(self):
+        try:
+            with open(self._file(INDEX_FILE), 'r') as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            index = {}
+
+        for key, obj in index.items():
+            try:
+                entry = CacheEntry.deserialize(key, obj)
+            except TypeError:
+                continue
+
+            if not os.path.exists(self._file(entry.name)):
+                continue
+
+            self.entries[key] = entry
+            self.size += entry.size
+
+        # Bodies stored after the last index save (e.g. if Kodi was killed) can't be found again
+        known = set(e.name for e in self.entries.values())
+        for name in os.listdir(self.path):
+            if name != INDEX_FILE and name not in known:
+                try:
+                    os.remove(self._file(name))
+                except OSError:
+                    pass
+
+        self._dirty = False
+        self._evict()
+
+    def _saveIndex(self):
+        if not self.enabled:
+            return
+
+        try:
+            tmp = self._file(INDEX_FILE) + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(dict((k, e.serialize()) for k, e in self.entries.items()), f)
+            if os.path.exists(self._file(INDEX_FILE)):
+                os.remove(self._file(INDEX_FILE))
+            os.rename(tmp, self._file(INDEX_FILE))
+            self._dirty = False
+            self._lastSave = time.time()
+        except (IOError, OSError):
+            util.ERROR()
+
+
+CACHE = MetadataCache()
@@ -1,5 +1,4 @@
 import json
-import time
 import hashlib
 from xml.etree import ElementTree
 
@@ -8,11 +7,14 @@ import myplexrequest
 import locks
 import callback
 import asyncadapter
+import plextvcache
 
 import util
 
 ACCOUNT = None
 
+HOME_USERS_KEY = 'homeUsers.{0}'  # by account ID
+
 
 class HomeUser(util.AttributeDict):
     pass
@@ -45,7 +47,6 @@ class MyPlexAccount(object):
 
         self.adminHasPlexPass = False
 
-        self.lastHomeUserUpdate = None
         self.homeUsers = []
 
     def init(self):
@@ -144,17 +145,7 @@ class MyPlexAccount(object):
 
             # update the list of users in the home
             self.updateHomeUsers()
-
-            # set admin attribute for the user
-            self.isAdmin = False
-            if self.homeUsers:
-                for user in self.homeUsers:
-                    if self.ID == user.id:
-                        self.isAdmin = str(user.admin) == "1"
-                        break
-
-            if self.isAdmin and self.isPlexPass:
-                self.adminHasPlexPass = True
+            self.updateAdmin()
 
             # consider a single, unprotected user authenticated
             if not self.isAuthenticated and not self.isProtected and len(self.homeUsers) <= 1:
@@ -195,7 +186,6 @@ class MyPlexAccount(object):
         self.email = None
         self.authToken = None
         self.pin = None
-        self.lastHomeUserUpdate = None
 
         # Booleans
         self.isSignedIn = False
@@ -205,8 +195,9 @@ class MyPlexAccount(object):
         self.isSecure = False
         self.isExpired = expired
 
-        # Clear the saved resources
+        # Clear the saved resources and home users
         plexapp.INTERFACE.clearRegistry("mpaResources", "xml_cache")
+        plextvcache.CACHE.clear()
 
         # Remove all saved servers
         plexapp.SERVERMANAGER.clearServers()
@@ -246,33 +237,69 @@ class MyPlexAccount(object):
             if self.isOffline:
                 self.homeUsers.append(MyPlexAccount())
 
-            self.lastHomeUserUpdate = None
             return
 
-        # Cache home users for 60 seconds, mainly to stop back to back tests
-        epoch = time.time()
-        if not self.lastHomeUserUpdate:
-            self.lastHomeUserUpdate = epoch
-        elif self.lastHomeUserUpdate + 60 > epoch:
-            util.DEBUG_LOG("Skipping home user update (updated {0} seconds ago)".format(epoch - self.lastHomeUserUpdate))
-            return
+        # Use the cached list if we have one, a stale list is refreshed in the background
+        # A background refresh that runs after we've switched to another account is dropped,
+        # it would fetch with that account's token
+        ID = self.ID
+
+        def fetch():
+            if self.ID == ID:
+                return self.fetchHomeUsers()
 
+        def onRefreshed(xml):
+            if self.ID == ID:
+                self.onHomeUsersRefreshed(xml)
+
+        xml = plextvcache.CACHE.fetch(HOME_USERS_KEY.format(ID), plextvcache.HOME_USERS_TTL, fetch, onRefreshed)
+        if xml:
+            self.setHomeUsers(xml)
+
+    def fetchHomeUsers(self):
         req = myplexrequest.MyPlexRequest("/api/home/users")
-        xml = req.getToStringWithTimeout()
-        data = ElementTree.fromstring(xml)
+        return req.getToStringWithTimeout()
+
+    def onHomeUsersRefreshed(self, xml):
+        if not self.isSignedIn:
+            return
+
+        self.setHomeUsers(xml)
+        self.updateAdmin()
+        plexapp.APP.trigger("change:homeUsers", account=self)
+
+    def setHomeUsers(self, xml):
+        try:
+            data = ElementTree.fromstring(xml.encode('utf-8'))
+        except ElementTree.ParseError:
+            util.ERROR()
+            return
+
         if data.attrib.get('size') and data.find('User') is not None:
-            self.homeUsers = []
+            homeUsers = []
             for user in data.findall('User'):
                 homeUser = HomeUser(user.attrib)
                 homeUser.isAdmin = homeUser.admin == "1"
                 homeUser.isManaged = homeUser.restricted == "1"
                 homeUser.isProtected = homeUser.protected == "1"
-                self.homeUsers.append(homeUser)
+                homeUsers.append(homeUser)
 
-            self.lastHomeUserUpdate = epoch
+            self.homeUsers = homeUsers
 
         util.LOG("home users: {0}".format(self.homeUsers))
 
+    def updateAdmin(self):
+        # set admin attribute for the user
+        self.isAdmin = False
+        if self.homeUsers:
+            for user in self.homeUsers:
+                if self.ID == user.id:
+                    self.isAdmin = str(user.admin) == "1"
+                    break
+
+        if self.isAdmin and self.isPlexPass:
+            self.adminHasPlexPass = True
+
     def switchHomeUser(self, userId, pin=''):
         if userId == self.ID and self.isAuthenticated:
             return True
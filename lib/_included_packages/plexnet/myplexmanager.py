@@ -5,6 +5,8 @@ import plexapp
 import plexconnection
 import plexserver
 import myplexrequest
+import plextvcache
+import plexresult
 import callback
 import util
 
@@ -27,31 +29,55 @@ class MyPlexManager(object):
         if force:
             plexapp.SERVERMANAGER.resetLastTest()
 
+        # Hand the server manager whatever we have cached for this user straight away, only go
+        # to plex.tv if it's stale or we were asked to.
+        cached, age = plextvcache.CACHE.get(self.resourcesKey())
+        if cached is not None:
+            util.DEBUG_LOG("Using cached resources ({0:.0f}s old)".format(age))
+            self.updateFromResources(self.parseCachedResources(cached))
+            if not force and age < plextvcache.RESOURCES_TTL:
+                return
+
         request = myplexrequest.MyPlexRequest("/pms/resources")
         context = request.createRequestContext("resources", callback.Callable(self.onResourcesResponse))
+        context.cached = cached
 
         if plexapp.ACCOUNT.isSecure:
             request.addParam("includeHttps", "1")
 
         plexapp.APP.startRequest(request, context)
 
-    def onResourcesResponse(self, request, response, context):
-        servers = []
+    def resourcesKey(self):
+        return 'resources.{0}'.format(plexapp.ACCOUNT.ID)
 
+    def onResourcesResponse(self, request, response, context):
         response.parseResponse()
 
         # Save the last successful response to cache
         if response.isSuccess() and response.event:
-            plexapp.INTERFACE.setRegistry("mpaResources", response.event.text.encode('utf-8'), "xml_cache")
-            util.DEBUG_LOG("Saved resources response to registry")
-        # Load the last successful response from cache
-        elif plexapp.INTERFACE.getRegistry("mpaResources", None, "xml_cache"):
-            data = ElementTree.fromstring(plexapp.INTERFACE.getRegistry("mpaResources", None, "xml_cache"))
-            response.parseFakeXMLResponse(data)
-            util.DEBUG_LOG("Using cached resources")
-
-        if response.container:
-            for resource in response.container:
+            plextvcache.CACHE.put(self.resourcesKey(), response.event.text)
+            util.DEBUG_LOG("Saved resources response to cache")
+
+            if response.event.text == context.cached:
+                util.DEBUG_LOG("Resources unchanged since the cached copy")
+                return
+        elif context.cached is not None:
+            util.DEBUG_LOG("Resources request failed, keeping the cached resources")
+            return
+
+        self.updateFromResources(response.container)
+
+    def parseCachedResources(self, cached):
+        import myplexserver
+        result = plexresult.PlexServerResult(myplexserver.MyPlexServer(), "/pms/resources")
+        result.parseFakeXMLResponse(ElementTree.fromstring(cached.encode('utf-8')))
+        return result.container
+
+    def updateFromResources(self, container):
+        servers = []
+
+        if container is not None:
+            for resource in container:
                 util.DEBUG_LOG(
                     "Parsed resource from plex.tv: type:{0} clientIdentifier:{1} name:{2} product:{3} provides:{4}".format(
                         resource.type,
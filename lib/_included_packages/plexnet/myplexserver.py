@@ -4,6 +4,9 @@ import plexserver
 import plexresource
 import plexservermanager
 
+# Overridable so plex.tv can be swapped for a local stand-in
+BASE_URL = 'https://plex.tv'
+
 
 class MyPlexServer(plexserver.PlexServer):
     TYPE = 'MYPLEXSERVER'
@@ -12,7 +15,7 @@ class MyPlexServer(plexserver.PlexServer):
         plexserver.PlexServer.__init__(self)
         self.uuid = 'myplex'
         self.name = 'plex.tv'
-        conn = plexconnection.PlexConnection(plexresource.ResourceConnection.SOURCE_MYPLEX, "https://plex.tv", False, None)
+        conn = plexconnection.PlexConnection(plexresource.ResourceConnection.SOURCE_MYPLEX, BASE_URL, False, None)
         self.connections.append(conn)
         self.activeConnection = conn
 
@@ -33,3 +36,8 @@ class MyPlexServer(plexserver.PlexServer):
                     return url
 
         return plexserver.PlexServer.buildUrl(self, path, includeToken)
+
+
+def setBaseURL(url):
+    global BASE_URL
+    BASE_URL = url.rstrip('/')
@@ -188,6 +188,11 @@ class NowPlayingManager(object):
             if params[paramKey]:
                 path = http.addUrlParam(path, paramKey + "=" + urllib.quote(str(params[paramKey])))
 
+        if timeline.state == 'stopped':
+            # Progress and watched state changed, which cached section listings don't validate against
+            import metadatacache
+            metadatacache.CACHE.invalidate(timeline.item.getServer().uuid, '/library/sections/')
+
         request = plexrequest.PlexRequest(timeline.item.getServer(), path)
         context = request.createRequestContext("timelineUpdate", callback.Callable(self.onTimelineResponse))
         context.playQueue = timeline.playQueue
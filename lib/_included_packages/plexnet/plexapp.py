@@ -3,6 +3,7 @@ import platform
 import uuid
 import sys
 import callback
+import threadutils
 
 import signalsmixin
 import simpleobjects
@@ -29,6 +30,7 @@ def init():
     import myplexmanager
     MANAGER = myplexmanager.MANAGER
     ACCOUNT.init()
+    SERVERMANAGER.warmStart()
 
 
 class App(signalsmixin.SignalsMixin):
@@ -100,7 +102,14 @@ class App(signalsmixin.SignalsMixin):
 
     def preShutdown(self):
         import http
+        import asyncadapter
+        import metadatacache
+        import plextvcache
+        import profiler
+        import imageprofiles
+        import gdm
         http.HttpRequest._cancel = True
+        gdm.DISCOVERY.close()
         if self.pendingRequests:
             util.DEBUG_LOG('Closing down {0} App() requests...'.format(len(self.pendingRequests)))
             for p in self.pendingRequests.values():
@@ -115,7 +124,20 @@ class App(signalsmixin.SignalsMixin):
             util.DEBUG_LOG('Closing server...')
             SERVERMANAGER.selectedServer.close()
 
+        http.SESSIONS.logStats()
+        http.INFLIGHT.logStats()
+        threadutils.EXECUTOR.logStats()
+        asyncadapter.logStats(util.DEBUG_LOG)
+
+        plextvcache.CACHE.logStats()
+        metadatacache.CACHE.save()
+        metadatacache.CACHE.logStats()
+        imageprofiles.REGISTRY.logStats()
+        profiler.PROFILER.flush()
+
     def shutdown(self):
+        threadutils.EXECUTOR.shutdown()
+
         if self.timers:
             util.DEBUG_LOG('Waiting for {0} App() timers: Started'.format(len(self.timers)))
 
@@ -462,6 +484,16 @@ def setAbortFlagFunction(func):
     asyncadapter.ABORT_FLAG_FUNCTION = func
 
 
+def setConnectEngine(selector):
+    import asyncadapter
+    asyncadapter.setEngine(selector)
+
+
+def setResponseDecoder(name):
+    import responsedecoder
+    responsedecoder.setDefaultDecoder(name)
+
+
 def refreshResources(force=False):
     import gdm
     gdm.DISCOVERY.discover()
@@ -1,4 +1,7 @@
 import random
+import time
+import json
+import threading
 
 import http
 import plexapp
@@ -15,6 +18,73 @@ class ConnectionSource(int):
         return self.name
 
 
+class ConnectionHistory(object):
+    """
+    Exponentially weighted RTT and success rate per connection address, so the
+    connections that answered quickly last time are tested first and preferred.
+    Saved to the registry next to the PlexServerManager state.
+    """
+
+    ALPHA = 0.3  # weight of the newest sample
+    RTT_REFERENCE = 0.25  # an RTT this long halves the history bonus
+    MAX_ENTRIES = 100
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()  # Connections are tested, and the state saved, from several threads
+
+    def get(self, address):
+        with self.lock:
+            entry = self.entries.get(address)
+            return entry and dict(entry)
+
+    def record(self, address, elapsed, success):
+        with self.lock:
+            entry = self.entries.get(address)
+            if not entry:
+                entry = self.entries[address] = {'rtt': None, 'success': float(success)}
+            else:
+                entry['success'] += self.ALPHA * (float(success) - entry['success'])
+
+            if success:
+                if entry['rtt'] is None:
+                    entry['rtt'] = elapsed
+                else:
+                    entry['rtt'] += self.ALPHA * (elapsed - entry['rtt'])
+
+            entry['tested'] = int(time.time())
+
+    def bonus(self, address):
+        """ Between 0 and 1. Connections we know nothing about sit in the middle. """
+        with self.lock:
+            entry = self.entries.get(address)
+            if not entry:
+                return 0.5
+
+            rtt = entry['rtt']
+            speed = rtt is not None and self.RTT_REFERENCE / (self.RTT_REFERENCE + rtt) or 0
+            return entry['success'] * speed
+
+    def load(self, jstring):
+        try:
+            entries = json.loads(jstring or '{}')
+        except ValueError:
+            util.ERROR()
+            entries = {}
+
+        with self.lock:
+            self.entries = entries
+
+    def serialize(self):
+        with self.lock:
+            # Only keep the most recently tested addresses
+            addresses = sorted(self.entries, key=lambda a: self.entries[a].get('tested', 0), reverse=True)
+            return json.dumps(dict((a, self.entries[a]) for a in addresses[:self.MAX_ENTRIES]))
+
+
+HISTORY = ConnectionHistory()
+
+
 class PlexConnection(object):
     # Constants
     STATE_UNKNOWN = "unknown"
@@ -34,6 +104,7 @@ class PlexConnection(object):
     SCORE_REACHABLE = 4
     SCORE_LOCAL = 2
     SCORE_SECURE = 1
+    SCORE_HISTORY = 0.9  # scaled by the history bonus, so it only orders connections within a class
 
     SOURCE_BY_VAL = {
         1: SOURCE_MANUAL,
@@ -135,7 +206,7 @@ class PlexConnection(object):
                 server.activeConnection.isSecure
             ):
                 util.DEBUG_LOG("Invalid insecure connection test in progress")
-            self.request = http.HttpRequest(self.buildUrl(server, "/"))
+            self.request = http.HttpRequest(self.buildUrl(server, "/"), serverUuid=server.uuid)
             context = self.request.createRequestContext("reachability", callback.Callable(self.onReachabilityResponse))
             context.server = server
             util.addPlexHeaders(self.request, server.getToken())
@@ -149,7 +220,29 @@ class PlexConnection(object):
             self.request.ignoreResponse = True
             self.request.cancel()
 
+    def abandonReachability(self):
+        # Another connection won the race, so drop our test without a result. We
+        # stay untested so the next reachability update will try us again.
+        request = self.request
+        self.request = None
+        self.hasPendingRequest = False
+        self.lastTestedAt = 0
+        if request:
+            request.ignoreResponse = True
+            request.cancel()
+
+    def getPotentialScore(self):
+        # The score we'd have if our pending test came back reachable
+        return (
+            self.SCORE_REACHABLE + (self.isSecure and self.SCORE_SECURE or 0) + (self.isLocal and self.SCORE_LOCAL or 0) +
+            self.SCORE_HISTORY * HISTORY.bonus(self.address)
+        )
+
     def onReachabilityResponse(self, request, response, context):
+        if request is not self.request:
+            # Abandoned after another connection won the race
+            return
+
         self.hasPendingRequest = False
         # It's possible we may have a result pending before we were able
         # to cancel it, so we'll just ignore it.
@@ -170,6 +263,11 @@ class PlexConnection(object):
         else:
             self.state = self.STATE_UNREACHABLE
 
+        # From when the request went out, not when it was queued behind other tests
+        rtt = request.roundTrip()
+        if rtt is not None:
+            HISTORY.record(self.address, rtt, self.state == self.STATE_REACHABLE)
+
         self.getScore(True)
 
         context.server.onReachabilityResult(self)
@@ -209,5 +307,6 @@ class PlexConnection(object):
                 self.score += self.SCORE_SECURE
             if self.isLocal:
                 self.score += self.SCORE_LOCAL
+            self.score += self.SCORE_HISTORY * HISTORY.bonus(self.address)
 
         return self.score
@@ -2,6 +2,8 @@
 """
 PlexLibrary
 """
+import time
+
 import plexobjects
 import playlist
 import media
@@ -9,6 +11,8 @@ import exceptions
 import util
 import signalsmixin
 
+VALIDATOR_TTL = 30  # seconds a section's updatedAt/contentChangedAt is trusted before it's read again
+
 
 class Library(plexobjects.PlexObject):
     def __repr__(self):
@@ -127,7 +131,39 @@ class LibrarySection(plexobjects.PlexObject):
 
         return plexobjects.PlexObject.getAbsolutePath(self, key)
 
-    def all(self, start=None, size=None, filter_=None, sort=None, unwatched=False, type_=None):
+    def cacheValidator(self):
+        """
+        Changes whenever the section's contents do, so cached listings stored against it are
+        still current. The section is read again once VALIDATOR_TTL has passed, our copy is
+        only loaded with the server. None if that fails, so nothing is used unrevalidated.
+        """
+        if not self.refreshValidator():
+            return None
+
+        return '{0}:{1}'.format(self.get('updatedAt', ''), self.get('contentChangedAt', ''))
+
+    def refreshValidator(self):
+        if time.time() - self.__dict__.get('_validatorReadAt', 0) < VALIDATOR_TTL:
+            return True
+
+        try:
+            data = self.server.query('/library/sections')
+        except exceptions.BadRequest:
+            data = None
+
+        if data is None:
+            return False
+
+        for elem in data:
+            if elem.attrib.get('key') == self.key:
+                self.set('updatedAt', elem.attrib.get('updatedAt', ''))
+                self.set('contentChangedAt', elem.attrib.get('contentChangedAt', ''))
+                self._validatorReadAt = time.time()
+                return True
+
+        return False
+
+    def all(self, start=None, size=None, filter_=None, sort=None, unwatched=False, type_=None, stream=False, cache=False):
         if self.key.startswith('/'):
             path = '{0}/all'.format(self.key)
         else:
@@ -154,7 +190,9 @@ class LibrarySection(plexobjects.PlexObject):
         if args:
             path += util.joinArgs(args)
 
-        return plexobjects.listItems(self.server, path)
+        # The validator doesn't follow watched state, so what unwatched filters out can't be cached
+        cache = cache and not unwatched
+        return plexobjects.listItems(self.server, path, stream=stream, cache=cache, validator=cache and self.cacheValidator() or None)
 
     def jumpList(self, filter_=None, sort=None, unwatched=False, type_=None):
         if self.key.startswith('/'):
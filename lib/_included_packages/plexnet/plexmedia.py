@@ -1,3 +1,5 @@
+import threading
+
 import locks
 import http
 import plexobjects
@@ -5,6 +7,9 @@ import plexpart
 import plexrequest
 import util
 
+# Guards publishing the lazily built parts
+BUILD_LOCK = threading.Lock()
+
 
 class PlexMedia(plexobjects.PlexObject):
     def __init__(self, data, initpath=None, server=None, container=None):
@@ -13,10 +18,29 @@ class PlexMedia(plexobjects.PlexObject):
         self.container_ = self.get('container')
         self.container = container
         self.indirectHeaders = None
-        self.parts = []
-        # If we weren't given any data, this is a synthetic media
-        if data is not None:
-            self.parts = [plexpart.PlexPart(elem, initpath=self.initpath, server=self.server, media=self) for elem in data]
+        # If we weren't given any data, this is a synthetic media. Otherwise keep the
+        # raw element around and only build the parts when something asks for them.
+        self._partsData = data
+        self._parts = None
+
+    @property
+    def parts(self):
+        if self._parts is None:
+            # Built outside the lock and only kept if no other thread got there first, so
+            # everyone ends up with the same list
+            data = self._partsData
+            parts = data is not None and [plexpart.PlexPart(elem, initpath=self.initpath, server=self.server, media=self) for elem in data] or []
+            with BUILD_LOCK:
+                if self._parts is None:
+                    self._parts = parts
+                    self._partsData = None
+
+        return self._parts
+
+    @parts.setter
+    def parts(self, value):
+        self._parts = value
+        self._partsData = None
 
     def get(self, key, default=None):
         return self._data.get(key, default)
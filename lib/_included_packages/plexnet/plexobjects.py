@@ -3,6 +3,8 @@ from datetime import datetime
 import exceptions
 import util
 import plexapp
+import metadatacache
+import profiler
 import json
 
 # Search Types - Plex uses these to filter specific media types when searching.
@@ -31,6 +33,16 @@ def registerLibFactory(ftype):
     return wrap
 
 
+_CLASS_ATTRS = {}
+
+
+def _classAttrs(cls):
+    names = _CLASS_ATTRS.get(cls)
+    if names is None:
+        names = _CLASS_ATTRS[cls] = frozenset(dir(cls))
+    return names
+
+
 class PlexValue(unicode):
     def __new__(cls, value, parent=None):
         self = super(PlexValue, cls).__new__(cls, value)
@@ -137,6 +149,10 @@ class Checks:
 
 
 class PlexObject(object, Checks):
+    # Raw attribute strings from the XML element. Values are only wrapped in a
+    # PlexValue when first accessed (see __getattr__). Never mutated in place.
+    _attrs = {}
+
     def __init__(self, data, initpath=None, server=None, container=None):
         self.initpath = initpath
         self.key = None
@@ -159,19 +175,47 @@ class PlexObject(object, Checks):
             return
 
         self.name = data.tag
-        for k, v in data.attrib.items():
-            setattr(self, k, PlexValue(v, self))
+        attrib = data.attrib
 
-    def __getattr__(self, attr):
-        a = PlexValue('', self)
-        a.NA = True
+        if self._attrs:
+            attrs = self._attrs.copy()
+            attrs.update(attrib)
+            self._attrs = attrs
+        else:
+            self._attrs = attrib
 
-        try:
-            setattr(self, attr, a)
-        except AttributeError:
-            util.LOG('Failed to set attribute: {0} ({1})'.format(attr, self.__class__))
+        # New data replaces anything already set or materialized on the instance
+        d = self.__dict__
+        for k in [k for k in d if k in attrib]:
+            del d[k]
 
-        return a
+        # Attributes shadowed by class attributes would never reach __getattr__
+        shadowed = _classAttrs(self.__class__)
+        for k in attrib:
+            if k in shadowed:
+                setattr(self, k, PlexValue(attrib[k], self))
+
+    def __getattr__(self, attr):
+        if attr in self._attrs:
+            a = PlexValue(self._attrs[attr], self)
+            self.__dict__[attr] = a
+            return a
+
+        na = self.__dict__.get('_na')
+        if na is None:
+            na = self.__dict__['_na'] = PlexValue('', self)
+            na.NA = True
+
+        return na
+
+    def __delattr__(self, attr):
+        if attr in self._attrs:
+            attrs = self._attrs.copy()
+            del attrs[attr]
+            self._attrs = attrs
+            self.__dict__.pop(attr, None)
+        else:
+            object.__delattr__(self, attr)
 
     def exists(self):
         # Used for media items - for others we just return True
@@ -179,6 +223,8 @@ class PlexObject(object, Checks):
 
     def get(self, attr, default=''):
         ret = self.__dict__.get(attr)
+        if ret is None and attr in self._attrs:
+            ret = getattr(self, attr)
         return ret is not None and ret or PlexValue(default, self)
 
     def set(self, attr, value):
@@ -199,11 +245,11 @@ class PlexObject(object, Checks):
 
     @property
     def defaultThumb(self):
-        return self.__dict__.get('thumb') and self.thumb or PlexValue('', self)
+        return self.get('thumb')
 
     @property
     def defaultArt(self):
-        return self.__dict__.get('art') and self.art or PlexValue('', self)
+        return self.get('art')
 
     def refresh(self):
         import requests
@@ -216,9 +262,9 @@ class PlexObject(object, Checks):
 
         try:
             if self.get('ratingKey'):
-                data = self.server.query('/library/metadata/{0}'.format(self.ratingKey), params=kwargs)
+                data = self.server.query('/library/metadata/{0}'.format(self.ratingKey), cache=True, params=kwargs)
             else:
-                data = self.server.query(self.key, params=kwargs)
+                data = self.server.query(self.key, cache=True, params=kwargs)
             self._reloaded = True
         except Exception, e:
             import traceback
@@ -248,6 +294,12 @@ class PlexObject(object, Checks):
 
         return ID
 
+    def invalidateSectionCache(self):
+        """ Drop cached listings of our library section, e.g. after our watched state changed. """
+        ID = self.getLibrarySectionId()
+        if ID and self.server:
+            metadatacache.CACHE.invalidate(self.server.uuid, '/library/sections/{0}/'.format(ID))
+
     def getLibrarySectionTitle(self):
         title = self.get('librarySectionTitle')
 
@@ -374,8 +426,9 @@ class PlexObject(object, Checks):
         import json
         odict = {}
         if full:
+            odict.update(self._attrs)
             for k, v in self.__dict__.items():
-                if k not in ('server', 'container', 'media', 'initpath', '_data') and v:
+                if k not in ('server', 'container', 'media', 'initpath', '_data', '_attrs', '_na') and v:
                     odict[k] = v
         else:
             odict['key'] = self.key
@@ -499,7 +552,8 @@ def buildItem(server, elem, initpath, bytag=False, container=None, tag_fallback=
 
     if libtype in LIBRARY_TYPES:
         cls = LIBRARY_TYPES[libtype]
-        return cls(elem, initpath=initpath, server=server, container=container)
+        with profiler.span('buildItem'):
+            return cls(elem, initpath=initpath, server=server, container=container)
     raise exceptions.UnknownType('Unknown library type: {0}'.format(libtype))
 
 
@@ -512,11 +566,27 @@ class ItemContainer(list):
         return self
 
 
-def listItems(server, path, libtype=None, watched=None, bytag=False, data=None, container=None):
-    data = data if data is not None else server.query(path)
-    container = container or PlexContainer(data, path, server, path)
-    items = ItemContainer().init(container)
+class ItemStream(object):
+    """ Streamed counterpart to ItemContainer. Items are built one at a time as iteration reaches them. """
+
+    def __init__(self, container, items, data=None):
+        self.container = container
+        self._items = items
+        self._data = data
+
+    def __iter__(self):
+        return self._items
+
+    def __getattr__(self, attr):
+        return getattr(self.container, attr)
 
+    def close(self):
+        self._items.close()
+        if self._data is not None:
+            self._data.close()
+
+
+def _iterItems(server, path, data, container, libtype=None, watched=None, bytag=False):
     for elem in data:
         if libtype and elem.attrib.get('type') != libtype:
             continue
@@ -525,10 +595,28 @@ def listItems(server, path, libtype=None, watched=None, bytag=False, data=None,
         if watched is False and elem.attrib.get('viewCount', 0) >= 1:
             continue
         try:
-            items.append(buildItem(server, elem, path, bytag, container))
+            yield buildItem(server, elem, path, bytag, container)
         except exceptions.UnknownType:
             pass
 
+
+def listItems(server, path, libtype=None, watched=None, bytag=False, data=None, container=None, stream=False, cache=False, validator=None):
+    """
+    Build the items for the container at path. With stream=True the response is
+    parsed incrementally and an ItemStream is returned that builds each item as
+    soon as its element has arrived. cache and validator are passed on to the
+    server query (see PlexServer.query).
+    """
+    if stream:
+        data = data if data is not None else server.queryStream(path, cache=cache, validator=validator)
+        container = container or PlexContainer(data.root if data is not None else None, path, server, path)
+        return ItemStream(container, _iterItems(server, path, data or (), container, libtype, watched, bytag), data)
+
+    data = data if data is not None else server.query(path, cache=cache, validator=validator)
+    container = container or PlexContainer(data, path, server, path)
+    items = ItemContainer().init(container)
+    items.extend(_iterItems(server, path, data, container, libtype, watched, bytag))
+
     return items
 
 
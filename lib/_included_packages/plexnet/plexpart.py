@@ -1,8 +1,13 @@
+import threading
+
 import plexobjects
 import plexstream
 import plexrequest
 import util
 
+# Guards publishing the lazily built streams
+BUILD_LOCK = threading.Lock()
+
 
 class PlexPart(plexobjects.PlexObject):
     def reload(self):
@@ -12,17 +17,38 @@ class PlexPart(plexobjects.PlexObject):
         plexobjects.PlexObject.__init__(self, data, initpath, server)
         self.container_ = self.container
         self.container = media
-        self.streams = []
 
-        # If we weren't given any data, this is a synthetic part
+        # If we weren't given any data, this is a synthetic part. Streams are only
+        # needed for playback decisions, so they're built on first access.
+        self._streamsData = data
+        self._streams = None
+
         if data is not None:
-            self.streams = [plexstream.PlexStream(e, initpath=self.initpath, server=self.server) for e in data if e.tag == 'Stream']
             if self.indexes:
                 indexKeys = self.indexes('').split(",")
                 self.indexes = util.AttributeDict()
                 for indexKey in indexKeys:
                     self.indexes[indexKey] = True
 
+    @property
+    def streams(self):
+        if self._streams is None:
+            # Built outside the lock and only kept if no other thread got there first, so
+            # everyone ends up with the same list
+            data = self._streamsData
+            streams = data is not None and [plexstream.PlexStream(e, initpath=self.initpath, server=self.server) for e in data if e.tag == 'Stream'] or []
+            with BUILD_LOCK:
+                if self._streams is None:
+                    self._streams = streams
+                    self._streamsData = None
+
+        return self._streams
+
+    @streams.setter
+    def streams(self, value):
+        self._streams = value
+        self._streamsData = None
+
     def getAddress(self):
         address = self.key
 
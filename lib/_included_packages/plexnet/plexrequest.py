@@ -1,34 +1,45 @@
-from xml.etree import ElementTree
-
 import plexserver
 import plexresult
+import responsedecoder
 import http
 import util
 
 
 class PlexRequest(http.HttpRequest):
-    def __init__(self, server, path, method=None):
+    def __init__(self, server, path, method=None, decoder=None):
         server = server or plexserver.dummyPlexServer()
 
-        http.HttpRequest.__init__(self, server.buildUrl(path, includeToken=True), method)
+        http.HttpRequest.__init__(self, server.buildUrl(path, includeToken=True), method, serverUuid=server.uuid)
 
         self.server = server
         self.path = path
+        self.coalesce = True
 
         util.addPlexHeaders(self, server.getToken())
+        self.setDecoder(decoder)
+
+    def setDecoder(self, decoder=None):
+        self.decoder = responsedecoder.getDecoder(decoder).NAME
+        accept = responsedecoder.getDecoder(self.decoder).ACCEPT
+        if accept:
+            self.addHeader("Accept", accept)
+        else:
+            self.headers.pop("Accept", None)
 
     def onResponse(self, event, context):
         if context.get('completionCallback'):
             result = plexresult.PlexResult(self.server, self.path)
             result.setResponse(event)
+            result.decoder = self.decoder
             context['completionCallback'](self, result, context)
 
     def doRequestWithTimeout(self, timeout=10, postBody=None):
         # non async request/response
+        decoder = responsedecoder.getDecoder(self.decoder)
         if postBody:
-            data = ElementTree.fromstring(self.postToStringWithTimeout(postBody, timeout))
+            data = decoder.fromstring(self.postToStringWithTimeout(postBody, timeout))
         else:
-            data = ElementTree.fromstring(self.getToStringWithTimeout(timeout))
+            data = decoder.fromstring(self.getToStringWithTimeout(timeout))
 
         response = plexresult.PlexResult(self.server, self.path)
         response.setResponse(self.event)
@@ -42,4 +53,5 @@ class PlexServerRequest(PlexRequest):
         if context.get('completionCallback'):
             result = plexresult.PlexServerResult(self.server, self.path)
             result.setResponse(event)
+            result.decoder = self.decoder
             context['completionCallback'](self, result, context)
@@ -1,3 +1,4 @@
+import hashlib
 from xml.etree import ElementTree
 
 import http
@@ -6,7 +7,7 @@ import plexobjects
 import plexconnection
 import util
 
-RESOURCES = 'https://plex.tv/api/resources?includeHttps=1'
+RESOURCES = '/api/resources?includeHttps=1'
 
 
 class PlexResource(object):
@@ -169,11 +170,24 @@ class PlexResourceList(plexobjects.PlexItemList):
 
 
 def fetchResources(token):
-    headers = util.BASE_HEADERS.copy()
-    headers['X-Plex-Token'] = token
-    util.LOG('GET {0}?X-Plex-Token={1}'.format(RESOURCES, util.hideToken(token)))
-    response = http.GET(RESOURCES)
-    data = ElementTree.fromstring(response.text.encode('utf8'))
+    import myplexserver
+    import plextvcache
+
+    url = myplexserver.BASE_URL + RESOURCES
+
+    def fetch():
+        headers = util.BASE_HEADERS.copy()
+        headers['X-Plex-Token'] = token
+        util.LOG('GET {0}?X-Plex-Token={1}'.format(url, util.hideToken(token)))
+        response = http.GET(url)
+        return response.ok and response.text or None
+
+    key = 'resources.{0}'.format(hashlib.sha1(token).hexdigest())
+    xml = plextvcache.CACHE.fetch(key, plextvcache.RESOURCES_TTL, fetch)
+    if not xml:
+        return []
+
+    data = ElementTree.fromstring(xml.encode('utf8'))
     import plexserver
     return [plexserver.PlexServer(elem) for elem in data]
 
@@ -7,18 +7,22 @@ import compat
 import verlib
 import re
 import json
-from xml.etree import ElementTree
 
 import signalsmixin
 import plexobjects
 import plexresource
 import plexlibrary
 import plexapp
+import responsedecoder
+import metadatacache
+import profiler
+import imageprofiles
 # from plexapi.client import Client
 # from plexapi.playqueue import PlayQueue
 
 
 TOTAL_QUERIES = 0
+WATCH_STATE_PATHS = ('/:/scrobble', '/:/unscrobble')
 DEFAULT_BASEURI = 'http://localhost:32400'
 
 
@@ -41,15 +45,16 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         self.allowChannelAccess = False
         self.activeConnection = None
         self.serverClass = None
+        self.rootData = None
 
         self.pendingReachabilityRequests = 0
         self.pendingSecureRequests = 0
+        self.reachabilityStartedAt = None
 
         self.features = {}
         self.librariesByUuid = {}
 
         self.server = self
-        self.session = http.Session()
 
         self.owner = None
         self.owned = False
@@ -94,7 +99,13 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         return self.__str__()
 
     def close(self):
-        self.session.cancel()
+        http.SESSIONS.closeServer(self.uuid)
+
+    @property
+    def session(self):
+        # Shared keep-alive session for the active connection
+        address = self.activeConnection and self.activeConnection.address or DEFAULT_BASEURI
+        return http.SESSIONS.getSession(address, self.uuid)
 
     def get(self, attr, default=None):
         return default
@@ -108,7 +119,8 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         data = self.query(key)
         return plexobjects.buildItem(self, data[0], key, container=self)
 
-    def hubs(self, section=None, count=None, search_query=None):
+    def hubs(self, section=None, count=None, search_query=None, cache=False):
+        """ With cache=True unchanged hubs are revalidated with a conditional GET instead of fetched again. """
         hubs = []
 
         params = {}
@@ -137,7 +149,7 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             if count is not None:
                 params['count'] = count
 
-        data = self.query(q, params=params)
+        data = self.query(q, params=params, cache=cache)
         container = plexobjects.PlexContainer(data, initpath=q, server=self, address=q)
 
         for elem in data:
@@ -164,26 +176,169 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             util.WARN_LOG("Server connection is None, returning an empty url")
             return ""
 
-    def query(self, path, method=None, **kwargs):
+    def _request(self, path, method=None, **kwargs):
         method = method or self.session.get
         url = self.buildUrl(path, includeToken=True)
         util.LOG('{0} {1}'.format(method.__name__.upper(), re.sub('X-Plex-Token=[^&]+', 'X-Plex-Token=****', url)))
-        try:
+        with profiler.span('http.send'):
             response = method(url, **kwargs)
-            if response.status_code not in (200, 201):
-                codename = http.status_codes.get(response.status_code, ['Unknown'])[0]
-                raise exceptions.BadRequest('({0}) {1}'.format(response.status_code, codename))
-            data = response.text.encode('utf8')
+        if response.status_code not in (200, 201, 304):
+            response.close()
+            codename = http.status_codes.get(response.status_code, ['Unknown'])[0]
+            raise exceptions.BadRequest('({0}) {1}'.format(response.status_code, codename))
+
+        return response
+
+    def _cachedRequest(self, path, decoder, validator, **kwargs):
+        """
+        Returns a (body, response) tuple for a GET that goes through the metadata cache.
+        body is set when the cached copy can be used - either because it was stored
+        against the same validator and the server confirmed it within
+        metadatacache.VALIDATOR_MAX_AGE, or because the server answered a conditional
+        GET with 304. Otherwise response is the fresh response, or None on connection errors.
+        """
+        cache = metadatacache.CACHE
+        key = cache.key(self.uuid, path, kwargs.get('params'), self.getToken())
+        entry = cache.get(key)
+
+        if entry and entry.decoder == decoder.NAME:
+            if validator is not None and entry.validator == validator and entry.confirmedWithin(metadatacache.VALIDATOR_MAX_AGE):
+                body = cache.load(entry)
+                if body is not None:
+                    return body, None
+
+            conditional = entry.conditionalHeaders()
+            if conditional:
+                kwargs['headers'] = dict(kwargs.get('headers') or {}, **conditional)
+        else:
+            entry = None
+
+        try:
+            response = self._request(path, **kwargs)
+        except http.requests.ConnectionError:
+            util.ERROR()
+            return None, None
+
+        if response.status_code == 304:
+            response.close()
+            body = entry and cache.load(entry, revalidated=True)
+            if body:
+                cache.update(entry, validator)
+                return body, None
+
+            # The cached copy disappeared under us, so ask again unconditionally
+            kwargs['headers'] = dict((k, v) for k, v in (kwargs.get('headers') or {}).items() if not k.startswith('If-'))
+            try:
+                response = self._request(path, **kwargs)
+            except http.requests.ConnectionError:
+                util.ERROR()
+                return None, None
+
+        return None, response
+
+    def _cacheResponse(self, path, response, body, decoder, validator, params=None):
+        etag = response.headers.get('ETag')
+        lastModified = response.headers.get('Last-Modified')
+
+        # Nothing to revalidate against means nothing worth caching
+        if validator is None and not etag and not lastModified:
+            return
+
+        key = metadatacache.CACHE.key(self.uuid, path, params, self.getToken())
+        metadatacache.CACHE.store(key, body, etag, lastModified, validator, decoder.NAME)
+
+    def query(self, path, method=None, decoder=None, cache=False, validator=None, **kwargs):
+        """
+        With cache=True plain GETs go through the persistent metadata cache.
+        A cached copy stored against the same validator (e.g. a section's updatedAt)
+        is used without a request, otherwise it's revalidated with a conditional GET.
+
+        Identical GETs issued while one is already in flight share its round trip
+        and parsed result, each getting its own copy of it. A GET sent after a write
+        to this server doesn't share one sent before it.
+        """
+        with profiler.span('PlexServer.query'):
+            if http.WriteEpochs.isWrite(method and method.__name__.upper(), path):
+                http.WRITES.bump(self.uuid)
+                try:
+                    return self._query(path, method, decoder, cache, validator, **kwargs)
+                finally:
+                    http.WRITES.bump(self.uuid)
+
+            if method is None and set(kwargs) <= set(('params', 'headers')):
+                key = (
+                    self.uuid, path, decoder, cache, validator,
+                    repr(sorted((kwargs.get('params') or {}).items())), repr(sorted((kwargs.get('headers') or {}).items())),
+                    http.WRITES.get(self.uuid)
+                )
+                return http.INFLIGHT.do(
+                    key, self._query, (path, None, decoder, cache, validator), kwargs, share=http.cloneElement
+                )
+
+            return self._query(path, method, decoder, cache, validator, **kwargs)
+
+    def _query(self, path, method=None, decoder=None, cache=False, validator=None, **kwargs):
+        decoder = responsedecoder.getDecoder(decoder)
+        if decoder.ACCEPT:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, Accept=decoder.ACCEPT)
+
+        if cache and method is None and metadatacache.CACHE.enabled:
+            body, response = self._cachedRequest(path, decoder, validator, **kwargs)
+            if body:
+                return decoder.fromstring(body)
+            elif response is None:
+                return None
+
+            body = response.content
+            self._cacheResponse(path, response, body, decoder, validator, kwargs.get('params'))
+            return decoder.fromstring(body)
+
+        if path.startswith(WATCH_STATE_PATHS):
+            # Listings are validated against the section's updatedAt, which doesn't change with watched state
+            metadatacache.CACHE.invalidate(self.uuid, '/library/sections/')
+
+        try:
+            response = self._request(path, method, **kwargs)
         except http.requests.ConnectionError:
             util.ERROR()
             return None
 
-        return ElementTree.fromstring(data) if data else None
+        return decoder.decode(response)
+
+    def queryStream(self, path, method=None, cache=False, validator=None, **kwargs):
+        """
+        Like query(), but parses the response incrementally as it arrives. Returns an
+        http.ElementStream whose root is available immediately and which yields each
+        child element as soon as it's complete, or None if there was no response.
+        """
+        if cache and method is None and metadatacache.CACHE.enabled:
+            decoder = responsedecoder.getDecoder(responsedecoder.XMLDecoder.NAME)
+            body, response = self._cachedRequest(path, decoder, validator, stream=True, **kwargs)
+            if body:
+                stream = http.ElementStream.fromString(body)
+            elif response is None:
+                return None
+            else:
+                def onComplete(body):
+                    self._cacheResponse(path, response, body, decoder, validator, kwargs.get('params'))
+
+                stream = http.ElementStream(response, onComplete=onComplete)
+
+            return stream.root is not None and stream or None
+
+        try:
+            stream = http.ElementStream(self._request(path, method, stream=True, **kwargs))
+        except http.requests.ConnectionError:
+            util.ERROR()
+            return None
+
+        return stream.root is not None and stream or None
 
     def getImageTranscodeURL(self, path, width, height, **extraOpts):
         if not path:
             return ''
 
+        width, height = imageprofiles.REGISTRY.snap(width, height)
         params = ("&width=%s&height=%s" % (width, height)) + ''.join(["&%s=%s" % (key, extraOpts[key]) for key in extraOpts])
 
         if "://" in path:
@@ -250,6 +405,9 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             util.LOG("Got a reachability response, but from a different server")
             return False
 
+        # Kept so the capabilities can be restored at startup before we're reachable
+        self.rootData = dict(data.attrib)
+
         self.serverClass = data.attrib.get('serverClass')
         self.supportsAudioTranscoding = data.attrib.get('transcoderAudio') == '1'
         self.supportsVideoTranscoding = data.attrib.get('transcoderVideo') == '1' or data.attrib.get('transcoderVideoQualities')
@@ -300,8 +458,9 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         epoch = time.time()
         retrySeconds = 60
         minSeconds = 10
-        for i in range(len(self.connections)):
-            conn = self.connections[i]
+
+        # Test the connections that have historically done best first
+        for conn in sorted(self.connections, key=lambda c: c.getPotentialScore(), reverse=True):
             diff = epoch - (conn.lastTestedAt or 0)
             if conn.hasPendingRequest:
                 util.DEBUG_LOG("Skip reachability test for {0} (has pending request)".format(conn))
@@ -313,6 +472,7 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
                     self.pendingSecureRequests += 1
 
                 if self.pendingReachabilityRequests == 1:
+                    self.reachabilityStartedAt = time.time()
                     self.trigger("started:reachability")
 
         if self.pendingReachabilityRequests <= 0:
@@ -347,7 +507,10 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
                 best = conn
 
         if best and best.state == best.STATE_REACHABLE:
-            if best.isSecure or self.pendingSecureRequests <= 0:
+            if self.raceWonBy(best):
+                self.activeConnection = best
+                self.abandonReachability(best)
+            elif best.isSecure or self.pendingSecureRequests <= 0:
                 self.activeConnection = best
             else:
                 util.DEBUG_LOG("Found a good connection for {0}, but holding out for better".format(repr(self.name)))
@@ -367,6 +530,47 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         import plexservermanager
         plexservermanager.MANAGER.updateReachabilityResult(self, bool(self.activeConnection))
 
+    def raceWonBy(self, best):
+        """
+        In race mode a reachable connection is locked in as soon as none of the
+        connections still being tested could beat its score.
+        """
+        if not plexapp.INTERFACE.getPreference('reachability_race', True):
+            return False
+
+        if best.hasPendingRequest:
+            # Only optimistically reachable (warm start), wait for its own result
+            return False
+
+        pending = [c for c in self.connections if c.hasPendingRequest and c is not best]
+        if not pending:
+            return False
+
+        return best.getScore() >= max(c.getPotentialScore() for c in pending)
+
+    def abandonReachability(self, winner):
+        abandoned = 0
+        for conn in self.connections:
+            if conn is winner or not conn.hasPendingRequest:
+                continue
+
+            conn.abandonReachability()
+            abandoned += 1
+            self.pendingReachabilityRequests -= 1
+            if conn.isSecure:
+                self.pendingSecureRequests -= 1
+
+        util.DEBUG_LOG('Reachability race for {0} won by {1} after {2:.0f}ms ({3} slower tests canceled)'.format(
+            repr(self.name), winner.address, self.getReachabilityElapsed() * 1000, abandoned
+        ))
+
+    def getReachabilityElapsed(self):
+        return self.reachabilityStartedAt and time.time() - self.reachabilityStartedAt or 0
+
+    def restoreRootData(self, rootData):
+        """ Restore the capabilities from a saved root response (see collectDataFromRoot). """
+        return self.collectDataFromRoot(responsedecoder.buildElement('MediaContainer', rootData))
+
     def markAsRefreshing(self):
         for i in range(len(self.connections)):
             conn = self.connections[i]
@@ -1,4 +1,5 @@
 import json
+import time
 
 import http
 import plexconnection
@@ -12,6 +13,9 @@ import gdm
 import util
 
 
+SELECTION_TIMES_KEPT = 20
+
+
 class SearchContext(dict):
     def __getattr__(self, attr):
         return self.get(attr)
@@ -29,6 +33,7 @@ class PlexServerManager(signalsmixin.SignalsMixin):
         self.transcodeServer = None
         self.channelServer = None
         self.deferReachabilityTimer = None
+        self.warmCandidate = None
 
         self.startSelectedServerSearch()
         self.loadState()
@@ -58,6 +63,10 @@ class PlexServerManager(signalsmixin.SignalsMixin):
             util.LOG("Setting selected server to {0}".format(server))
             self.selectedServer = server
 
+            if server and self.searchContext and self.searchContext.startedAt:
+                self.recordSelectionTime(server, time.time() - self.searchContext.startedAt)
+                self.searchContext.startedAt = None
+
             # Update our saved state.
             self.saveState()
 
@@ -235,6 +244,9 @@ class PlexServerManager(signalsmixin.SignalsMixin):
                 util.LOG("The selected channel server is not reachable")
                 self.channelServer = None
 
+        if server.pendingReachabilityRequests <= 0:
+            self.saveHistory()
+
         # See if we should settle for the best we've found so far.
         self.checkSelectedServerSearch()
 
@@ -291,6 +303,18 @@ class PlexServerManager(signalsmixin.SignalsMixin):
                 self.setSelectedServer(self.searchContext.bestServer or self.searchContext.fallbackServer, True)
                 return self.selectedServer
 
+    def recordSelectionTime(self, server, elapsed):
+        # Keep the time to a selected server for the last few searches
+        util.LOG("Selected server {0} after {1:.0f}ms".format(repr(server.name), elapsed * 1000))
+
+        try:
+            times = json.loads(plexapp.INTERFACE.getRegistry("ServerSelectionTimes") or '[]')
+        except ValueError:
+            times = []
+
+        times.append({'time': int(time.time()), 'ms': int(elapsed * 1000), 'server': server.uuid})
+        plexapp.INTERFACE.setRegistry("ServerSelectionTimes", json.dumps(times[-SELECTION_TIMES_KEPT:]))
+
     def compareServers(self, first, second):
         if not first or not first.isSupported:
             return second and -1 or 0
@@ -304,6 +328,8 @@ class PlexServerManager(signalsmixin.SignalsMixin):
             return 0
 
     def loadState(self):
+        plexconnection.HISTORY.load(plexapp.INTERFACE.getRegistry("PlexServerManager.history"))
+
         jstring = plexapp.INTERFACE.getRegistry("PlexServerManager")
         if not jstring:
             return
@@ -318,6 +344,8 @@ class PlexServerManager(signalsmixin.SignalsMixin):
             util.ERROR_LOG("Failed to parse PlexServerManager JSON")
             return
 
+        self.warmCandidate = None
+
         for serverObj in obj['servers']:
             server = plexserver.createPlexServerForName(serverObj['uuid'], serverObj['name'])
             server.owned = bool(serverObj.get('owned'))
@@ -342,11 +370,51 @@ class PlexServerManager(signalsmixin.SignalsMixin):
                 else:
                     server.connections.append(connection)
 
+            if serverObj.get('root'):
+                server.restoreRootData(serverObj['root'])
+
             self.serversByUuid[server.uuid] = server
 
+            if server.uuid == self.searchContext.preferredServer and serverObj.get('activeConnection'):
+                self.warmCandidate = (server, serverObj['activeConnection'])
+
         util.LOG("Loaded {0} servers from registry".format(len(obj['servers'])))
         self.updateReachability(False, True)
 
+    def warmStart(self):
+        """
+        Select the preferred server right away through the connection that was active
+        last time. Its reachability is confirmed in the background and the normal search
+        takes over if that fails. Called by plexapp.init() once SERVERMANAGER is set and
+        the account is loaded, so listeners of change:selectedServer can use both.
+        """
+        if not self.warmCandidate:
+            return False
+
+        server, address = self.warmCandidate
+        self.warmCandidate = None
+
+        if self.selectedServer or not server.isSupported or not plexapp.INTERFACE.getPreference('warm_start', True):
+            return False
+
+        for conn in server.connections:
+            if conn.address == address:
+                break
+        else:
+            return False
+
+        util.LOG("Warm start: selecting {0} via {1} until reachability is confirmed".format(repr(server.name), address))
+        conn.state = conn.STATE_REACHABLE
+        conn.getScore(True)
+        server.activeConnection = conn
+        self.setSelectedServer(server, True)
+
+        # The connection is only optimistically reachable, so always test it. This goes to the
+        # server directly because updateReachability() waits for a protected Home user's PIN.
+        server.updateReachability(True)
+
+        return True
+
     def saveState(self):
         # Serialize our important information to JSON and save it to the registry.
         # We'll always update server info upon connecting, so we don't need much
@@ -365,6 +433,8 @@ class PlexServerManager(signalsmixin.SignalsMixin):
                     'uuid': server.uuid,
                     'owned': server.owned,
                     'sameNetwork': server.sameNetwork,
+                    'root': server.rootData,
+                    'activeConnection': server.isReachable(False) and server.activeConnection.address or None,
                     'connections': []
                 }
 
@@ -384,9 +454,14 @@ class PlexServerManager(signalsmixin.SignalsMixin):
             plexapp.INTERFACE.setPreference("lastServerId", self.selectedServer.uuid)
 
         plexapp.INTERFACE.setRegistry("PlexServerManager", json.dumps(obj))
+        self.saveHistory()
+
+    def saveHistory(self):
+        plexapp.INTERFACE.setRegistry("PlexServerManager.history", plexconnection.HISTORY.serialize())
 
     def clearState(self):
         plexapp.INTERFACE.setRegistry("PlexServerManager", '')
+        plexapp.INTERFACE.setRegistry("PlexServerManager.history", '')
 
     def isValidForTranscoding(self, server):
         return server and server.activeConnection and server.owned and not server.synced and not server.isSecondary()
@@ -450,7 +525,8 @@ class PlexServerManager(signalsmixin.SignalsMixin):
         self.searchContext = SearchContext({
             'bestServer': None,
             'preferredServer': plexapp.INTERFACE.getPreference('lastServerId', ''),
-            'waitingForResources': plexapp.ACCOUNT.isSignedIn
+            'waitingForResources': plexapp.ACCOUNT.isSignedIn,
+            'startedAt': time.time()
         })
 
         util.LOG("Starting selected server search, hoping for {0}".format(self.searchContext.preferredServer))
@@ -0,0 +1,160 @@
+"""
+TTL cache for plex.tv responses (resources and home users).
+
+Responses are kept in the registry so they survive a restart. A fresh entry is used
+as-is. A stale one is still handed back right away while a refresh runs on the
+executor (stale-while-revalidate), so sign in and user switches only wait on plex.tv
+when nothing has been cached yet.
+"""
+import json
+import time
+import threading
+
+import plexapp
+import threadutils
+import util
+
+REGISTRY_KEY = 'plextvCache'
+REGISTRY_SECTION = 'xml_cache'
+
+RESOURCES_TTL = 300  # seconds
+HOME_USERS_TTL = 300
+
+
+class PlexTVCache(object):
+    def __init__(self):
+        self.entries = None
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def get(self, key):
+        """ Returns (data, age) for key, or (None, None) if nothing is cached. Data is always unicode. """
+        with self.lock:
+            entry = self._entries().get(key)
+
+        if not entry:
+            return None, None
+
+        return entry['data'], max(0, time.time() - entry['at'])
+
+    def put(self, key, data):
+        data = _text(data)
+        with self.lock:
+            self._entries()[key] = {'data': data, 'at': time.time()}
+            self._save()
+
+    def remove(self, key):
+        with self.lock:
+            if self._entries().pop(key, None) is not None:
+                self._save()
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            plexapp.INTERFACE.clearRegistry(REGISTRY_KEY, REGISTRY_SECTION)
+
+    def fetch(self, key, ttl, fetcher, onRefresh=None, force=False):
+        """
+        Return the data cached for key, calling fetcher() for it only when nothing is cached.
+        Stale (or forced) entries are returned as well and refreshed in the background,
+        onRefresh(data) is called if the refreshed data differs from what we returned.
+        """
+        data, age = self.get(key)
+
+        if data is not None:
+            if not force and age < ttl:
+                self.hits += 1
+                return data
+
+            self.stale += 1
+            util.DEBUG_LOG('plex.tv cache: using stale {0} ({1:.0f}s old), refreshing'.format(key, age))
+            self.refresh(key, fetcher, onRefresh)
+            return data
+
+        self.misses += 1
+        data = _text(fetcher())
+        if data:
+            self.put(key, data)
+        else:
+            self.failures += 1
+
+        return data
+
+    def refresh(self, key, fetcher, onRefresh=None):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        threadutils.EXECUTOR.submit(self._refresh, (key, fetcher, onRefresh), lane=threadutils.LANE_UI, name='plextv-refresh')
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self._entries()),
+                'hits': self.hits,
+                'stale': self.stale,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'failures': self.failures
+            }
+
+    def logStats(self):
+        util.LOG(
+            'plex.tv cache: {entries} entries, {hits} hits, {stale} stale, {misses} misses, '
+            '{refreshes} refreshes, {failures} failures'.format(**self.stats())
+        )
+
+    def _refresh(self, key, fetcher, onRefresh):
+        old = self.get(key)[0]
+
+        try:
+            data = _text(fetcher())
+        except:
+            util.ERROR()
+            data = None
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+        if not data:
+            self.failures += 1
+            util.DEBUG_LOG('plex.tv cache: refresh of {0} failed, keeping the cached copy'.format(key))
+            return
+
+        self.refreshes += 1
+        self.put(key, data)
+
+        if data != old and onRefresh:
+            util.DEBUG_LOG('plex.tv cache: {0} changed'.format(key))
+            onRefresh(data)
+
+    def _entries(self):
+        if self.entries is None:
+            self.entries = {}
+            jstring = plexapp.INTERFACE.getRegistry(REGISTRY_KEY, None, REGISTRY_SECTION)
+            if jstring:
+                try:
+                    self.entries = json.loads(jstring)
+                except ValueError:
+                    util.ERROR()
+
+        return self.entries
+
+    def _save(self):
+        plexapp.INTERFACE.setRegistry(REGISTRY_KEY, json.dumps(self.entries), REGISTRY_SECTION)
+
+
+def _text(data):
+    # Keep everything unicode, which is what comes back out of the registry
+    if isinstance(data, str):
+        return data.decode('utf8')
+    return data
+
+
+CACHE = PlexTVCache()
@@ -0,0 +1,242 @@
+"""
+Timing spans and counters for the hot paths.
+
+    with profiler.span('PlexServer.query'):
+        ...
+    profiler.count('metadata.cache.hit')
+    profiler.record('task.wait', seconds)
+
+Spans aggregate into count/total/min/max per name, nothing is kept per call. While
+profiling is off span() hands back one shared no-op context manager and count() and
+record() return straight away, so the calls can stay in the hot paths. Summaries are
+appended to a size capped profile file that rotates into .1, .2... backups.
+"""
+import os
+import time
+import threading
+
+import util
+
+MAX_FILE_SIZE = 256 * 1024  # bytes
+BACKUP_COUNT = 2
+FLUSH_INTERVAL = 60  # seconds
+
+ENABLED = False
+
+
+class Stat(object):
+    __slots__ = ('count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if self.min is None or elapsed < self.min:
+            self.min = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+class Span(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        PROFILER.record(self.name, time.time() - self.start)
+
+
+class NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Profiler(object):
+    def __init__(self):
+        self.path = None
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.since = time.time()
+        self.lastFlush = time.time()
+        self.flushing = False
+
+    @property
+    def enabled(self):
+        return ENABLED
+
+    def setPath(self, path):
+        self.path = path
+
+    def enable(self, enabled=True):
+        global ENABLED
+
+        if enabled == ENABLED:
+            return
+
+        if not enabled:
+            self.flush()
+
+        with self.lock:
+            self._reset()
+            ENABLED = enabled
+
+        util.LOG('Profiling: {0}'.format(enabled and 'ON' or 'OFF'))
+
+    def record(self, name, elapsed):
+        if not ENABLED:
+            return
+
+        with self.lock:
+            stat = self.spans.get(name)
+            if stat is None:
+                stat = self.spans[name] = Stat()
+            stat.add(elapsed)
+
+        self._checkFlush()
+
+    def count(self, name, amount=1):
+        if not ENABLED:
+            return
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        """ The current spans (slowest total first) and counters as text. """
+        with self.lock:
+            spans = sorted(self.spans.items(), key=lambda i: -i[1].total)
+            counters = sorted(self.counters.items())
+            since = self.since
+
+        lines = ['Profile {0} - {1} ({2:.0f}s)'.format(_timestamp(since), _timestamp(time.time()), time.time() - since)]
+        if spans:
+            lines.append('{0:<48} {1:>8} {2:>10} {3:>9} {4:>9} {5:>9}'.format('span', 'count', 'total ms', 'avg ms', 'min ms', 'max ms'))
+            for name, stat in spans:
+                lines.append('{0:<48} {1:>8} {2:>10.1f} {3:>9.2f} {4:>9.2f} {5:>9.2f}'.format(
+                    name, stat.count, stat.total * 1000, stat.total / stat.count * 1000, stat.min * 1000, stat.max * 1000
+                ))
+
+        if counters:
+            lines.append('{0:<48} {1:>8}'.format('counter', 'count'))
+            for name, value in counters:
+                lines.append('{0:<48} {1:>8}'.format(name, value))
+
+        if not spans and not counters:
+            lines.append('Nothing recorded')
+
+        return '\n'.join(lines)
+
+    def flush(self):
+        """ Append the current summary to the profile file and start a new period. """
+        if not self.path:
+            return
+
+        with self.lock:
+            if not self.spans and not self.counters:
+                self.lastFlush = time.time()
+                return
+
+        text = self.summary()
+
+        with self.lock:
+            self._reset()
+
+        try:
+            self._rotate()
+            with open(self.path, 'a') as f:
+                f.write(text.encode('utf8') if isinstance(text, unicode) else text)
+                f.write('\n\n')
+        except (IOError, OSError):
+            util.ERROR()
+
+    def read(self):
+        """ The profile file (newest period last) followed by what's been recorded since the last flush. """
+        data = ''
+        if self.path:
+            try:
+                with open(self.path, 'r') as f:
+                    data = f.read()
+            except (IOError, OSError):
+                pass
+
+        if ENABLED:
+            data += self.summary()
+
+        return data
+
+    def _reset(self):
+        self.spans = {}
+        self.counters = {}
+        self.since = self.lastFlush = time.time()
+
+    def _checkFlush(self):
+        if self.flushing or time.time() - self.lastFlush < FLUSH_INTERVAL:
+            return
+
+        self.flushing = True
+        self.lastFlush = time.time()
+
+        import threadutils
+        threadutils.EXECUTOR.submit(self._flush, lane=threadutils.LANE_TIMELINE, name='profile-flush')
+
+    def _flush(self):
+        try:
+            self.flush()
+        finally:
+            self.flushing = False
+
+    def _rotate(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < MAX_FILE_SIZE:
+            return
+
+        for i in range(BACKUP_COUNT, 0, -1):
+            src = i > 1 and '{0}.{1}'.format(self.path, i - 1) or self.path
+            dst = '{0}.{1}'.format(self.path, i)
+            if not os.path.exists(src):
+                continue
+            if os.path.exists(dst):
+                os.remove(dst)
+            os.rename(src, dst)
+
+
+def _timestamp(t):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+
+def span(name):
+    if not ENABLED:
+        return NULL_SPAN
+    return Span(name)
+
+
+def count(name, amount=1):
+    if ENABLED:
+        PROFILER.count(name, amount)
+
+
+def record(name, elapsed):
+    if ENABLED:
+        PROFILER.record(name, elapsed)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Response decoders for PMS queries.
+
+Every decoder turns a response body into an ElementTree element, so the rest of
+plexnet (PlexObject._setData, buildItem via LIBRARY_TYPES, the media trees) can
+stay format agnostic. XML is the default and the fallback: a JSON decoder
+handed a body that isn't JSON will parse it as XML. The json_responses setting
+switches the default to JSON (see plexapp.setResponseDecoder()).
+"""
+import json
+from xml.etree import ElementTree
+
+import profiler
+
+# JSON groups all items under "Metadata", so use the item type to recover the tag
+# the XML response would have used.
+METADATA_TAGS = {
+    'movie': 'Video',
+    'episode': 'Video',
+    'clip': 'Video',
+    'track': 'Track',
+    'photo': 'Photo',
+    'playlist': 'Playlist'
+}
+
+# Types PMS uses for directories as well as items (a photo album is a Directory with
+# type="photo"), only entries with Media get the item tag.
+MEDIA_TYPES = ('photo',)
+
+
+class XMLDecoder(object):
+    NAME = 'xml'
+    ACCEPT = None  # PMS defaults to XML
+
+    def decode(self, response):
+        with profiler.span('http.receive'):
+            data = response.text.encode('utf8')
+        return self.fromstring(data)
+
+    def fromstring(self, data):
+        if not data:
+            return None
+
+        with profiler.span('parse.xml'):
+            return ElementTree.fromstring(data)
+
+
+class JSONDecoder(XMLDecoder):
+    NAME = 'json'
+    ACCEPT = 'application/json'
+
+    def decode(self, response):
+        with profiler.span('http.receive'):
+            data = response.content
+        return self.fromstring(data)
+
+    def fromstring(self, data):
+        if not data:
+            return None
+
+        if data.lstrip()[:1] != '{':
+            return XMLDecoder.fromstring(self, data)
+
+        with profiler.span('parse.json'):
+            # Objects are decoded as lists of (key, value) pairs, which keeps the children in the
+            # server's order like an OrderedDict would, at a fraction of the cost
+            obj = json.loads(data, object_pairs_hook=list)
+            if len(obj) == 1 and obj[0][0] == 'MediaContainer':
+                return buildElement('MediaContainer', obj[0][1])
+
+            return buildElement('MediaContainer', obj)
+
+
+def _isObject(value):
+    return isinstance(value, list) and value and isinstance(value[0], tuple)
+
+
+def _childTag(key, pairs):
+    if key == 'Metadata':
+        for k, v in pairs:
+            if k == 'type':
+                if v in MEDIA_TYPES and not any(ck == 'Media' for ck, cv in pairs):
+                    return 'Directory'
+                return METADATA_TAGS.get(v, 'Directory')
+        return 'Directory'
+
+    return key
+
+
+def buildElement(tag, obj):
+    """
+    Build an Element (and its children) from a decoded PMS JSON object, either a dict or
+    the list of (key, value) pairs JSONDecoder decodes objects to.
+    """
+    elem = ElementTree.Element(tag)
+    attrib = elem.attrib
+
+    for k, v in isinstance(obj, dict) and obj.iteritems() or obj:
+        if isinstance(v, dict):
+            v = v.items()
+
+        if _isObject(v):
+            elem.append(buildElement(_childTag(k, v), v))
+        elif isinstance(v, list):
+            for child in v:
+                if isinstance(child, dict):
+                    child = child.items()
+                if _isObject(child):
+                    elem.append(buildElement(_childTag(k, child), child))
+        elif isinstance(v, bool):
+            attrib[k] = v and '1' or '0'
+        elif v is not None:
+            attrib[k] = unicode(v)
+
+    return elem
+
+
+DECODERS = {
+    XMLDecoder.NAME: XMLDecoder(),
+    JSONDecoder.NAME: JSONDecoder()
+}
+
+DEFAULT = XMLDecoder.NAME
+
+
+def getDecoder(name=None):
+    return DECODERS.get(name or DEFAULT) or DECODERS[XMLDecoder.NAME]
+
+
+def setDefaultDecoder(name):
+    global DEFAULT
+    if name not in DECODERS:
+        raise ValueError('Unknown response decoder: {0}'.format(name))
+    DEFAULT = name
@@ -1,7 +1,10 @@
 # import inspect
 # import ctypes
 import threading
-# import time
+import time
+import heapq
+import itertools
+import collections
 
 
 # def _async_raise(tid, exctype):
@@ -91,3 +94,192 @@ class KillableThread(threading.Thread):
     #         self._Thread__target(*self._Thread__args, **self._Thread__kwargs)
     #     except KillThreadException:
     #         self.onKilled()
+
+
+# Executor lanes, in priority order
+LANE_REACHABILITY = 0
+LANE_TIMELINE = 1
+LANE_UI = 2
+
+LANE_NAMES = ('reachability', 'timeline', 'ui')
+
+
+class Job(object):
+    def __init__(self, func, args, kwargs, lane, due, name=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.lane = lane
+        self.due = due
+        self.name = name or repr(func)
+        self.canceled = False
+
+    def cancel(self):
+        self.canceled = True
+
+    def run(self):
+        if self.canceled:
+            return
+
+        try:
+            self.func(*self.args, **self.kwargs)
+        except:
+            import util
+            util.ERROR('Executor job failed: {0}'.format(self.name))
+
+
+class Executor(object):
+    """
+    A fixed-size pool of worker threads that runs jobs by lane priority, with
+    first-in first-out order inside each lane. Jobs can be delayed, which replaces
+    one-shot timer threads. Workers are only started as jobs arrive, up to maxWorkers.
+    A lane can be capped (laneLimits) so its jobs never hold every worker, e.g.
+    reachability probes waiting out timeouts on dead addresses.
+    """
+
+    def __init__(self, maxWorkers=16, name='PLEXNET-EXECUTOR', laneLimits=None):
+        self.maxWorkers = maxWorkers
+        self.name = name
+        self.laneLimits = [(laneLimits or {}).get(lane) or maxWorkers for lane in range(len(LANE_NAMES))]
+        self._ready = [collections.deque() for lane in LANE_NAMES]
+        self._running = [0] * len(LANE_NAMES)
+        self._delayed = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._workers = []
+        self._idle = 0
+        self._stopped = False
+
+    def submit(self, func, args=(), kwargs=None, lane=LANE_UI, delay=0, name=None):
+        job = Job(func, args, kwargs or {}, lane, time.time() + delay, name)
+
+        with self._cond:
+            if self._stopped:
+                job.cancel()
+                return job
+
+            if delay > 0:
+                heapq.heappush(self._delayed, (job.due, next(self._seq), job))
+                # Someone has to be waiting for it to come due, even if every worker is busy
+                if not self._idle and len(self._workers) < self.maxWorkers:
+                    self._startWorker()
+                    self._idle += 1
+                    self._workers[-1].starting = True
+            else:
+                self._ready[lane].append(job)
+                self._startWorkers()
+
+            self._cond.notify()
+
+        return job
+
+    def stats(self):
+        with self._cond:
+            return {
+                'threads': len(self._workers),
+                'busy': len(self._workers) - self._idle,
+                'queued': dict((LANE_NAMES[lane], len([j for j in jobs if not j.canceled])) for lane, jobs in enumerate(self._ready)),
+                'delayed': len(self._delayed)
+            }
+
+    def logStats(self):
+        stats = self.stats()
+        import util
+        util.DEBUG_LOG('Executor: threads={0} busy={1} delayed={2} queued={3}'.format(
+            stats['threads'], stats['busy'], stats['delayed'], ', '.join('{0}={1}'.format(n, stats['queued'][n]) for n in LANE_NAMES)
+        ))
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            for jobs in self._ready:
+                for job in jobs:
+                    job.cancel()
+                jobs.clear()
+            for entry in self._delayed:
+                entry[2].cancel()
+            self._delayed = []
+            self._cond.notifyAll()
+            workers = list(self._workers)
+
+        if wait:
+            for worker in workers:
+                if worker is not threading.currentThread():
+                    worker.join()
+
+    def _runnable(self):
+        # Called with the condition held. Jobs that could start now, lanes at their limit don't count.
+        return sum(
+            min(len(jobs), self.laneLimits[lane] - self._running[lane]) for lane, jobs in enumerate(self._ready) if jobs
+        )
+
+    def _startWorkers(self):
+        # Called with the condition held
+        while self._runnable() > self._idle and len(self._workers) < self.maxWorkers:
+            self._startWorker()
+            self._idle += 1  # Counted as idle until it picks up a job, so we don't start one per job
+            self._workers[-1].starting = True
+
+    def _startWorker(self):
+        worker = threading.Thread(target=self._work, name='{0}:{1}'.format(self.name, len(self._workers)))
+        worker.daemon = True
+        worker.starting = False
+        self._workers.append(worker)
+        worker.start()
+
+    def _nextJob(self):
+        # Called with the condition held. Returns None when we're shutting down.
+        while not self._stopped:
+            now = time.time()
+            promoted = False
+            while self._delayed and self._delayed[0][0] <= now:
+                job = heapq.heappop(self._delayed)[2]
+                self._ready[job.lane].append(job)
+                promoted = True
+
+            if promoted:
+                # More came due than this worker can run
+                self._startWorkers()
+
+            for lane, jobs in enumerate(self._ready):
+                if jobs and self._running[lane] < self.laneLimits[lane]:
+                    job = jobs.popleft()
+                    if job.canceled:
+                        break
+                    self._running[lane] += 1
+                    return job
+            else:
+                self._idle += 1
+                self._cond.wait(self._delayed and max(self._delayed[0][0] - now, 0.01) or None)
+                self._idle -= 1
+
+        return None
+
+    def _work(self):
+        worker = threading.currentThread()
+        try:
+            while True:
+                with self._cond:
+                    if worker.starting:
+                        worker.starting = False
+                        self._idle -= 1
+                    job = self._nextJob()
+
+                if not job:
+                    return
+
+                try:
+                    job.run()
+                finally:
+                    with self._cond:
+                        self._running[job.lane] -= 1
+                        if self._ready[job.lane]:
+                            # A job held back by the lane limit can go now
+                            self._cond.notify()
+        finally:
+            with self._cond:
+                self._workers.remove(worker)
+
+
+# Probes of dead addresses wait out their timeouts, keep workers free for everything else
+EXECUTOR = Executor(laneLimits={LANE_REACHABILITY: 8})
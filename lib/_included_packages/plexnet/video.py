@@ -186,12 +186,18 @@ class PlayableVideo(Video):
             self.extras = PlexVideoItemList(data.find('Extras'), initpath=self.initpath, server=self.server, container=self)
 
     def reload(self, *args, **kwargs):
+        viewState = None
         if not kwargs.get('_soft'):
+            viewState = (self.get('viewCount'), self.get('viewOffset'))
             if self.get('viewCount'):
                 del self.viewCount
             if self.get('viewOffset'):
                 del self.viewOffset
         Video.reload(self, *args, **kwargs)
+
+        if viewState is not None and viewState != (self.get('viewCount'), self.get('viewOffset')):
+            self.invalidateSectionCache()
+
         return self
 
     def postPlay(self, **params):
@@ -1,21 +1,28 @@
 import Queue
-import heapq
+import time
+import threading
 import xbmc
 import util
-from plexnet import threadutils
+from plexnet import threadutils, profiler
+
+IDLE_WAIT = 1.0  # seconds an idle worker sleeps before checking whether it should stop
+JOIN_TIMEOUT = 5.0  # seconds shutdown waits for a worker's running task
 
 
 class Tasks(list):
+    """ A window's tasks, so they can all be canceled (and dropped from the queue) in one call. """
+
     def add(self, task):
-        for t in self:
-            if not t.isValid():
-                self.remove(t)
+        self.clean()
 
         if isinstance(task, list):
             self += task
         else:
             self.append(task)
 
+    def clean(self):
+        self[:] = [t for t in self if t.isValid()]
+
     def cancel(self):
         while self:
             self.pop().cancel()
@@ -25,6 +32,12 @@ class Task:
     def __init__(self, priority=None):
         self._priority = priority
         self._canceled = False
+        self._queue = None
+        self._heapIndex = None
+        self._seq = 0
+        self._queuedAt = None
+        self._threader = None
+        self._generation = None
         self.finished = False
 
     def __cmp__(self, other):
@@ -42,33 +55,197 @@ class Task:
 
     def cancel(self):
         self._canceled = True
+        queue = self._queue
+        if queue:
+            queue.remove(self)
 
     def isCanceled(self):
-        return self._canceled or xbmc.abortRequested
+        return self._canceled or xbmc.abortRequested or (self._threader is not None and self._generation != self._threader.generation)
 
     def isValid(self):
         return not self.finished and not self._canceled
 
+    def isQueued(self):
+        return self._queue is not None
+
+
+class TaskQueue(object):
+    """
+    Indexed binary heap of tasks, lowest _priority first and first in first out for
+    equal priorities. Each queued task keeps its index in the heap, so reprioritizing
+    or removing it is O(log n) and a canceled task leaves the queue immediately
+    instead of waiting for a worker to pop it. Idle workers block in get().
+    """
 
-class MutablePriorityQueue(Queue.PriorityQueue):
-    def _get(self, heappop=heapq.heappop):
-            self.queue.sort()
-            return heappop(self.queue)
+    def __init__(self):
+        self.heap = []
+        self.lock = threading.Condition()
+        self._seq = 0
+        self.added = 0
+        self.done = 0
+        self.removed = 0
+        self.waitTotal = 0.0
+        self.waitMax = 0.0
+
+    def put(self, task):
+        if task._queue and task._queue is not self:
+            task._queue.remove(task)
+
+        with self.lock:
+            if task._queue is self:
+                self._fix(task._heapIndex)
+                return
+
+            self._seq += 1
+            task._seq = self._seq
+            task._queue = self
+            task._queuedAt = time.time()
+            task._heapIndex = len(self.heap)
+            self.heap.append(task)
+            self._siftUp(task._heapIndex)
+            self.added += 1
+            self.lock.notify()
+
+    def get(self, aborted=None):
+        """
+        Block until there's a task and return it, or None once aborted() is true. aborted()
+        is checked with the lock held, so an abort followed by wake() can't slip in before
+        the wait and be missed.
+        """
+        with self.lock:
+            while not self.heap:
+                if aborted and aborted():
+                    return None
+                self.lock.wait(IDLE_WAIT)
+
+            return self._pop()
+
+    def get_nowait(self):
+        with self.lock:
+            if not self.heap:
+                raise Queue.Empty
+
+            return self._pop()
+
+    def wake(self):
+        """ Wake every waiting worker, so they notice they've been aborted. """
+        with self.lock:
+            self.lock.notify_all()
+
+    def remove(self, task):
+        with self.lock:
+            if task._queue is not self:
+                return False
+
+            self._removeAt(task._heapIndex)
+            self.removed += 1
+            return True
+
+    def reprioritize(self, task, priority):
+        with self.lock:
+            task._priority = priority
+            if task._queue is self:
+                self._fix(task._heapIndex)
 
     def lowest(self):
-        """Return the lowest priority item in the queue (not reliable!)."""
-        self.mutex.acquire()
-        try:
-            lowest = self.queue and min(self.queue) or None
-        except:
-            lowest = None
-            util.ERROR()
-        finally:
-            self.mutex.release()
-        return lowest
+        """ The task that will run next, or None. """
+        with self.lock:
+            return self.heap and self.heap[0] or None
+
+    def empty(self):
+        return not self.heap
+
+    def qsize(self):
+        return len(self.heap)
+
+    def clear(self):
+        """ Cancel and drop everything queued. """
+        with self.lock:
+            for task in self.heap:
+                task._canceled = True
+                task._queue = task._heapIndex = None
+            self.removed += len(self.heap)
+            self.heap = []
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queued': len(self.heap),
+                'added': self.added,
+                'done': self.done,
+                'removed': self.removed,
+                'avg_wait': self.done and self.waitTotal / self.done * 1000 or 0,
+                'max_wait': self.waitMax * 1000
+            }
+
+    def _pop(self):
+        task = self.heap[0]
+        self._removeAt(0)
+        wait = time.time() - task._queuedAt
+        self.done += 1
+        self.waitTotal += wait
+        self.waitMax = max(self.waitMax, wait)
+        profiler.record('BGThreader.wait', wait)
+        return task
+
+    def _less(self, a, b):
+        if a._priority == b._priority:
+            return a._seq < b._seq
+        return a._priority < b._priority
+
+    def _removeAt(self, idx):
+        task = self.heap[idx]
+        last = self.heap.pop()
+        if idx < len(self.heap):
+            self.heap[idx] = last
+            last._heapIndex = idx
+            self._fix(idx)
+
+        task._queue = task._heapIndex = None
+
+    def _fix(self, idx):
+        if idx > 0 and self._less(self.heap[idx], self.heap[(idx - 1) >> 1]):
+            self._siftUp(idx)
+        else:
+            self._siftDown(idx)
+
+    def _siftUp(self, idx):
+        heap = self.heap
+        task = heap[idx]
+        while idx > 0:
+            parent = (idx - 1) >> 1
+            if not self._less(task, heap[parent]):
+                break
+            heap[idx] = heap[parent]
+            heap[idx]._heapIndex = idx
+            idx = parent
+
+        heap[idx] = task
+        task._heapIndex = idx
+
+    def _siftDown(self, idx):
+        heap = self.heap
+        size = len(heap)
+        task = heap[idx]
+        while True:
+            child = 2 * idx + 1
+            if child >= size:
+                break
+            if child + 1 < size and self._less(heap[child + 1], heap[child]):
+                child += 1
+            if not self._less(heap[child], task):
+                break
+            heap[idx] = heap[child]
+            heap[idx]._heapIndex = idx
+            idx = child
+
+        heap[idx] = task
+        task._heapIndex = idx
 
 
 class BackgroundWorker:
+    """ A long-lived worker thread, it blocks on the queue while there's nothing to do. """
+
     def __init__(self, queue, name=None):
         self._queue = queue
         self.name = name
@@ -77,10 +254,12 @@ class BackgroundWorker:
         self._task = None
 
     def _runTask(self, task):
-        if task._canceled:
+        if task.isCanceled():
             return
+
         try:
-            task._run()
+            with profiler.span('{0}.run'.format(task.__class__.__name__)):
+                task._run()
         except:
             util.ERROR()
 
@@ -93,24 +272,25 @@ class BackgroundWorker:
 
     def start(self):
         if self._thread and self._thread.isAlive():
-            return
+            return False
 
         self._thread = threadutils.KillableThread(target=self._queueLoop, name='BACKGROUND-WORKER({0})'.format(self.name))
+        self._thread.daemon = True
         self._thread.start()
+        return True
 
     def _queueLoop(self):
-        if self._queue.empty():
-            return
+        util.DEBUG_LOG('BGThreader: ({0}): Started'.format(self.name))
+        while not self.aborted():
+            task = self._queue.get(self.aborted)
+            if not task:
+                continue
 
-        util.DEBUG_LOG('BGThreader: ({0}): Active'.format(self.name))
-        try:
-            while not self.aborted():
-                self._task = self._queue.get_nowait()
-                self._runTask(self._task)
-                self._queue.task_done()
-                self._task = None
-        except Queue.Empty:
-            util.DEBUG_LOG('BGThreader ({0}): Idle'.format(self.name))
+            self._task = task
+            self._runTask(task)
+            self._task = None
+
+        util.DEBUG_LOG('BGThreader: ({0}): Stopped'.format(self.name))
 
     def shutdown(self):
         self.abort()
@@ -118,22 +298,38 @@ class BackgroundWorker:
         if self._task:
             self._task.cancel()
 
+        self._queue.wake()
+
         if self._thread and self._thread.isAlive():
             util.DEBUG_LOG('BGThreader: thread ({0}): Waiting...'.format(self.name))
-            self._thread.join()
-            util.DEBUG_LOG('BGThreader: thread ({0}): Done'.format(self.name))
+            self._thread.join(JOIN_TIMEOUT)
+            if self._thread.isAlive():
+                util.LOG('BGThreader: thread ({0}): Still running, leaving it'.format(self.name))
+            else:
+                util.DEBUG_LOG('BGThreader: thread ({0}): Done'.format(self.name))
 
     def working(self):
-        return self._thread and self._thread.isAlive()
+        return self._task is not None
 
 
 class BackgroundThreader:
+    """
+    Runs tasks on a fixed pool of workers that are started with the first task and
+    then live until shutdown. reset() starts a new generation instead of replacing
+    the pool: queued tasks are dropped and running ones see isCanceled().
+    """
+
     def __init__(self, name=None, worker_count=8):
         self.name = name
-        self._queue = MutablePriorityQueue()
+        self._queue = TaskQueue()
         self._abort = False
         self._priority = -1
-        self.workers = [BackgroundWorker(self._queue, 'queue.{0}:worker.{1}'.format(self.name, x)) for x in range(worker_count)]
+        self._workerIndex = 0
+        self.generation = 0
+        self.threadsStarted = 0
+        self.lock = threading.Lock()
+        self.workers = []
+        self.setWorkerCount(worker_count, start=False)
 
     def _nextPriority(self):
         self._priority += 1
@@ -143,25 +339,56 @@ class BackgroundThreader:
         self._abort = True
         for w in self.workers:
             w.abort()
+        self._queue.wake()
         return self
 
     def aborted(self):
         return self._abort or xbmc.abortRequested
 
     def shutdown(self):
+        self.logStats()
         self.abort()
 
         for w in self.workers:
             w.shutdown()
 
+    def reset(self):
+        self.generation += 1
+        self._queue.clear()
+        util.DEBUG_LOG('BGThreader ({0}): Reset to generation {1}'.format(self.name, self.generation))
+
+    def setWorkerCount(self, count, start=True):
+        with self.lock:
+            count = max(1, count)
+            while len(self.workers) < count:
+                self.workers.append(BackgroundWorker(self._queue, 'queue.{0}:worker.{1}'.format(self.name, self._workerIndex)))
+                self._workerIndex += 1
+
+            extra = self.workers[count:]
+            del self.workers[count:]
+
+        for w in extra:
+            w.abort()
+
+        if extra:
+            self._queue.wake()
+        elif start and not self._queue.empty():
+            self.startWorkers()
+
+    def _prepare(self, task):
+        task._threader = self
+        task._generation = self.generation
+
     def addTask(self, task):
         task._priority = self._nextPriority()
+        self._prepare(task)
         self._queue.put(task)
         self.startWorkers()
 
     def addTasks(self, tasks):
         for t in tasks:
             t._priority = self._nextPriority()
+            self._prepare(t)
             self._queue.put(t)
 
         self.startWorkers()
@@ -174,14 +401,20 @@ class BackgroundThreader:
         p = lowest - len(tasks)
         for t in tasks:
             t._priority = p
+            self._prepare(t)
             self._queue.put(t)
             p += 1
 
         self.startWorkers()
 
     def startWorkers(self):
-        for w in self.workers:
-            w.start()
+        if self.aborted():
+            return
+
+        with self.lock:
+            for w in self.workers:
+                if w.start():
+                    self.threadsStarted += 1
 
     def working(self):
         return not self._queue.empty() or self.hasTask()
@@ -201,30 +434,13 @@ class BackgroundThreader:
         if lowest is None:
             return
 
-        qitem._priority = lowest - 1
+        self._queue.reprioritize(qitem, lowest - 1)
 
-
-class ThreaderManager:
-    def __init__(self):
-        self.index = 0
-        self.abandoned = []
-        self.threader = BackgroundThreader(str(self.index))
-
-    def __getattr__(self, name):
-        return getattr(self.threader, name)
-
-    def reset(self):
-        if self.threader._queue.empty() and not self.threader.hasTask():
-            return
-
-        self.index += 1
-        self.abandoned.append(self.threader.abort())
-        self.threader = BackgroundThreader(str(self.index))
-
-    def shutdown(self):
-        self.threader.shutdown()
-        for a in self.abandoned:
-            a.shutdown()
+    def logStats(self):
+        util.DEBUG_LOG(
+            'BGThreader ({0}): {1} workers, {2} threads started, {queued} queued, {added} added, {done} run, {removed} canceled, '
+            'wait avg {avg_wait:.0f}ms max {max_wait:.0f}ms'.format(self.name, len(self.workers), self.threadsStarted, **self._queue.stats())
+        )
 
 
-BGThreader = ThreaderManager()
+BGThreader = BackgroundThreader('main', util.getSetting('background_workers', 8))
@@ -1,11 +1,366 @@
+"""
+Disk cache for thumbnails and artwork.
+
+Images are stored under the profile by the sha1 of their URL, normalized and without
+the token, so a poster PMS has transcoded for us once comes off disk after that. The
+cache is capped at the image_cache_size setting (MB) and evicts the least recently
+used images first. A file's mtime is its last use, so the order survives a restart.
+
+get() hands back the local path of a cached image, otherwise the URL and Kodi fetches
+it as usual. Only what warm() is given gets downloaded, in the background, so that's
+kept to images about to be shown (e.g. the library's prefetched chunks) rather than
+every list item. The index of what's on disk is read in the background as well.
+"""
 import os
+import time
+import urllib
+import hashlib
+import urlparse
+import threading
+import collections
+
 from lib import util
+from lib import backgroundthread
+from plexnet import http, profiler
 
 CACHE_PATH = os.path.join(util.PROFILE, 'avatars')
+IMAGE_CACHE_PATH = os.path.join(util.PROFILE, 'images')
+
+DEFAULT_SIZE = 250  # MB
+EVICT_TO = 0.9  # Evict down to this fraction of the cap so we don't evict on every download
+DOWNLOAD_TIMEOUT = 10
+LOAD_WAIT = 5  # Longest a download waits for the index to be read before going ahead without it
+WORKERS = 2
+DROP_PARAMS = ('x-plex-token',)
 
 if not os.path.exists(CACHE_PATH):
     os.makedirs(CACHE_PATH)
 
 
 def getImage(url, ID):
-    return url, ''
+    return CACHE.get(url), ''
+
+
+def normalizeUrl(url):
+    """ The URL without scheme, token or parameter order, so every URL for one image has the same key. """
+    parsed = urlparse.urlsplit(url)
+    params = sorted(
+        (k, v) for k, v in urlparse.parse_qsl(parsed.query, keep_blank_values=True) if k.lower() not in DROP_PARAMS
+    )
+    return '{0}{1}?{2}'.format(parsed.netloc.lower(), parsed.path, urllib.urlencode(params))
+
+
+def cacheKey(url):
+    if isinstance(url, unicode):
+        url = url.encode('utf8')
+
+    ext = 'format=png' in url and '.png' or '.jpg'
+    return hashlib.sha1(normalizeUrl(url)).hexdigest() + ext
+
+
+class ImageDownloadTask(backgroundthread.Task):
+    def setup(self, url, key):
+        self.url = url
+        self.key = key
+        return self
+
+    def run(self):
+        if self.isCanceled():
+            return
+
+        CACHE.download(self.url, self.key)
+
+
+class ImageIndexTask(backgroundthread.Task):
+    def run(self):
+        CACHE.load()
+
+
+class ImageCache(object):
+    def __init__(self, path):
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.loaded = threading.Event()
+        self.loading = False
+        self.cleared = 0
+        self.size = 0
+        self.maxSize = None
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.threader = backgroundthread.BackgroundThreader('images', WORKERS)
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.failures = 0
+        self.evicted = 0
+
+    @property
+    def enabled(self):
+        return self.getMaxSize() > 0
+
+    def getMaxSize(self):
+        if self.maxSize is None:
+            self.maxSize = util.getSetting('image_cache_size', DEFAULT_SIZE) * 1024 * 1024
+        return self.maxSize
+
+    def setMaxSize(self, mb):
+        self.maxSize = mb * 1024 * 1024
+        if self.maxSize:
+            with self.lock:
+                self._evict()
+        else:
+            self.clear()
+
+    def get(self, url, warm=False):
+        """ The local path for url if it's cached, otherwise url, queued for download if warm is set. """
+        if not url or not url.startswith('http') or not self.enabled:
+            return url
+
+        key = cacheKey(url)
+        with self.lock:
+            entries = self._entries()
+            if key in entries:
+                entries[key] = entries.pop(key)
+                self.hits += 1
+                path = os.path.join(self.path, key)
+            else:
+                self.misses += 1
+                path = None
+
+        if path:
+            profiler.count('image.cache.hit')
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            return path
+
+        profiler.count('image.cache.miss')
+        if warm:
+            self._queue([(url, key)], front=True)
+
+        return url
+
+    def has(self, url):
+        if not url or not self.enabled:
+            return False
+
+        with self.lock:
+            return cacheKey(url) in self._entries()
+
+    def load(self):
+        """ Read what's on disk into the index, least recently used (oldest mtime) first. """
+        start = time.time()
+        cleared = self.cleared
+        files = []
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+
+            for name in os.listdir(self.path):
+                path = os.path.join(self.path, name)
+                try:
+                    if name.endswith('.part'):
+                        os.remove(path)
+                        continue
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, name, stat.st_size))
+        except OSError:
+            util.ERROR()
+
+        entries = collections.OrderedDict((name, size) for mtime, name, size in sorted(files))
+
+        try:
+            with self.lock:
+                if self.cleared != cleared:
+                    # clear() deleted the files while we were reading them
+                    entries = collections.OrderedDict()
+
+                # Anything downloaded while we were reading is the most recently used
+                for key, size in self.entries.items():
+                    entries.pop(key, None)
+                    entries[key] = size
+                self.entries = entries
+                self.size = sum(entries.values())
+                self._evict()
+        finally:
+            # Never leave downloads waiting on an index that isn't coming
+            self.loaded.set()
+
+        util.DEBUG_LOG('Image cache: Loaded {0} images in {1:.0f}ms'.format(len(entries), (time.time() - start) * 1000))
+
+    def warm(self, urls):
+        """
+        Download whichever of urls aren't cached yet, behind anything get() has asked for.
+        Returns the tasks so the caller can cancel them.
+        """
+        if not self.enabled:
+            return []
+
+        with self.lock:
+            entries = self._entries()
+            missing = []
+            for url in urls:
+                if not url or not url.startswith('http'):
+                    continue
+                key = cacheKey(url)
+                if key not in entries:
+                    missing.append((url, key))
+
+        return self._queue(missing)
+
+    def download(self, url, key):
+        cleared = self.cleared
+        try:
+            self.loaded.wait(LOAD_WAIT)
+            with self.lock:
+                if key in self.entries:
+                    return True
+
+            with profiler.span('image.download'):
+                res = http.HttpRequest(url).getPostWithTimeout(DOWNLOAD_TIMEOUT)
+                data = res is not None and res.status_code == 200 and res.content or None
+
+            if not data:
+                self.failures += 1
+                return False
+
+            path = os.path.join(self.path, key)
+            tmp = path + '.part'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+
+            with self.lock:
+                if self.cleared != cleared:
+                    # clear() ran while we were downloading
+                    os.remove(tmp)
+                    return False
+
+                os.rename(tmp, path)
+                entries = self._entries()
+                self.size += len(data) - entries.pop(key, 0)
+                entries[key] = len(data)
+                self.downloads += 1
+                self._evict()
+
+            return True
+        except (IOError, OSError):
+            self.failures += 1
+            util.ERROR()
+            return False
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def clear(self):
+        """
+        Delete every cached image. Called from the settings window, so it works from the
+        directory rather than wait for the index to be read.
+        """
+        self.cancel()
+
+        with self.lock:
+            self.cleared += 1
+            self.evicted += len(self.entries)
+            self.entries = collections.OrderedDict()
+            self.size = 0
+
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+
+        for name in names:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+    def cancel(self):
+        """ Drop the downloads that haven't started yet. """
+        with self.lock:
+            tasks = self.pending.values()
+            self.pending = {}
+
+        for task in tasks:
+            task.cancel()
+
+    def shutdown(self):
+        self.logStats()
+        self.threader.shutdown()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self._entries()),
+                'size': self.size / (1024.0 * 1024),
+                'max': self.getMaxSize() / (1024.0 * 1024),
+                'hits': self.hits,
+                'misses': self.misses,
+                'downloads': self.downloads,
+                'failures': self.failures,
+                'evicted': self.evicted,
+                'pending': len(self.pending)
+            }
+
+    def logStats(self):
+        util.LOG(
+            'Image cache: {entries} images, {size:.1f} of {max:.0f}MB, {hits} hits, {misses} misses, {downloads} downloads, '
+            '{failures} failures, {evicted} evicted, {pending} pending'.format(**self.stats())
+        )
+
+    def _queue(self, missing, front=False):
+        tasks = []
+        with self.lock:
+            for url, key in missing:
+                task = self.pending.get(key)
+                if task and task.isValid():
+                    if front and task.isQueued():
+                        self.threader.moveToFront(task)
+                    continue
+                task = ImageDownloadTask().setup(url, key)
+                self.pending[key] = task
+                tasks.append(task)
+
+        if tasks:
+            if front:
+                self.threader.addTasksToFront(tasks)
+            else:
+                self.threader.addTasks(tasks)
+
+        return tasks
+
+    def _entries(self):
+        # Until the index has been read everything looks like a miss, which only costs a download warm() skips later
+        if not self.loaded.is_set() and not self.loading:
+            self.loading = True
+            self.threader.addTasksToFront([ImageIndexTask()])
+
+        return self.entries
+
+    def _evict(self):
+        maxSize = self.getMaxSize()
+        if self.size <= maxSize:
+            return
+
+        target = maxSize * EVICT_TO
+        start = time.time()
+        count = 0
+        while self.entries and self.size > target:
+            self._remove(next(iter(self.entries)))
+            count += 1
+
+        util.DEBUG_LOG('Image cache: Evicted {0} images in {1:.0f}ms'.format(count, (time.time() - start) * 1000))
+
+    def _remove(self, key):
+        self.size -= self.entries.pop(key, 0)
+        self.evicted += 1
+        try:
+            os.remove(os.path.join(self.path, key))
+        except OSError:
+            pass
+
+
+CACHE = ImageCache(IMAGE_CACHE_PATH)
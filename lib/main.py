@@ -16,6 +16,7 @@ from plexnet import threadutils
 from windows import background, userselect, home, windowutils
 import player
 import backgroundthread
+import image
 import util
 
 
@@ -138,6 +139,7 @@ def _main():
         plexapp.APP.preShutdown()
         util.CRON.stop()
         backgroundthread.BGThreader.shutdown()
+        image.CACHE.shutdown()
         plexapp.APP.shutdown()
         waitForThreads()
         background.setBusy(False)
@@ -1,3 +1,4 @@
+import os
 import sys
 import platform
 import uuid
@@ -8,7 +9,7 @@ import requests
 
 import xbmc
 
-from plexnet import plexapp, myplex
+from plexnet import plexapp, myplex, metadatacache, profiler
 import util
 
 
@@ -23,6 +24,8 @@ def abortFlag():
 
 plexapp.setTimer(PlexTimer)
 plexapp.setAbortFlagFunction(abortFlag)
+plexapp.setConnectEngine(util.getSetting('connect_engine_selector', False))
+plexapp.setResponseDecoder(util.getSetting('json_responses', False) and 'json' or 'xml')
 
 maxVideoRes = plexapp.Res((3840, 2160))  # INTERFACE.globals["supports4k"] and plexapp.Res((3840, 2160)) or plexapp.Res((1920, 1080))
 
@@ -220,6 +223,9 @@ class PlexInterface(plexapp.AppInterface):
 
 plexapp.setInterface(PlexInterface())
 plexapp.setUserAgent(defaultUserAgent())
+metadatacache.CACHE.setPath(os.path.join(util.PROFILE, 'metadata'))
+profiler.PROFILER.setPath(os.path.join(util.PROFILE, 'profile.log'))
+profiler.PROFILER.enable(util.getSetting('profiling', False))
 
 
 class CallbackEvent(plexapp.CompatEvent):
@@ -1,4 +1,6 @@
 import kodigui
 from lib import util
+from lib import image
 
 kodigui.MONITOR = util.MONITOR
+kodigui.IMAGE_CACHE = image.CACHE
@@ -12,7 +12,7 @@ from lib import colors
 from lib import player
 
 import plexnet
-from plexnet import plexapp
+from plexnet import plexapp, http, threadutils, profiler
 
 import windowutils
 import playlists
@@ -26,6 +26,7 @@ from lib.util import T
 
 HUBS_REFRESH_INTERVAL = 300  # 5 Minutes
 HUB_PAGE_SIZE = 10
+HUBS_BATCH_CONCURRENCY = http.POOL_MAXSIZE  # Hub requests in flight at once, each on a kept-alive connection
 
 MOVE_SET = frozenset(
     (
@@ -44,6 +45,14 @@ MOVE_SET = frozenset(
 )
 
 
+# What a hub item's list item is drawn from, items that match on all of these are left in place on refresh
+HUB_ITEM_SIGNATURE = ('ratingKey', 'updatedAt', 'viewCount', 'viewOffset', 'lastViewedAt', 'leafCount', 'viewedLeafCount')
+
+
+def hubItemSignature(obj):
+    return tuple(obj.get(attr) for attr in HUB_ITEM_SIGNATURE)
+
+
 class HubsList(list):
     def init(self):
         self.lastUpdated = time.time()
@@ -65,7 +74,7 @@ class SectionHubsTask(backgroundthread.Task):
             return
 
         try:
-            hubs = HubsList(plexapp.SERVERMANAGER.selectedServer.hubs(self.section.key, count=HUB_PAGE_SIZE)).init()
+            hubs = HubsList(plexapp.SERVERMANAGER.selectedServer.hubs(self.section.key, count=HUB_PAGE_SIZE, cache=True)).init()
             if self.isCanceled():
                 return
             self.callback(self.section, hubs)
@@ -74,6 +83,106 @@ class SectionHubsTask(backgroundthread.Task):
             self.callback(self.section, False)
 
 
+class SectionHubsBatchTask(backgroundthread.Task):
+    """
+    Loads the hubs for a list of sections together, HUBS_BATCH_CONCURRENCY requests at a
+    time over the server's keep-alive session. Sections are taken in order, which
+    prioritize() can change as the user moves around, and callback(section, hubs) is
+    called as each one arrives.
+    """
+
+    def setup(self, sections, callback):
+        self.sections = list(sections)
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.loading = []
+        self.active = 0
+        self.allLoaded = threading.Event()
+        return self
+
+    def hasSection(self, section):
+        """ Whether section is still waiting to be loaded or being loaded now. """
+        with self.lock:
+            return section in self.sections or section in self.loading
+
+    def prioritize(self, section):
+        """ Load section next, returns False if it isn't waiting to be loaded. """
+        with self.lock:
+            if section not in self.sections:
+                return False
+
+            self.sections.remove(section)
+            self.sections.insert(0, section)
+            return True
+
+    def run(self):
+        if self.isCanceled():
+            return
+
+        server = plexapp.SERVERMANAGER.selectedServer
+        if not server:
+            # Could happen during sign-out for instance
+            return
+
+        start = time.time()
+        count = len(self.sections)
+        self.active = 1
+        for i in range(min(HUBS_BATCH_CONCURRENCY, count) - 1):
+            threadutils.EXECUTOR.submit(self._fetchAll, (server, True), name='hubs-batch')
+
+        # This thread works through the sections too, so everything gets loaded even if no
+        # helper ever gets an executor worker. Helpers that start late find nothing left.
+        self._fetchAll(server)
+
+        while not self.allLoaded.wait(0.5):
+            if self.isCanceled():
+                return
+
+        elapsed = time.time() - start
+        profiler.record('HomeWindow.allHubs', elapsed)
+        util.DEBUG_LOG('Hubs: Loaded {0} sections in {1:.2f}s'.format(count, elapsed))
+
+    def _fetchAll(self, server, helper=False):
+        if helper:
+            with self.lock:
+                if not self.sections or self.isCanceled():
+                    return
+                self.active += 1
+
+        try:
+            while not self.isCanceled():
+                with self.lock:
+                    if not self.sections:
+                        break
+                    section = self.sections.pop(0)
+                    self.loading.append(section)
+
+                try:
+                    self._fetch(server, section)
+                except:
+                    util.ERROR()
+                finally:
+                    with self.lock:
+                        self.loading.remove(section)
+        finally:
+            with self.lock:
+                self.active -= 1
+                if not self.active:
+                    self.allLoaded.set()
+
+    def _fetch(self, server, section):
+        try:
+            hubs = HubsList(server.hubs(section.key, count=HUB_PAGE_SIZE, cache=True)).init()
+        except plexnet.exceptions.BadRequest:
+            util.DEBUG_LOG('404 on section: {0}'.format(repr(section.title)))
+            hubs = False
+
+        if self.isCanceled():
+            return
+
+        self.callback(section, hubs)
+
+
 class UpdateHubTask(backgroundthread.Task):
     def setup(self, hub, callback):
         self.hub = hub
@@ -292,7 +401,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
     def __init__(self, *args, **kwargs):
         kodigui.BaseWindow.__init__(self, *args, **kwargs)
         self.lastSection = HomeSection
-        self.tasks = []
+        self.tasks = backgroundthread.Tasks()
         self.closeOption = None
         self.hubControls = None
         self.backgroundSet = False
@@ -499,7 +608,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
 
     def updateOnDeckHubs(self, **kwargs):
         tasks = [UpdateHubTask().setup(hub, self.updateHubCallback) for hub in self.updateHubs.values()]
-        self.tasks += tasks
+        self.tasks.add(tasks)
         backgroundthread.BGThreader.addTasks(tasks)
 
     def showBusy(self, on=True):
@@ -508,9 +617,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
     @busy.dialog()
     def serverRefresh(self):
         backgroundthread.BGThreader.reset()
-        if self.tasks:
-            for task in self.tasks:
-                task.cancel()
+        self.tasks.cancel()
 
         self.setProperty('hub.focus', '')
         self.displayServerAndUser()
@@ -588,7 +695,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
         mli.setBoolProperty('is.updating', True)
         self.cleanTasks()
         task = ExtendHubTask().setup(control.dataSource, self.extendHubCallback)
-        self.tasks.append(task)
+        self.tasks.add(task)
         backgroundthread.BGThreader.addTask(task)
 
     def displayServerAndUser(self, **kwargs):
@@ -607,7 +714,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
             self.setProperty('server.iconmod', '')
 
     def cleanTasks(self):
-        self.tasks = [t for t in self.tasks if t.isValid()]
+        self.tasks.clean()
 
     def sectionChanged(self, force=False):
         self.sectionChangeTimeout = time.time() + 0.3
@@ -678,7 +785,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
             return
 
         if plexapp.SERVERMANAGER.selectedServer.hasHubs():
-            self.tasks = [SectionHubsTask().setup(s, self.sectionHubsCallback) for s in [HomeSection, PlaylistsSection] + sections]
+            self.tasks = backgroundthread.Tasks([SectionHubsBatchTask().setup([HomeSection, PlaylistsSection] + sections, self.sectionHubsCallback)])
             backgroundthread.BGThreader.addTasks(self.tasks)
 
         for section in sections:
@@ -731,20 +838,27 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
 
         if not hubs:
             for task in self.tasks:
-                if task.section == section:
+                if isinstance(task, SectionHubsBatchTask):
+                    if task.prioritize(section):
+                        if task.isQueued():
+                            backgroundthread.BGThreader.moveToFront(task)
+                        break
+                elif getattr(task, 'section', None) == section:
                     backgroundthread.BGThreader.moveToFront(task)
                     break
             return
 
         if time.time() - hubs.lastUpdated > HUBS_REFRESH_INTERVAL:
-            util.DEBUG_LOG('Section is stale: REFRESHING - update: {0}'.format(update))
+            # Keep showing what we have, the refreshed hubs are patched in by sectionHubsCallback()
             self.cleanTasks()
-            if not update:
-                if section.key in self.sectionHubs:
-                    self.sectionHubs[section.key] = None
-            self.tasks.append(SectionHubsTask().setup(section, self.sectionHubsCallback))
-            backgroundthread.BGThreader.addTask(self.tasks[-1])
-            return
+            if not self.hasHubsTask(section):
+                util.DEBUG_LOG('Section is stale: REFRESHING - update: {0}'.format(update))
+                self.tasks.add(SectionHubsTask().setup(section, self.sectionHubsCallback))
+                backgroundthread.BGThreader.addTask(self.tasks[-1])
+
+            if update:
+                self.showBusy(False)
+                return
 
         util.DEBUG_LOG('Showing hubs - Section: {0} - Update: {1}'.format(section.key, update))
         try:
@@ -786,6 +900,16 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
         finally:
             self.showBusy(False)
 
+    def hasHubsTask(self, section):
+        for task in self.tasks:
+            if isinstance(task, SectionHubsBatchTask):
+                if task.hasSection(section):
+                    return True
+            elif getattr(task, 'section', None) == section:
+                return True
+
+        return False
+
     def showHub(self, hub, items=None):
         identifier = re.sub('\.\d+$', '', hub.hubIdentifier)
         if identifier in self.HUBMAP:
@@ -929,6 +1053,17 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
 
     def _showHub(self, hub, hubitems=None, index=None, with_progress=False, with_art=False, ar16x9=False, text2lines=False, **kwargs):
         control = self.hubControls[index]
+
+        # When refreshing the hub already on show, list items whose source item hasn't changed are
+        # kept, wherever the item has moved to in the hub
+        current = []
+        reusable = {}
+        if not hubitems and control.dataSource and control.dataSource.hubIdentifier == hub.hubIdentifier:
+            current = control.items
+            for mli in current:
+                if mli.dataSource:
+                    reusable.setdefault(hubItemSignature(mli.dataSource), []).append(mli)
+
         control.dataSource = hub
 
         if not hub.items and not hubitems:
@@ -942,6 +1077,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
         self.setProperty('hub.text2lines.4{0:02d}'.format(index), text2lines and '1' or '')
 
         items = []
+        new = []
 
         for obj in hubitems or hub.items:
             if not self.backgroundSet:
@@ -949,31 +1085,49 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
                 self.setProperty(
                     'background', obj.art.asTranscodedImageURL(self.width, self.height, blur=128, opacity=60, background=colors.noAlpha.Background)
                 )
+
+            matches = reusable.get(hubItemSignature(obj))
+            if matches:
+                old = matches.pop(0)
+                old.dataSource = obj
+                items.append(old)
+                continue
+
             mli = self.createListItem(obj, wide=with_art)
             if mli:
                 items.append(mli)
+                new.append(mli)
 
         if with_progress:
-            for mli in items:
+            for mli in new:
                 mli.setProperty('progress', util.getProgressImage(mli.dataSource))
         if with_art:
-            for mli in items:
+            for mli in new:
                 mli.setThumbnailImage(mli.dataSource.art.asTranscodedImageURL(*self.THUMB_AR16X9_DIM))
                 mli.setProperty('thumb.fallback', 'script.plex/thumb_fallbacks/movie16x9.png')
         if ar16x9:
-            for mli in items:
+            for mli in new:
                 mli.setProperty('thumb.fallback', 'script.plex/thumb_fallbacks/movie16x9.png')
 
         if hub.more.asBool():
-            end = kodigui.ManagedListItem('')
-            end.setBoolProperty('is.end', True)
-            items.append(end)
+            old = current and current[-1] or None
+            if old and old.getProperty('is.end') and not old.getProperty('is.updating'):
+                items.append(old)
+            else:
+                end = kodigui.ManagedListItem('')
+                end.setBoolProperty('is.end', True)
+                items.append(end)
 
         if hubitems:
             end = control.size() - 1
             control.replaceItem(end, items[0])
             control.addItems(items[1:])
             control.selectItem(end)
+        elif current:
+            changed = control.patchItems(items)
+            profiler.count('home.hub.items.changed', changed)
+            profiler.count('home.hub.items.kept', len(items) - len(new))
+            util.DEBUG_LOG('Hub {0}: {1} of {2} items changed'.format(hub.hubIdentifier, changed, len(items)))
         else:
             control.replaceItems(items)
 
@@ -1127,6 +1281,4 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
         self.processCommand(opener.handleOpen(musicplayer.MusicPlayerWindow))
 
     def finished(self):
-        if self.tasks:
-            for task in self.tasks:
-                task.cancel()
+        self.tasks.cancel()
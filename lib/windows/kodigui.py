@@ -5,7 +5,10 @@ import time
 import threading
 import traceback
 
+from plexnet import profiler
+
 MONITOR = None
+IMAGE_CACHE = None  # Set to something with get(url) to have list item thumbnails swapped for local copies
 
 
 class BaseFunctions:
@@ -98,7 +101,8 @@ class BaseWindow(xbmcgui.WindowXML, BaseFunctions):
             self.onReInit()
         else:
             self.started = True
-            self.onFirstInit()
+            with profiler.span('{0}.onFirstInit'.format(self.__class__.__name__)):
+                self.onFirstInit()
             self.finishedInit = True
 
     def onFirstInit(self):
@@ -150,7 +154,8 @@ class BaseDialog(xbmcgui.WindowXMLDialog, BaseFunctions):
             self.onReInit()
         else:
             self.started = True
-            self.onFirstInit()
+            with profiler.span('{0}.onFirstInit'.format(self.__class__.__name__)):
+                self.onFirstInit()
 
     def onFirstInit(self):
         pass
@@ -225,6 +230,8 @@ DUMMY_LIST_ITEM = xbmcgui.ListItem()
 
 class ManagedListItem(object):
     def __init__(self, label='', label2='', iconImage='', thumbnailImage='', path='', data_source=None, properties=None):
+        if thumbnailImage and IMAGE_CACHE:
+            thumbnailImage = IMAGE_CACHE.get(thumbnailImage)
         self._listItem = xbmcgui.ListItem(label, label2, iconImage, thumbnailImage, path)
         self.dataSource = data_source
         self.properties = {}
@@ -363,6 +370,8 @@ class ManagedListItem(object):
         return self.listItem.setSubtitles(subtitles)  # List of strings - HELIX
 
     def setThumbnailImage(self, thumb):
+        if thumb and IMAGE_CACHE:
+            thumb = IMAGE_CACHE.get(thumb)
         self.thumbnailImage = thumb
         return self.listItem.setThumbnailImage(thumb)
 
@@ -479,6 +488,57 @@ class ManagedControlList(object):
 
         self._updateItems(0, self.size())
 
+    def patchItems(self, managed_items):
+        """
+        Like replaceItems(), but positions that already hold the same managed item are left
+        alone, so only the list items that actually changed are touched. Managed items that
+        are kept but have moved are redrawn at their new position. Returns the number of
+        positions replaced, added or removed.
+        """
+        if not self.items:
+            self.addItems(managed_items)
+            return len(managed_items)
+
+        oldSize = self.size()
+        size = len(managed_items)
+        changed = 0
+        kept = set(id(mli) for mli in managed_items)
+
+        for pos in range(min(oldSize, size)):
+            mli = managed_items[pos]
+            old = self.items[pos]
+            if mli is old:
+                continue
+
+            if id(old) not in kept:
+                old.onDestroy()
+                old.invalidate()
+
+            if not mli._ID:
+                mli._ID = self._nextID()
+            self.items[pos] = mli
+            self._properties.update(mli.properties)
+            mli._manager = self
+            mli._listItem = self.control.getListItem(pos)
+            mli._updateListItem()
+            changed += 1
+
+        if size > oldSize:
+            self.addItems(managed_items[oldSize:])
+        elif size < oldSize:
+            pos = self.getSelectedPosition()
+            for idx in range(oldSize - 1, size - 1, -1):
+                if id(self.items[idx]) not in kept:
+                    self.items[idx].onDestroy()
+                    self.items[idx].invalidate()
+                self.control.removeItem(idx)
+            del self.items[size:]
+
+            if size and pos >= size:
+                self.selectItem(size - 1)
+
+        return changed + abs(size - oldSize)
+
     def getListItem(self, pos):
         li = self.control.getListItem(pos)
         mli = self.items[pos]
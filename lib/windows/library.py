@@ -4,6 +4,8 @@ import urllib
 import json
 import time
 import threading
+import functools
+import collections
 
 import xbmc
 import xbmcgui
@@ -12,6 +14,7 @@ import kodigui
 from lib import colors
 from lib import util
 from lib import backgroundthread
+from lib import image
 
 import busy
 import subitems
@@ -22,13 +25,18 @@ import dropdown
 import opener
 import windowutils
 
-from plexnet import playqueue
+from plexnet import playqueue, profiler
 
 from lib.util import T
 
 CHUNK_SIZE = 200
 # CHUNK_SIZE = 30
 
+PREFETCH_MAX_AHEAD = 3      # Chunks fetched ahead of the wrapped list when scrolling fast
+PREFETCH_LOOKAHEAD = 2.0    # Seconds of scrolling at the current speed to fetch ahead for
+PREFETCH_CACHE_CHUNKS = 12  # Fetched chunks kept for scrolling back
+PREFETCH_IMAGE_CHUNKS = 2   # Chunks beyond the wrapped list whose posters and art are downloaded before they're shown
+
 KEYS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 
 MOVE_SET = frozenset(
@@ -163,12 +171,22 @@ class ChunkRequestTask(backgroundthread.Task):
                 type_ = 4
             elif ITEM_TYPE == 'album':
                 type_ = 9
-            items = self.section.all(self.start, self.size, self.filter, self.sort, self.unwatched, type_=type_)
+            # Stream the chunk so items are built while the response is still arriving
+            stream = self.section.all(self.start, self.size, self.filter, self.sort, self.unwatched, type_=type_, stream=True, cache=True)
+            items = []
+            try:
+                for item in stream:
+                    if self.isCanceled():
+                        return
+                    items.append(item)
+            finally:
+                stream.close()
+
             if self.isCanceled():
                 return
             self.callback(items, self.start)
-        except plexnet.exceptions.BadRequest:
-            util.DEBUG_LOG('404 on section: {0}'.format(repr(self.section.title)))
+        except plexnet.exceptions.BadRequest, e:
+            util.DEBUG_LOG('Failed to load chunk at {0} of section {1}: {2}'.format(self.start, repr(self.section.title), e))
 
 
 class PhotoPropertiesTask(backgroundthread.Task):
@@ -339,6 +357,274 @@ class ChunkModeWrapped(object):
             self.objects = self.objects[:CHUNK_SIZE * 2] + objects
 
 
+class ChunkPrefetcher(object):
+    """
+    Fetches chunks for a ChunkModeWrapped list ahead of the viewport. The wrapped list
+    only holds the three chunks around midStart, so everything fetched is also kept
+    in a small LRU, and shifting onto a chunk that's already there fills it without a
+    request. Scroll speed and direction decide how far ahead to fetch, and in-flight
+    chunks that end up far from the viewport are canceled.
+
+    Chunks fetched ahead also have their thumbnails and art warmed in the image cache,
+    at low priority, so they are on disk by the time the chunk is shown. Non-chunked
+    lists already hold every item, so for those only the images are warmed, for the
+    chunks ahead of the selected position (see warmAhead()).
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.cache = collections.OrderedDict()
+        self.inFlight = {}
+        self.pending = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.lastPos = None
+        self.lastTime = 0
+        self.velocity = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.canceled = 0
+        self.populateTotal = 0.0
+        self.populateMax = 0.0
+        self.populated = 0
+        self.imageTasks = {}
+        self.warmed = {}
+        self.imagesQueued = 0
+        self.imagesCanceled = 0
+        self.imageHits = 0
+        self.imageMisses = 0
+
+    def reset(self):
+        with self.lock:
+            self.generation += 1
+            for task in self.inFlight.values():
+                task.cancel()
+            self.inFlight = {}
+            self.pending = {}
+            self.cache.clear()
+            self.lastPos = None
+            self.velocity = 0.0
+            imageTasks = self.imageTasks
+            self.imageTasks = {}
+            self.warmed = {}
+
+        for tasks in imageTasks.values():
+            self._cancelImages(tasks)
+
+    def has(self, start):
+        with self.lock:
+            return start in self.cache
+
+    def get(self, start):
+        with self.lock:
+            items = self.cache.pop(start, None)
+            if items is None:
+                return None
+            self.cache[start] = items
+            return list(items)
+
+    def fetch(self, starts):
+        """ Fill the chunks at starts, from the cache where possible, with the first start most urgent. """
+        tasks = []
+        for start in starts:
+            items = self.get(start)
+            if items is not None:
+                self.hits += 1
+                self._populated(0)
+                self._imagesShown(start)
+                self.window.chunkCallback(items, start)
+                continue
+
+            self.misses += 1
+            with self.lock:
+                self.pending.setdefault(start, time.time())
+                task = self.inFlight.get(start)
+
+            if task and task.isQueued():
+                tasks.append(task)
+            elif not task or not task.isValid():
+                tasks.append(self._task(start))
+
+        if tasks:
+            backgroundthread.BGThreader.addTasksToFront(tasks)
+
+    def _track(self, pos):
+        now = time.time()
+        if self.lastPos is not None and now - self.lastTime < 1:
+            speed = (pos - self.lastPos) / max(now - self.lastTime, 0.01)
+            self.velocity = (self.velocity + speed) / 2
+        else:
+            self.velocity = 0.0
+        self.lastPos = pos
+        self.lastTime = now
+
+    def update(self, pos):
+        """ Called with the selected position as the user moves, fetches ahead of where they're going. """
+        self._track(pos)
+
+        chunkMode = self.window.chunkMode
+        ahead = min(PREFETCH_MAX_AHEAD, 1 + int(abs(self.velocity) * PREFETCH_LOOKAHEAD / CHUNK_SIZE))
+        direction = self.velocity < 0 and -1 or 1
+
+        tasks = []
+        for i in range(ahead):
+            start = chunkMode.midStart + (direction * CHUNK_SIZE * (2 + i))
+            if start < 0 or start >= chunkMode.itemCount:
+                break
+
+            with self.lock:
+                if start in self.cache or start in self.inFlight:
+                    continue
+            tasks.append(self._task(start))
+            self.prefetched += 1
+
+        self._cancelFar(chunkMode.midStart)
+
+        if tasks:
+            backgroundthread.BGThreader.addTasks(tasks)
+
+    def warmAhead(self, pos):
+        """ update() for non-chunked lists: warms the images of the chunks past the one at pos. """
+        if pos == self.lastPos:
+            return
+
+        self._track(pos)
+
+        current = pos - pos % CHUNK_SIZE
+        self._imagesShown(current)
+
+        items = self.window.showPanelControl.items
+        direction = self.velocity < 0 and -1 or 1
+        for i in range(1, PREFETCH_IMAGE_CHUNKS + 1):
+            start = current + direction * CHUNK_SIZE * i
+            if start < 0 or start >= len(items):
+                break
+
+            with self.lock:
+                if start in self.imageTasks:
+                    continue
+
+            # Chunks that haven't loaded yet get their turn on a later move
+            objs = [mli.dataSource for mli in items[start:start + CHUNK_SIZE] if mli.dataSource]
+            if objs:
+                self._warmImages(self.generation, start, objs)
+
+        self._cancelFarImages(current, CHUNK_SIZE * (PREFETCH_IMAGE_CHUNKS + 1))
+
+    def _task(self, start):
+        window = self.window
+        task = ChunkRequestTask().setup(
+            window.section, start, CHUNK_SIZE, functools.partial(self._fetched, self.generation),
+            filter_=window.getFilterOpts(), sort=window.getSortOpts(), unwatched=window.filterUnwatched
+        )
+        with self.lock:
+            self.inFlight[start] = task
+        window.tasks.add(task)
+        return task
+
+    def _fetched(self, generation, items, start):
+        with self.lock:
+            if generation != self.generation:
+                return
+
+            self.inFlight.pop(start, None)
+            self.cache.pop(start, None)
+            self.cache[start] = items
+            while len(self.cache) > PREFETCH_CACHE_CHUNKS:
+                self.warmed.pop(self.cache.popitem(last=False)[0], None)
+            requested = self.pending.pop(start, None)
+
+        if requested is not None:
+            self._populated(time.time() - requested)
+
+        chunkMode = self.window.chunkMode
+        if chunkMode.posIsValid(start):
+            self.window.chunkCallback(list(items), start)
+        elif abs(start - chunkMode.midStart) <= CHUNK_SIZE * (1 + PREFETCH_IMAGE_CHUNKS):
+            self._warmImages(generation, start, items)
+
+    def _cancelFar(self, midStart):
+        far = CHUNK_SIZE * (PREFETCH_MAX_AHEAD + 2)
+        with self.lock:
+            for start, task in self.inFlight.items():
+                if abs(start - midStart) > far:
+                    task.cancel()
+                    del self.inFlight[start]
+                    self.pending.pop(start, None)
+                    self.canceled += 1
+
+        self._cancelFarImages(midStart, far)
+
+    def _cancelFarImages(self, pos, far):
+        with self.lock:
+            farImages = [self.imageTasks.pop(start) for start in self.imageTasks.keys() if abs(start - pos) > far]
+
+        for tasks in farImages:
+            self._cancelImages(tasks)
+
+    def _warmImages(self, generation, start, items):
+        urls = self.window.chunkImageUrls(items)
+        tasks = image.CACHE.warm(urls)
+        with self.lock:
+            if generation != self.generation:
+                stale = True
+            else:
+                stale = False
+                self.warmed[start] = urls
+                self.imageTasks[start] = tasks
+                self.imagesQueued += len(tasks)
+
+        if stale:
+            self._cancelImages(tasks)
+
+    def _cancelImages(self, tasks):
+        for task in tasks:
+            if task.isQueued():
+                task.cancel()
+                self.imagesCanceled += 1
+
+    def _imagesShown(self, start):
+        # How many of a warmed chunk's images made it to disk before it was shown
+        with self.lock:
+            urls = self.warmed.pop(start, None)
+            self.imageTasks.pop(start, None)
+
+        if not urls:
+            return
+
+        ready = len([u for u in urls if image.CACHE.has(u)])
+        self.imageHits += ready
+        self.imageMisses += len(urls) - ready
+        profiler.count('library.image.prefetch.hit', ready)
+        profiler.count('library.image.prefetch.miss', len(urls) - ready)
+
+    def _populated(self, elapsed):
+        self.populated += 1
+        self.populateTotal += elapsed
+        self.populateMax = max(self.populateMax, elapsed)
+        profiler.record('library.chunk.populate', elapsed)
+
+    def logStats(self):
+        if not self.hits and not self.misses:
+            return
+
+        util.DEBUG_LOG(
+            'Chunk prefetch: {0} hits, {1} misses ({2:.0f}% hit rate), {3} prefetched, {4} canceled, '
+            'time to populate avg {5:.0f}ms max {6:.0f}ms'.format(
+                self.hits, self.misses, self.hits * 100.0 / (self.hits + self.misses), self.prefetched, self.canceled,
+                self.populated and self.populateTotal / self.populated * 1000 or 0, self.populateMax * 1000
+            )
+        )
+
+        shown = self.imageHits + self.imageMisses
+        util.DEBUG_LOG(
+            'Image prefetch: {0} queued, {1} canceled, {2} of {3} images on disk when shown ({4:.0f}% hit rate)'.format(
+                self.imagesQueued, self.imagesCanceled, self.imageHits, shown, shown and self.imageHits * 100.0 / shown or 0
+            )
+        )
+
+
 class CustomScrollBar(object):
     def __init__(self, window, bar_group_id, bar_image_id, bar_image_focus_id, button_id, min_bar_height=20):
         self._barGroup = window.getControl(bar_group_id)
@@ -396,6 +682,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         self.keyItems = {}
         self.firstOfKeyItems = {}
         self.tasks = backgroundthread.Tasks()
+        self.prefetcher = ChunkPrefetcher(self)
         self.backgroundSet = False
         self.showPanelControl = None
         self.keyListControl = None
@@ -450,6 +737,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
 
     def doClose(self):
         self.tasks.cancel()
+        self.prefetcher.logStats()
         kodigui.MultiWindow.doClose(self)
 
     def onFirstInit(self):
@@ -496,6 +784,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
                 if controlID == self.POSTERS_PANEL_ID or controlID == self.SCROLLBAR_ID:
                     self.updateKey()
                     self.checkChunkedNav(action)
+                    self.warmImagesAhead()
                 elif controlID == self.CUSTOM_SCOLLBAR_BUTTON_ID:
                     if action == xbmcgui.ACTION_MOVE_UP:
                         self.shiftSelection(-12)
@@ -653,6 +942,14 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
 
         self.selectKey(mli)
 
+    def warmImagesAhead(self):
+        if self.chunkMode or self.section.TYPE in ('photo', 'photodirectory'):
+            return
+
+        pos = self.showPanelControl.getSelectedPosition()
+        if pos >= 0:
+            self.prefetcher.warmAhead(pos)
+
     def checkChunkedNav(self, action=None, idx=None):
         if not self.chunkMode:
             return
@@ -709,6 +1006,8 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         elif self.chunkMode.posIsBackward(pos):
             self.shiftChunks(-1)
 
+        self.prefetcher.update(pos)
+
     def shiftChunks(self, mod=1):
         start = self.chunkMode.shift(mod)
         if start is None:
@@ -717,13 +1016,9 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         if start < 0:
             self.chunkCallback([None] * CHUNK_SIZE, -CHUNK_SIZE)
         else:
-            self.chunkCallback([False] * CHUNK_SIZE, start)
-            task = ChunkRequestTask().setup(
-                self.section, start, CHUNK_SIZE, self.chunkCallback, filter_=self.getFilterOpts(), sort=self.getSortOpts(), unwatched=self.filterUnwatched
-            )
-
-            self.tasks.add(task)
-            backgroundthread.BGThreader.addTasksToFront([task])
+            if not self.prefetcher.has(start):
+                self.chunkCallback([False] * CHUNK_SIZE, start)
+            self.prefetcher.fetch([start])
 
     def selectKey(self, mli=None):
         if not mli:
@@ -772,23 +1067,9 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         if not start:
             mul = 2
 
-        tasks = []
-        for x in range(mul):
-            task = ChunkRequestTask().setup(
-                self.section,
-                start + (CHUNK_SIZE * x),
-                CHUNK_SIZE,
-                self.chunkCallback,
-                filter_=self.getFilterOpts(),
-                sort=self.getSortOpts(),
-                unwatched=self.filterUnwatched
-            )
-
-            self.tasks.add(task)
-            tasks.append(task)
-
-        mid = tasks.pop(1)
-        backgroundthread.BGThreader.addTasksToFront([mid] + tasks)
+        starts = [start + (CHUNK_SIZE * x) for x in range(mul)]
+        mid = starts.pop(1)
+        self.prefetcher.fetch([mid] + starts)
 
     def keyClicked(self):
         li = self.keyListControl.getSelectedItem()
@@ -1266,7 +1547,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         fallback = 'script.plex/thumb_fallbacks/{0}.png'.format(TYPE_KEYS.get(self.section.type, TYPE_KEYS['movie'])['fallback'])
 
         if self.sort != 'titleSort':
-            sectionAll = self.section.all(0, 0, filter_=self.getFilterOpts(), sort=self.getSortOpts(), unwatched=self.filterUnwatched, type_=type_)
+            sectionAll = self.section.all(0, 0, filter_=self.getFilterOpts(), sort=self.getSortOpts(), unwatched=self.filterUnwatched, type_=type_, cache=True)
             totalSize = sectionAll.totalSize.asInt()
             if not self.chunkMode:
                 for x in range(totalSize):
@@ -1333,19 +1614,19 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         self.keyListControl.addItems(jitems)
 
         self.showPanelControl.selectItem(0)
+        self.prefetcher.reset()
+
+        if self.chunkMode:
+            self.prefetcher.fetch(range(0, min(totalSize, CHUNK_SIZE * 2), CHUNK_SIZE))
+            return
 
         tasks = []
-        ct = 0
         for start in range(0, totalSize, CHUNK_SIZE):
             tasks.append(
                 ChunkRequestTask().setup(
                     self.section, start, CHUNK_SIZE, self.chunkCallback, filter_=self.getFilterOpts(), sort=self.getSortOpts(), unwatched=self.filterUnwatched
                 )
             )
-            ct += 1
-
-            if self.chunkMode and ct > 1:
-                break
 
         self.tasks.add(tasks)
         backgroundthread.BGThreader.addTasksToFront(tasks)
@@ -1483,6 +1764,25 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         else:
             self._chunkCallback(items, start)
 
+    def chunkImageUrls(self, items):
+        """ The thumbnail and art URLs _chunkCallback() sets for items, at the same sizes. """
+        keys = TYPE_KEYS.get(self.section.type, TYPE_KEYS['movie'])
+        thumbDim = keys['thumb_dim']
+        artDim = keys.get('art_dim', (256, 256))
+        withThumb = ITEM_TYPE != 'episode'
+        withArt = ITEM_TYPE == 'episode' or (ITEM_TYPE != 'album' and self.section.TYPE in ('movie', 'show'))
+
+        urls = []
+        for obj in items:
+            if not obj:
+                continue
+            if withThumb:
+                urls.append(obj.defaultThumb.asTranscodedImageURL(*thumbDim))
+            if withArt:
+                urls.append(obj.defaultArt.asTranscodedImageURL(*artDim))
+
+        return urls
+
     def _chunkCallback(self, items, start):
         if self.chunkMode and not self.chunkMode.posIsValid(start):
             return
@@ -1519,7 +1819,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
                         # # mli.setProperty('key', self.chunkMode.getKey(pos))
 
                         mli.setLabel2(util.durationToText(obj.fixedDuration()))
-                        mli.setProperty('art', obj.defaultArt.asTranscodedImageURL(*artDim))
+                        mli.setProperty('art', image.CACHE.get(obj.defaultArt.asTranscodedImageURL(*artDim), warm=False))
                         if not obj.isWatched:
                             mli.setProperty('unwatched', '1')
                     else:
@@ -1539,7 +1839,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
                         mli.setProperty('index', str(pos))
                         mli.setLabel(u'{0} \u2022 {1}'.format(obj.parentTitle, obj.title))
 
-                        mli.setThumbnailImage(obj.defaultThumb.asTranscodedImageURL(*thumbDim))
+                        mli.setThumbnailImage(image.CACHE.get(obj.defaultThumb.asTranscodedImageURL(*thumbDim), warm=False))
 
                         mli.setProperty('summary', obj.summary)
 
@@ -1564,7 +1864,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
                     if obj:
                         mli.setProperty('index', str(pos))
                         mli.setLabel(obj.defaultTitle or '')
-                        mli.setThumbnailImage(obj.defaultThumb.asTranscodedImageURL(*thumbDim))
+                        mli.setThumbnailImage(image.CACHE.get(obj.defaultThumb.asTranscodedImageURL(*thumbDim), warm=False))
                         mli.dataSource = obj
                         mli.setProperty('summary', obj.get('summary'))
 
@@ -1573,7 +1873,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
 
                         if showUnwatched:
                             mli.setLabel2(util.durationToText(obj.fixedDuration()))
-                            mli.setProperty('art', obj.defaultArt.asTranscodedImageURL(*artDim))
+                            mli.setProperty('art', image.CACHE.get(obj.defaultArt.asTranscodedImageURL(*artDim), warm=False))
                             if not obj.isWatched:
                                 if self.section.TYPE == 'show':
                                     mli.setProperty('unwatched.count', str(obj.unViewedLeafCount))
@@ -4,9 +4,12 @@ import kodigui
 import windowutils
 
 from lib import util
+from lib import backgroundthread
+from lib import image
 from lib.util import T
 
 import plexnet
+from plexnet import plexapp, profiler
 
 
 class Setting(object):
@@ -85,6 +88,43 @@ class BoolSetting(BasicSetting):
     type = 'BOOL'
 
 
+class ProfilingSetting(BoolSetting):
+    def set(self, val):
+        BoolSetting.set(self, val)
+        profiler.PROFILER.enable(val)
+
+
+class ConnectEngineSetting(BoolSetting):
+    def set(self, val):
+        BoolSetting.set(self, val)
+        plexapp.setConnectEngine(val)
+
+
+class JSONResponsesSetting(BoolSetting):
+    def set(self, val):
+        BoolSetting.set(self, val)
+        plexapp.setResponseDecoder(val and 'json' or 'xml')
+
+
+class ActionSetting(BasicSetting):
+    type = 'ACTION'
+
+    def __init__(self, ID, label, action, desc=''):
+        BasicSetting.__init__(self, ID, label, None, desc)
+        self.action = action
+
+    def valueLabel(self):
+        return ''
+
+    def run(self):
+        self.action()
+
+
+def showProfile():
+    text = profiler.PROFILER.read() or T(32467, 'Nothing has been profiled yet')
+    xbmcgui.Dialog().textviewer(T(32466, 'View Profile'), text)
+
+
 class OptionsSetting(BasicSetting):
     type = 'OPTIONS'
 
@@ -109,6 +149,18 @@ class OptionsSetting(BasicSetting):
         return 0
 
 
+class WorkerCountSetting(OptionsSetting):
+    def set(self, val):
+        OptionsSetting.set(self, val)
+        backgroundthread.BGThreader.setWorkerCount(val)
+
+
+class ImageCacheSizeSetting(OptionsSetting):
+    def set(self, val):
+        OptionsSetting.set(self, val)
+        image.CACHE.setMaxSize(val)
+
+
 class InfoSetting(BasicSetting):
     type = 'INFO'
 
@@ -232,6 +284,27 @@ class Settings(object):
                 BoolSetting('gdm_discovery', T(32042, 'Server Discovery (GDM)'), True),
                 BoolSetting('kiosk.mode', T(32043, 'Start Plex On Kodi Startup'), False),
                 BoolSetting('debug', T(32024, 'Debug Logging'), False),
+                ConnectEngineSetting('connect_engine_selector', T(32464, 'Multiplex connection attempts (experimental)'), False).description(
+                    T(32476, 'Wait on all connection attempts from one thread instead of a thread each. Can make finding servers quicker.')
+                ),
+                WorkerCountSetting(
+                    'background_workers', T(32469, 'Background Workers'), 8, tuple((c, str(c)) for c in (2, 4, 6, 8, 12, 16))
+                ).description(
+                    T(32470, 'Threads used to load library chunks and hubs in the background. Fewer suit slower devices.')
+                ),
+                ImageCacheSizeSetting(
+                    'image_cache_size', T(32471, 'Image Cache Size'), image.DEFAULT_SIZE,
+                    ((0, T(32473, 'Off')),) + tuple((s, '{0} MB'.format(s)) for s in (100, 250, 500, 1000))
+                ).description(
+                    T(32472, 'Disk space for posters and artwork kept on this device, so they are not fetched from the server again.')
+                ),
+                JSONResponsesSetting('json_responses', T(32474, 'Request JSON From Servers'), False).description(
+                    T(32475, 'Ask the server for JSON instead of XML, which can be quicker to parse on slower devices.')
+                ),
+                ProfilingSetting('profiling', T(32465, 'Profiling'), False).description(
+                    T(32468, 'Time the slow paths (server requests, parsing, background tasks, window setup) and write the results to profile.log')
+                ),
+                ActionSetting('view_profile', T(32466, 'View Profile'), showProfile),
             )
         ),
         'manual': (
@@ -376,6 +449,8 @@ class SettingsWindow(kodigui.BaseWindow, windowutils.UtilMixin):
             self.editIP(mli, setting)
         elif setting.type == 'INTEGER' and not from_right:
             self.editInteger(mli, setting)
+        elif setting.type == 'ACTION' and not from_right:
+            setting.run()
 
     def changeSetting(self):
         optionItem = self.optionsList.getSelectedItem()
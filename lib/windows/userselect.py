@@ -44,9 +44,13 @@ class UserSelectWindow(kodigui.BaseWindow):
 
     def onFirstInit(self):
         self.userList = kodigui.ManagedControlList(self, self.USER_LIST_ID, 6)
+        plexapp.APP.on('change:homeUsers', self.onHomeUsersChanged)
 
         self.start()
 
+    def onClosed(self):
+        plexapp.APP.off('change:homeUsers', self.onHomeUsersChanged)
+
     def onAction(self, action):
         try:
             ID = action.getId()
@@ -98,31 +102,57 @@ class UserSelectWindow(kodigui.BaseWindow):
             item.setThumbnailImage(thumb)
             item.setProperty('back.image', back)
 
+    def onHomeUsersChanged(self, **kwargs):
+        # We opened with the cached list and a background refresh found it had changed
+        if self._closing:
+            return
+
+        selected = self.userList.getSelectedItem()
+        pin = selected and selected.getProperty('editing.pin')
+        self.fillUsers(selected and selected.dataSource.id)
+
+        # Don't lose a PIN that was being typed in
+        item = self.userList.getSelectedItem()
+        if pin and item and item.dataSource.id == selected.dataSource.id:
+            item.setProperty('pin', selected.getProperty('pin'))
+            item.setProperty('editing.pin', pin)
+
     def start(self):
         self.setProperty('busy', '1')
         try:
-            users = plexapp.ACCOUNT.homeUsers
-
-            items = []
-            for user in users:
-                # thumb, back = image.getImage(user.thumb, user.id)
-                # mli = kodigui.ManagedListItem(user.title, thumbnailImage=thumb, data_source=user)
-                mli = kodigui.ManagedListItem(user.title, user.title[0].upper(), data_source=user)
-                mli.setProperty('pin', user.title)
-                # mli.setProperty('back.image', back)
-                mli.setProperty('protected', user.isProtected and '1' or '')
-                mli.setProperty('admin', user.isAdmin and '1' or '')
-                items.append(mli)
-
-            self.userList.addItems(items)
-            self.task = UserThumbTask().setup(users, self.userThumbCallback)
-            backgroundthread.BGThreader.addTask(self.task)
-
+            self.fillUsers()
             self.setFocusId(self.USER_LIST_ID)
             self.setProperty('initialized', '1')
         finally:
             self.setProperty('busy', '')
 
+    def fillUsers(self, selectID=None):
+        if self.task:
+            self.task.cancel()
+
+        users = plexapp.ACCOUNT.homeUsers
+
+        items = []
+        selectIdx = 0
+        for user in users:
+            # thumb, back = image.getImage(user.thumb, user.id)
+            # mli = kodigui.ManagedListItem(user.title, thumbnailImage=thumb, data_source=user)
+            mli = kodigui.ManagedListItem(user.title, user.title[0].upper(), data_source=user)
+            mli.setProperty('pin', user.title)
+            # mli.setProperty('back.image', back)
+            mli.setProperty('protected', user.isProtected and '1' or '')
+            mli.setProperty('admin', user.isAdmin and '1' or '')
+            if selectID is not None and user.id == selectID:
+                selectIdx = len(items)
+            items.append(mli)
+
+        self.userList.replaceItems(items)
+        if items:
+            self.userList.selectItem(selectIdx)
+
+        self.task = UserThumbTask().setup(users, self.userThumbCallback)
+        backgroundthread.BGThreader.addTask(self.task)
+
     def shutdownClicked(self):
         options = []
         options.append({'key': 'sign_out', 'display': T(32421, 'Sign Out')})
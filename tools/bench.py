@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the library browse hot paths, run headless against tools/fakeplex.py
+with the Kodi modules stubbed out (tools/kodistubs.py).
+
+    python tools/bench.py                      # everything, compared against the baseline
+    python tools/bench.py listItems PlexServer.hubs
+    python tools/bench.py --save               # make these results the new baseline
+
+Each case reports runs per second, items per second, the peak RSS the case reached,
+and the objects one run leaves allocated (tracemalloc bytes where available). Cases
+run in a forked child where possible so RSS isn't inherited from earlier cases.
+Results are compared against tools/bench_baseline.json (or --baseline FILE), any
+case more than --threshold percent slower is flagged and the exit status is 1.
+The committed baseline is only meaningful on the machine that recorded it, so
+record your own with --save before making a change.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import optparse
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS)
+
+import kodistubs  # noqa E402
+import fakeplex  # noqa E402
+
+BASELINE = os.path.join(TOOLS, 'bench_baseline.json')
+
+BENCHMARKS = []
+
+
+class Benchmark(object):
+    def __init__(self, name, func, sizes, unit='items'):
+        self.name = name
+        self.func = func
+        self.sizes = sizes
+        self.unit = unit
+
+
+def benchmark(name, sizes, unit='items'):
+    """
+    Register func(ctx, size) as a benchmark. It does its setup and returns the
+    callable that gets timed, which should return whatever it built so the
+    allocation count has something to hold on to.
+    """
+    def wrap(func):
+        BENCHMARKS.append(Benchmark(name, func, sizes, unit))
+        return func
+    return wrap
+
+
+class Context(object):
+    """ Sets up plexnet and the fake server for a case, and tears it down again. """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.fakes = []
+        self.plexapp = None
+
+    def setup(self):
+        kodistubs.install()
+
+        # Same import order as lib/main.py, plexnet has to come up through plexapp
+        import lib  # noqa F401
+        from plexnet import plexapp, metadatacache
+        from lib import plex  # noqa F401
+        from lib import backgroundthread
+        from plexnet import video, audio, photo, playlist  # noqa F401 (register the library types)
+
+        plexapp.init()
+
+        # Time the requests, not the disk cache
+        metadatacache.CACHE.setPath(None)
+
+        # Or the image downloads list items would otherwise queue
+        from lib import image
+        image.CACHE.maxSize = 0
+
+        # Chunk fetches queued by the windows would otherwise run in the background while we time
+        backgroundthread.BGThreader.addTasksToFront = lambda tasks: None
+        backgroundthread.BGThreader.addTasks = lambda tasks: None
+        backgroundthread.BGThreader.addTask = lambda task: None
+
+        self.plexapp = plexapp
+        return self
+
+    def server(self, **kwargs):
+        kwargs.setdefault('latency', self.latency)
+        fake = fakeplex.FakePlexServer(fakeplex.Config(**kwargs)).start()
+        self.fakes.append(fake)
+        return fake.plexServer()
+
+    def section(self, index=0, **kwargs):
+        return self.server(**kwargs).library.sections()[index]
+
+    def libraryWindow(self, section):
+        from lib.windows import library, kodigui
+
+        library.ITEM_TYPE = section.TYPE  # as opener.py does
+        window = library.LibraryWindow(windows=library.VIEWS_POSTER.get('all'), section=section)
+        window._setupCurrent(window._next)
+        window.scrollBar = None
+        window.showPanelControl = kodigui.ManagedControlList(window._current, window._current.POSTERS_PANEL_ID, 5)
+        window.keyListControl = kodigui.ManagedControlList(window._current, window._current.KEY_LIST_ID, 27)
+        return window
+
+    def close(self):
+        for fake in self.fakes:
+            fake.stop()
+        self.fakes = []
+
+
+# Benchmarks
+
+@benchmark('section.all.paging', (1000, 10000))
+def sectionAllPaging(ctx, size):
+    from lib.windows import library
+
+    section = ctx.section(items=size)
+
+    def run():
+        items = []
+        for start in range(0, size, library.CHUNK_SIZE):
+            items.extend(section.all(start, library.CHUNK_SIZE))
+        return items
+
+    return run
+
+
+@benchmark('listItems', (1000, 10000, 50000))
+def listItems(ctx, size):
+    from xml.etree import ElementTree
+    from plexnet import plexobjects
+
+    server = ctx.server(items=size)
+    path = '/library/sections/1/all'
+    data = ElementTree.fromstring(fakeplex.Library(fakeplex.Config(items=size)).all('1', 0, size).encode('utf-8'))
+
+    def run():
+        return plexobjects.listItems(server, path, data=data)
+
+    return run
+
+
+@benchmark('fillShows.jumpList', (1000, 10000))
+def fillShows(ctx, size):
+    section = ctx.section(1, shows=size)
+    window = ctx.libraryWindow(section)
+    window.sort = 'titleSort'
+
+    def run():
+        window.fillShows()
+        return window.showPanelControl.items
+
+    return run
+
+
+@benchmark('_chunkCallback', (200, 1000, 5000))
+def chunkCallback(ctx, size):
+    from lib.windows import kodigui
+
+    section = ctx.section(items=size)
+    items = section.all(0, size)
+    window = ctx.libraryWindow(section)
+    window.showPanelControl.addItems([kodigui.ManagedListItem('', properties={'index': str(i)}) for i in range(size)])
+
+    def run():
+        window.backgroundSet = False
+        window._chunkCallback(list(items), 0)
+        return window.showPanelControl.items
+
+    return run
+
+
+@benchmark('PlexServer.hubs', (8, 32), unit='hubs')
+def hubs(ctx, size):
+    server = ctx.server(hubs=size, hubSize=20)
+
+    def run():
+        return server.hubs()
+
+    return run
+
+
+@benchmark('PlexServer.hubs.json', (8, 32), unit='hubs')
+def hubsJSON(ctx, size):
+    """ PlexServer.hubs with the json_responses setting on, to compare with the XML case. """
+    from plexnet import responsedecoder
+
+    server = ctx.server(hubs=size, hubSize=20)
+
+    def run():
+        responsedecoder.setDefaultDecoder(responsedecoder.JSONDecoder.NAME)
+        try:
+            return server.hubs()
+        finally:
+            responsedecoder.setDefaultDecoder(responsedecoder.XMLDecoder.NAME)
+
+    return run
+
+
+@benchmark('home.hubsBatch', (8, 16), unit='sections')
+def hubsBatch(ctx, size):
+    """ Time to all hubs for the home screen, run with --latency to see the round trips. """
+    from lib.windows import home
+
+    server = ctx.server(hubs=4, hubSize=10)
+    ctx.plexapp.SERVERMANAGER.selectedServer = server
+    sections = [home.HomeSection] + [Section(str(i)) for i in range(1, size)]
+
+    def run():
+        loaded = []
+        home.SectionHubsBatchTask().setup(sections, lambda section, hubs: loaded.append(hubs)).run()
+        return loaded
+
+    return run
+
+
+@benchmark('startup.firstHub.cold', (8,), unit='hubs')
+def firstHubCold(ctx, size):
+    """ Saved servers to the first home hubs without a warm start, the reachability test goes first. """
+    return firstHub(ctx, size, False)
+
+
+@benchmark('startup.firstHub.warm', (8,), unit='hubs')
+def firstHubWarm(ctx, size):
+    """ The same with the preferred server warm started from its saved connection. """
+    return firstHub(ctx, size, True)
+
+
+def firstHub(ctx, size, warm):
+    import json
+
+    server = ctx.server(hubs=size, hubSize=20)
+    manager = ctx.plexapp.SERVERMANAGER
+    address = server.activeConnection.address
+    state = json.dumps({'servers': [{
+        'uuid': server.uuid, 'name': server.name, 'owned': True, 'sameNetwork': True,
+        'root': warm and {'machineIdentifier': server.uuid, 'version': fakeplex.VERSION} or None,
+        'activeConnection': warm and address or None,
+        'connections': [{'sources': 1, 'address': address, 'isLocal': True, 'token': server.activeConnection.token}]
+    }]})
+    ctx.plexapp.INTERFACE.setPreference('lastServerId', server.uuid)
+
+    def run():
+        manager.serversByUuid = {}
+        manager.selectedServer = None
+        manager.startSelectedServerSearch()
+        ctx.plexapp.INTERFACE.setRegistry('PlexServerManager', state)
+        manager.loadState()
+        manager.warmStart()
+
+        deadline = time.time() + 10
+        while not manager.selectedServer and time.time() < deadline:
+            time.sleep(0.001)
+
+        return manager.selectedServer.hubs()
+
+    return run
+
+
+class Section(object):
+    def __init__(self, key):
+        self.key = key
+        self.title = 'Section {0}'.format(key)
+
+
+@benchmark('BGThreader.bursts', (100, 1000), unit='tasks')
+def threaderBursts(ctx, size):
+    """ Small bursts of tasks with the queue draining in between, the way scrolling a library queues chunks. """
+    import threading
+    from lib import backgroundthread
+
+    class Tick(backgroundthread.Task):
+        def setup(self, done):
+            self.done = done
+            return self
+
+        def run(self):
+            self.done.release()
+
+    threader = backgroundthread.BackgroundThreader('bench')
+    done = threading.Semaphore(0)
+
+    def run():
+        tasks = []
+        for start in range(0, size, 10):
+            burst = [Tick().setup(done) for i in range(min(10, size - start))]
+            threader.addTasks(burst)
+            for t in burst:
+                done.acquire()
+            time.sleep(0.001)  # let the workers go idle
+            tasks += burst
+        return tasks
+
+    return run
+
+
+# Runner
+
+def peakRSS():
+    """ Peak resident set size of this process in KB, None where we can't tell. """
+    if not resource:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def allocations(run):
+    """ What one run leaves allocated: bytes with tracemalloc, otherwise a count of new gc tracked objects. """
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        result = run()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del result
+        return {'allocated_bytes': size}
+
+    before = len(gc.get_objects())
+    result = run()
+    after = len(gc.get_objects())
+    del result
+    return {'allocated_objects': after - before}
+
+
+def measure(bench, size, repeat, latency):
+    ctx = Context(latency).setup()
+    try:
+        run = bench.func(ctx, size)
+        run()  # warm up, fills connection pools and import caches
+
+        times = []
+        for i in range(repeat):
+            gc.collect()
+            start = time.time()
+            run()
+            times.append(time.time() - start)
+
+        times.sort()
+        median = times[len(times) // 2]
+        result = {
+            'name': bench.name,
+            'size': size,
+            'unit': bench.unit,
+            'runs': repeat,
+            'best': times[0],
+            'median': median,
+            'ops_per_sec': median and 1 / median or 0,
+            'items_per_sec': median and size / median or 0,
+            'peak_rss_kb': peakRSS()
+        }
+        result.update(allocations(run))
+        return result
+    finally:
+        ctx.close()
+
+
+def measureIsolated(bench, size, repeat, latency):
+    if not hasattr(os, 'fork'):
+        return measure(bench, size, repeat, latency)
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(r)
+        try:
+            result = measure(bench, size, repeat, latency)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            result = {'name': bench.name, 'size': size, 'error': str(e)}
+        os.write(w, json.dumps(result))
+        os.close(w)
+        os._exit(0)
+
+    os.close(w)
+    data = ''
+    while True:
+        chunk = os.read(r, 65536)
+        if not chunk:
+            break
+        data += chunk
+    os.close(r)
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+def caseKey(result):
+    return '{0}[{1}]'.format(result['name'], result['size'])
+
+
+def report(results, baseline=None, threshold=10):
+    regressions = []
+
+    print '{0:<32} {1:>10} {2:>10} {3:>12} {4:>11} {5:>12}  {6}'.format(
+        'case', 'median ms', 'ops/sec', 'items/sec', 'peak RSS', 'allocated', baseline and 'vs baseline' or ''
+    )
+
+    for result in results:
+        key = caseKey(result)
+        if 'error' in result:
+            print '{0:<32} ERROR: {1}'.format(key, result['error'])
+            continue
+
+        allocated = result.get('allocated_bytes')
+        allocated = allocated is not None and '{0}KB'.format(allocated // 1024) or '{0} obj'.format(result.get('allocated_objects'))
+        change = ''
+        if baseline and key in baseline and baseline[key].get('median'):
+            pct = (result['median'] - baseline[key]['median']) / baseline[key]['median'] * 100
+            change = '{0:+.1f}%'.format(pct)
+            if pct > threshold:
+                change += '  REGRESSION'
+                regressions.append(key)
+
+        print '{0:<32} {1:>10.2f} {2:>10.2f} {3:>12.0f} {4:>9}KB {5:>12}  {6}'.format(
+            key, result['median'] * 1000, result['ops_per_sec'], result['items_per_sec'], result['peak_rss_kb'], allocated, change
+        )
+
+    return regressions
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] [benchmark ...]')
+    parser.add_option('-r', '--repeat', type='int', default=5, help='timed runs per case')
+    parser.add_option('--latency', type='float', default=0, help='fake server latency per request, in ms')
+    parser.add_option('--size', type='int', action='append', dest='sizes', help='only run these sizes (repeatable)')
+    parser.add_option('-b', '--baseline', metavar='FILE', default=BASELINE, help='baseline to compare against or save to')
+    parser.add_option('--save', action='store_true', default=False, help='save these results as the baseline')
+    parser.add_option('--threshold', type='float', default=10, help='percent slower than baseline that counts as a regression')
+    parser.add_option('--no-fork', action='store_true', default=False, help='run every case in this process')
+    parser.add_option('-l', '--list', action='store_true', default=False, help='list the benchmarks')
+    options, names = parser.parse_args(argv)
+
+    if options.list:
+        for bench in BENCHMARKS:
+            print '{0:<24} sizes: {1}'.format(bench.name, ', '.join(str(s) for s in bench.sizes))
+        return 0
+
+    selected = [b for b in BENCHMARKS if not names or b.name in names]
+    if not selected:
+        parser.error('No benchmarks match: {0}'.format(', '.join(names)))
+
+    baseline = None
+    if not options.save and os.path.exists(options.baseline):
+        with open(options.baseline, 'r') as f:
+            baseline = dict((caseKey(r), r) for r in json.load(f)['results'])
+
+    measureCase = options.no_fork and measure or measureIsolated
+    results = []
+    for bench in selected:
+        for size in bench.sizes:
+            if options.sizes and size not in options.sizes:
+                continue
+            results.append(measureCase(bench, size, options.repeat, options.latency / 1000.0))
+
+    regressions = report(results, baseline, options.threshold)
+
+    if options.save:
+        with open(options.baseline, 'w') as f:
+            json.dump({
+                'python': sys.version.split()[0],
+                'platform': sys.platform,
+                'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'results': results
+            }, f, indent=1, sort_keys=True)
+        print 'Saved baseline to {0}'.format(options.baseline)
+
+    return regressions and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Behaviour checks for the dev tools and the parts of plexnet they stand in for, run
+headless with the Kodi modules stubbed out (tools/kodistubs.py).
+
+    python tools/checks.py                     # everything
+    python tools/checks.py decoder.parity fakeplex.faults
+    python tools/checks.py --list
+
+Each check raises CheckFailed (or any other exception) when the behaviour it
+covers is broken. The exit status is 1 if any check failed.
+"""
+import os
+import sys
+import glob
+import time
+import shutil
+import httplib
+import urllib2
+import optparse
+import tempfile
+import traceback
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS)
+
+import kodistubs  # noqa E402
+import fakeplex  # noqa E402
+
+FIXTURES = os.path.join(TOOLS, 'fixtures')
+
+CHECKS = []
+
+
+class CheckFailed(Exception):
+    pass
+
+
+class Check(object):
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+
+def check(name):
+    """ Register func() as a check. """
+    def wrap(func):
+        CHECKS.append(Check(name, func))
+        return func
+    return wrap
+
+
+def expect(condition, message, *args):
+    if not condition:
+        raise CheckFailed(message.format(*args))
+
+
+def setup():
+    kodistubs.install()
+
+    # Same import order as lib/main.py, plexnet has to come up through plexapp
+    import lib  # noqa F401
+    from plexnet import plexapp  # noqa F401
+
+
+# Checks
+
+def compareElements(xmlElem, jsonElem, path):
+    path = '{0}/{1}'.format(path, xmlElem.tag)
+    expect(xmlElem.tag == jsonElem.tag, '{0}: JSON decoded as <{1}>', path, jsonElem.tag)
+    expect(xmlElem.attrib == jsonElem.attrib, '{0}: attributes differ\n  xml:  {1}\n  json: {2}', path, xmlElem.attrib, jsonElem.attrib)
+    expect(len(xmlElem) == len(jsonElem), '{0}: {1} children from XML, {2} from JSON', path, len(xmlElem), len(jsonElem))
+    for i, (x, j) in enumerate(zip(xmlElem, jsonElem)):
+        compareElements(x, j, '{0}[{1}]'.format(path, i))
+
+
+@check('decoder.parity')
+def decoderParity():
+    """ The JSON decoder builds the same tree as the XML one, for generated and fixture containers. """
+    setup()
+    from plexnet import responsedecoder
+
+    library = fakeplex.Library(fakeplex.Config(items=50, shows=20, hubs=2, hubSize=5))
+    bodies = [
+        ('sections', library.sections()),
+        ('movies', library.all('1', 0, 20)),
+        ('shows', library.all('2', 0, 20)),
+        ('hubs', library.hubs()),
+        ('playQueue', library.playQueue(1, size=5)),
+    ]
+    for path in sorted(glob.glob(os.path.join(FIXTURES, 'decoder', '*.xml'))):
+        with open(path, 'r') as f:
+            bodies.append((os.path.basename(path), f.read().decode('utf-8')))
+
+    xml = responsedecoder.getDecoder(responsedecoder.XMLDecoder.NAME)
+    json_ = responsedecoder.getDecoder(responsedecoder.JSONDecoder.NAME)
+    for name, body in bodies:
+        body = body.encode('utf-8')
+        compareElements(xml.fromstring(body), json_.fromstring(fakeplex.toJSON(body)), name)
+
+
+def fetch(url, timeout=10):
+    """ (status, body, seconds taken) for a GET, status is None if the connection was dropped. """
+    start = time.time()
+    try:
+        response = urllib2.urlopen(url, timeout=timeout)
+        return response.getcode(), response.read(), time.time() - start
+    except urllib2.HTTPError as e:
+        return e.code, e.read(), time.time() - start
+    except (urllib2.URLError, httplib.HTTPException, IOError):
+        return None, None, time.time() - start
+
+
+@check('fakeplex.replay')
+def fakeplexReplay():
+    """ Responses recorded to tools/fixtures/replay/ are served as recorded, tokens ignored. """
+    fixtures = fakeplex.Fixtures(os.path.join(FIXTURES, 'replay'))
+    paths = ('/identity', '/library/sections', '/library/sections/1/all?X-Plex-Container-Start=0&X-Plex-Container-Size=2')
+
+    with fakeplex.FakePlexServer(replay=fixtures.directory) as fake:
+        for path in paths:
+            recorded = fixtures.load('GET', path)
+            expect(recorded is not None, 'no fixture for {0}', path)
+            status, body, elapsed = fetch(fake.url + path + (path.count('?') and '&' or '?') + 'X-Plex-Token=anything')
+            expect((status, body) == (recorded[0], recorded[2]), '{0}: replayed {1} ({2} bytes), recorded {3} ({4} bytes)',
+                   path, status, len(body or ''), recorded[0], len(recorded[2]))
+
+        status, body, elapsed = fetch(fake.url + '/library/sections/2/all')
+        expect(status == 404, 'unrecorded request answered with {0}', status)
+
+
+@check('fakeplex.record')
+def fakeplexRecord():
+    """ Recording from an upstream server and replaying it gives back the same responses. """
+    directory = tempfile.mkdtemp()
+    try:
+        with fakeplex.FakePlexServer(fakeplex.Config(items=20)) as upstream:
+            with fakeplex.FakePlexServer(upstream=upstream.url, record=directory) as recorder:
+                recorded = [fetch(recorder.url + path)[:2] for path in ('/', '/library/sections/1/all', '/hubs')]
+
+        with fakeplex.FakePlexServer(replay=directory) as replay:
+            replayed = [fetch(replay.url + path)[:2] for path in ('/', '/library/sections/1/all', '/hubs')]
+
+        expect(all(status == 200 for status, body in recorded), 'recording failed: {0}', [status for status, body in recorded])
+        expect(recorded == replayed, 'replayed responses differ from the recorded ones')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@check('fakeplex.faults')
+def fakeplexFaults():
+    """ --fail-rate, --fail-status and --fail-path fail the requests they say they do. """
+    with fakeplex.FakePlexServer(fakeplex.Config(failRate=1, failStatus=503)) as fake:
+        status, body, elapsed = fetch(fake.url + '/identity')
+        expect(status == 503, 'fail-rate 1 answered with {0}, expected 503', status)
+        expect(fake.counts.get('failures') == 1, 'failures counted: {0}', fake.counts.get('failures'))
+
+    with fakeplex.FakePlexServer(fakeplex.Config(failRate=1, failStatus=0)) as fake:
+        status, body, elapsed = fetch(fake.url + '/identity')
+        expect(status is None, 'fail-status 0 answered with {0}, expected a dropped connection', status)
+
+    with fakeplex.FakePlexServer(fakeplex.Config(failRate=1, failPath='^/hubs')) as fake:
+        expect(fetch(fake.url + '/hubs')[0] == 500, '/hubs should fail with fail-path ^/hubs')
+        expect(fetch(fake.url + '/identity')[0] == 200, '/identity should not fail with fail-path ^/hubs')
+
+    requests = 400
+    with fakeplex.FakePlexServer(fakeplex.Config(failRate=0.25, seed=1)) as fake:
+        failed = len([1 for i in range(requests) if fetch(fake.url + '/identity')[0] == 500])
+    expect(0.15 < failed / float(requests) < 0.35, 'fail-rate 0.25 failed {0} of {1} requests', failed, requests)
+
+
+@check('fakeplex.latency')
+def fakeplexLatency():
+    """ Every response is delayed by latency plus up to jitter. """
+    latency, jitter = 0.1, 0.05
+    with fakeplex.FakePlexServer(fakeplex.Config(latency=latency, jitter=jitter, seed=1)) as fake:
+        times = [fetch(fake.url + '/identity')[2] for i in range(10)]
+
+    expect(min(times) >= latency, 'fastest response took {0:.3f}s, latency is {1}s', min(times), latency)
+    # Allow some scheduling slack on top of the jitter
+    expect(max(times) < latency + jitter + 0.05, 'slowest response took {0:.3f}s, latency + jitter is {1}s', max(times), latency + jitter)
+    expect(max(times) - min(times) > 0.005, 'responses took {0:.3f}s to {1:.3f}s, no jitter', min(times), max(times))
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] [check ...]')
+    parser.add_option('-l', '--list', action='store_true', default=False, help='list the checks')
+    options, names = parser.parse_args(argv)
+
+    if options.list:
+        for c in CHECKS:
+            print '{0:<24} {1}'.format(c.name, (c.func.__doc__ or '').strip())
+        return 0
+
+    selected = [c for c in CHECKS if not names or c.name in names]
+    if not selected:
+        parser.error('No checks match: {0}'.format(', '.join(names)))
+
+    failed = []
+    for c in selected:
+        try:
+            c.func()
+        except CheckFailed as e:
+            print '{0:<24} FAIL: {1}'.format(c.name, e)
+            failed.append(c.name)
+        except Exception:
+            print '{0:<24} ERROR:\n{1}'.format(c.name, traceback.format_exc())
+            failed.append(c.name)
+        else:
+            print '{0:<24} ok'.format(c.name)
+
+    return failed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
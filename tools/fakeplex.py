@@ -0,0 +1,644 @@
+#!/usr/bin/env python
+"""
+Offline stand-in for a Plex Media Server and the plex.tv endpoints plexnet talks to.
+
+Serves generated MediaContainers of whatever size is asked for, so PlexServer,
+PlexServerManager and PlayQueue can be exercised (and timed) without a real server:
+
+    /, /identity, /library, /library/sections, /library/sections/N/all (paged with
+    X-Plex-Container-Start/Size), /library/sections/N/firstCharacter,
+    /library/metadata/N, /hubs, /hubs/sections/N, /playQueues, /:/timeline,
+    /photo/:/transcode, and plex.tv's /pms/resources, /api/resources,
+    /api/home/users, /users/account and /users/sign_in.xml
+
+Latency and failures can be injected, and responses from a real server can be
+recorded to a fixture directory and replayed later. Generated GET responses carry an
+ETag and are answered with 304 when If-None-Match still matches, and are converted to
+PMS style JSON when the request accepts application/json.
+
+    python tools/fakeplex.py --items 10000 --latency 50 --jitter 20 --fail-rate 0.05
+    python tools/fakeplex.py --record http://192.168.1.10:32400 --token XXXX --fixtures fixtures/
+    python tools/fakeplex.py --replay fixtures/
+
+tools/fixtures/replay/ holds a small recording, and tools/checks.py covers replay and
+the fault and latency injection.
+
+Point plexnet at it with myplexserver.setBaseURL() for the plex.tv side, and by
+adding http://127.0.0.1:<port> as a manual connection (or by using the server from
+FakePlexServer.plexServer()) for the PMS side.
+"""
+import re
+import os
+import sys
+import json
+import time
+import gzip
+import random
+import collections
+import base64
+import urllib2
+import urlparse
+import hashlib
+import optparse
+import threading
+import StringIO
+import SocketServer
+import BaseHTTPServer
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
+
+DEFAULT_PORT = 32400
+MACHINE_ID = 'fakeplex0000000000000000000000000000000'
+VERSION = '1.3.3.3148-fake'
+
+# Smallest valid PNG, returned for every transcoded photo
+PIXEL = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+BODY_CACHE_SIZE = 512  # generated responses kept per server
+
+
+class Config(object):
+    def __init__(self, items=1000, shows=None, hubs=8, hubSize=20, latency=0, jitter=0, failRate=0, failStatus=500,
+                 failPath=None, seed=None, name='Fake PMS', machineID=MACHINE_ID, token='fake-token'):
+        self.items = items
+        self.shows = shows if shows is not None else max(1, items // 10)
+        self.hubs = hubs
+        self.hubSize = hubSize
+        self.latency = latency  # seconds
+        self.jitter = jitter
+        self.failRate = failRate
+        self.failStatus = failStatus  # 0 drops the connection without a response
+        self.failPath = failPath and re.compile(failPath) or None
+        self.random = random.Random(seed)
+        self.name = name
+        self.machineID = machineID
+        self.token = token
+        self.updatedAt = int(time.time())
+
+
+class Library(object):
+    """ Generates the XML for the fake server's content on demand. """
+
+    def __init__(self, config):
+        self.config = config
+
+    def attrs(self, **kwargs):
+        return ' '.join('{0}={1}'.format(k, quoteattr(unicode(v))) for k, v in sorted(kwargs.items()) if v is not None)
+
+    def container(self, children='', **kwargs):
+        kwargs.setdefault('size', children.count('\n'))
+        return u'<?xml version="1.0" encoding="UTF-8"?>\n<MediaContainer {0}>\n{1}</MediaContainer>\n'.format(
+            self.attrs(**kwargs), children
+        )
+
+    def title(self, prefix, i):
+        return u'{0} {1} {2:05d}'.format(LETTERS[i % len(LETTERS)], prefix, i)
+
+    def movie(self, i, **extra):
+        ratingKey = 100000 + i
+        return (
+            u'<Video {0}><Media {1}><Part {2}><Stream {3}/><Stream {4}/></Part></Media>'
+            u'<Genre tag="Drama"/><Director tag="Someone"/><Role tag="Actor {5}"/></Video>\n'
+        ).format(
+            self.attrs(
+                ratingKey=ratingKey, key='/library/metadata/{0}'.format(ratingKey), type='movie', title=self.title('Movie', i),
+                titleSort=self.title('Movie', i), year=1950 + i % 70, duration=5400000, addedAt=self.config.updatedAt - i,
+                updatedAt=self.config.updatedAt, librarySectionID=1, viewCount=i % 3 == 0 and 1 or None,
+                thumb='/library/metadata/{0}/thumb/1'.format(ratingKey), art='/library/metadata/{0}/art/1'.format(ratingKey),
+                summary='Generated movie number {0}'.format(i), **extra
+            ),
+            self.attrs(id=ratingKey, duration=5400000, bitrate=8000, width=1920, height=1080, videoCodec='h264',
+                       audioCodec='aac', audioChannels=2, container='mp4', videoResolution='1080'),
+            self.attrs(id=ratingKey, key='/library/parts/{0}/file.mp4'.format(ratingKey), duration=5400000,
+                       file='/media/movie{0}.mp4'.format(i), size=4000000000, container='mp4'),
+            self.attrs(id=ratingKey * 10, streamType=1, codec='h264', index=0),
+            self.attrs(id=ratingKey * 10 + 1, streamType=2, codec='aac', index=1, channels=2, selected=1),
+            i % 100
+        )
+
+    def show(self, i):
+        ratingKey = 500000 + i
+        return u'<Directory {0}/>\n'.format(self.attrs(
+            ratingKey=ratingKey, key='/library/metadata/{0}/children'.format(ratingKey), type='show', title=self.title('Show', i),
+            titleSort=self.title('Show', i), year=1990 + i % 30, leafCount=10, viewedLeafCount=i % 11, childCount=1,
+            addedAt=self.config.updatedAt - i, updatedAt=self.config.updatedAt, librarySectionID=2,
+            thumb='/library/metadata/{0}/thumb/1'.format(ratingKey), art='/library/metadata/{0}/art/1'.format(ratingKey)
+        ))
+
+    def sectionTotal(self, section):
+        return section == '1' and self.config.items or self.config.shows
+
+    def sectionItem(self, section, i):
+        return section == '1' and self.movie(i) or self.show(i)
+
+    def root(self):
+        return self.container(
+            u'<Directory key="library" title="library"/>\n<Directory key="hubs" title="hubs"/>\n',
+            machineIdentifier=self.config.machineID, friendlyName=self.config.name, version=VERSION, platform='Linux',
+            transcoderVideo=1, transcoderAudio=1, transcoderPhoto=1, transcoderVideoQualities='0,1,2,3,4,5,6,7,8,9,10,11,12',
+            allowMediaDeletion=1, multiuser=1, myPlex=1, serverClass=None
+        )
+
+    def identity(self):
+        return self.container(machineIdentifier=self.config.machineID, version=VERSION, size=0)
+
+    def library(self):
+        return self.container(
+            u'<Directory key="sections" title="Library Sections"/>\n<Directory key="recentlyAdded" title="Recently Added Content"/>\n'
+            u'<Directory key="onDeck" title="On Deck"/>\n',
+            title1='Plex Library', identifier='com.plexapp.plugins.library'
+        )
+
+    def sections(self):
+        children = u''.join(
+            u'<Directory {0}/>\n'.format(self.attrs(
+                key=key, type=type_, title=title, agent='com.plexapp.agents.none', scanner='Plex Scanner',
+                updatedAt=self.config.updatedAt, contentChangedAt=self.config.updatedAt, uuid='section-{0}'.format(key)
+            ))
+            for key, type_, title in (('1', 'movie', 'Movies'), ('2', 'show', 'TV Shows'))
+        )
+        return self.container(children, allowSync=0, title1='Plex Library')
+
+    def all(self, section, start, size):
+        total = self.sectionTotal(section)
+        start = max(0, min(start, total))
+        end = total if size is None else min(total, start + size)
+        children = u''.join(self.sectionItem(section, i) for i in xrange(start, end))
+        return self.container(children, size=end - start, totalSize=total, offset=start, librarySectionID=section)
+
+    def firstCharacter(self, section):
+        total = self.sectionTotal(section)
+        counts = [len(xrange(i, total, len(LETTERS))) for i in range(len(LETTERS))]
+        children = u''.join(
+            u'<Directory {0}/>\n'.format(self.attrs(key=letter, title=letter, size=count))
+            for letter, count in zip(LETTERS, counts) if count
+        )
+        return self.container(children)
+
+    def metadata(self, ratingKey):
+        if ratingKey >= 500000:
+            return self.container(self.show(ratingKey - 500000))
+        return self.container(self.movie(max(0, ratingKey - 100000)))
+
+    def hubs(self, section=None):
+        children = []
+        for h in range(self.config.hubs):
+            items = u''.join(
+                self.movie((h * self.config.hubSize + i) % max(1, self.config.items)) for i in range(self.config.hubSize)
+            )
+            identifier = 'movie.fake.{0}'.format(h)
+            children.append(u'<Hub {0}>\n{1}</Hub>\n'.format(
+                self.attrs(
+                    hubIdentifier=section and '{0}.{1}'.format(identifier, section) or identifier, title='Hub {0}'.format(h),
+                    key='/hubs/sections/1/fake{0}'.format(h), type='movie', size=self.config.hubSize, more=1,
+                    hubKey='/library/metadata/' + ','.join(str(100000 + i) for i in range(self.config.hubSize))
+                ),
+                items
+            ))
+        return self.container(u''.join(children), size=len(children))
+
+    def playQueue(self, pqID, selected=0, size=None):
+        size = size or min(100, self.config.items)
+        children = u''.join(self.movie(i, playQueueItemID=pqID * 1000 + i) for i in range(size))
+        return self.container(
+            children, size=size, playQueueID=pqID, playQueueSelectedItemID=pqID * 1000 + selected,
+            playQueueSelectedItemOffset=selected, playQueueSelectedMetadataItemID=100000 + selected,
+            playQueueTotalCount=size, playQueueVersion=1, playQueueShuffled=0, playQueueSourceURI='library://fake/item/'
+        )
+
+    def empty(self):
+        return self.container(size=0)
+
+    # plex.tv
+
+    def resources(self, baseURL):
+        parsed = urlparse.urlparse(baseURL)
+        return self.container(u'<Device {0}>\n<Connection {1}/>\n</Device>\n'.format(
+            self.attrs(
+                name=self.config.name, product='Plex Media Server', productVersion=VERSION, platform='Linux',
+                clientIdentifier=self.config.machineID, provides='server', owned=1, presence=1, publicAddressMatches=1,
+                accessToken=self.config.token, createdAt=self.config.updatedAt, lastSeenAt=self.config.updatedAt
+            ),
+            self.attrs(protocol='http', address=parsed.hostname, port=parsed.port, uri=baseURL, local=1)
+        ))
+
+    def homeUsers(self):
+        children = u''.join(
+            u'<User {0}/>\n'.format(self.attrs(
+                id=i + 1, title='User {0}'.format(i + 1), username='user{0}'.format(i + 1), admin=i == 0 and 1 or 0,
+                restricted=i > 1 and 1 or 0, protected=0, guest=0, thumb=''
+            ))
+            for i in range(3)
+        )
+        return self.container(children)
+
+    def account(self):
+        return u'<?xml version="1.0" encoding="UTF-8"?>\n<user {0}>\n<subscription active="1" status="Active" plan="lifetime"/>\n</user>\n'.format(
+            self.attrs(
+                id=1, uuid='fakeuser', title='User 1', username='user1', email='user1@example.com', thumb='',
+                authenticationToken=self.config.token, secure=0, restricted=0, home=1
+            )
+        )
+
+
+class Fixtures(object):
+    """ Responses recorded from a real server, keyed on method and path (tokens stripped). """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def key(self, method, path):
+        parsed = urlparse.urlparse(path)
+        query = sorted((k, v) for k, v in urlparse.parse_qsl(parsed.query, True) if not k.startswith('X-Plex-Token'))
+        normalized = '{0} {1}?{2}'.format(method, parsed.path, '&'.join('{0}={1}'.format(k, v) for k, v in query))
+        return normalized, hashlib.sha1(normalized).hexdigest()
+
+    def load(self, method, path):
+        normalized, name = self.key(method, path)
+        try:
+            with open(os.path.join(self.directory, name + '.json'), 'r') as f:
+                obj = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        return obj['status'], obj['contentType'], base64.b64decode(obj['body'])
+
+    def save(self, method, path, status, contentType, body):
+        normalized, name = self.key(method, path)
+        with open(os.path.join(self.directory, name + '.json'), 'w') as f:
+            json.dump({
+                'request': normalized, 'status': status, 'contentType': contentType, 'body': base64.b64encode(body)
+            }, f, indent=1, separators=(',', ': '), sort_keys=True)
+
+
+def toJSON(body):
+    """ A generated XML MediaContainer as PMS sends it for Accept: application/json. """
+    root = ElementTree.fromstring(body)
+    return json.dumps({root.tag: elementToJSON(root)})
+
+
+def elementToJSON(elem):
+    obj = collections.OrderedDict(sorted(elem.attrib.items()))  # children stay in the server's order
+    for child in elem:
+        # PMS groups every library item under Metadata whatever its XML tag
+        if child.tag in ('Video', 'Track', 'Photo') or (child.tag in ('Directory', 'Playlist') and 'ratingKey' in child.attrib):
+            key = 'Metadata'
+        else:
+            key = child.tag
+        obj.setdefault(key, []).append(elementToJSON(child))
+    return obj
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakePlex/1.0'
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    ROUTES = (
+        (r'^/$', 'root'),
+        (r'^/identity$', 'identity'),
+        (r'^/library/?$', 'library'),
+        (r'^/library/sections/?$', 'sections'),
+        (r'^/library/sections/(\d+)/all$', 'all'),
+        (r'^/library/sections/(\d+)/firstCharacter$', 'firstCharacter'),
+        (r'^/library/metadata/(\d+)$', 'metadata'),
+        (r'^/hubs/?$', 'hubs'),
+        (r'^/hubs/sections/(\d+)$', 'hubs'),
+        (r'^/playQueues/?$', 'createPlayQueue'),
+        (r'^/playQueues/(\d+)', 'playQueue'),
+        (r'^/:/timeline', 'timeline'),
+        (r'^/:/(scrobble|unscrobble|progress)', 'empty'),
+        (r'^/photo/:/transcode', 'photo'),
+        (r'^/(pms|api)/resources', 'resources'),
+        (r'^/api/home/users/?$', 'homeUsers'),
+        (r'^/users/(account|sign_in)', 'account'),
+    )
+    ROUTES = tuple((re.compile(pattern), name) for pattern, name in ROUTES)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def handle_request(self, method):
+        server = self.server
+        config = server.config
+
+        if self.headers.get('Content-Length'):
+            self.rfile.read(int(self.headers['Content-Length']))
+
+        parsed = urlparse.urlparse(self.path)
+        self.query = dict(urlparse.parse_qsl(parsed.query, True))
+        server.count(parsed.path)
+
+        if config.latency or config.jitter:
+            time.sleep(config.latency + config.random.uniform(0, config.jitter))
+
+        if config.failRate and (not config.failPath or config.failPath.search(parsed.path)):
+            if config.random.random() < config.failRate:
+                server.count('failures')
+                if not config.failStatus:
+                    self.close_connection = 1
+                    return
+                return self.respond(config.failStatus, 'text/plain', 'Injected failure')
+
+        if server.replay:
+            recorded = server.replay.load(method, self.path)
+            if not recorded:
+                return self.respond(404, 'text/plain', 'No fixture recorded for {0} {1}'.format(method, self.path))
+            return self.respond(*recorded)
+
+        if server.upstream:
+            return self.proxy(method)
+
+        # Generated content only depends on the request, so don't let building it show up in client timings
+        wantsJSON = 'application/json' in self.headers.get('Accept', '')
+        cacheKey = method == 'GET' and (
+            self.path, self.headers.get('X-Plex-Container-Start'), self.headers.get('X-Plex-Container-Size'), wantsJSON
+        )
+        cached = cacheKey and server.bodies.get(cacheKey)
+        if cached:
+            return self.respond(*cached)
+
+        for pattern, name in self.ROUTES:
+            match = pattern.match(parsed.path)
+            if match:
+                body = getattr(self, 'route_' + name)(*match.groups())
+                if not isinstance(body, tuple):
+                    if wantsJSON:
+                        body = (200, 'application/json', toJSON(body.encode('utf-8')))
+                    else:
+                        body = (200, 'application/xml', body.encode('utf-8'))
+                if cacheKey:
+                    server.cacheBody(cacheKey, body)
+                return self.respond(*body)
+
+        self.respond(404, 'text/plain', 'Not found')
+
+    def param(self, name, default=None):
+        return self.query.get(name, self.headers.get(name, default))
+
+    def respond(self, status, contentType, body):
+        etag = None
+        if status == 200 and self.command == 'GET' and not self.server.upstream and not self.server.replay:
+            etag = '"{0}"'.format(hashlib.sha1(body).hexdigest()[:16])
+            if self.headers.get('If-None-Match') == etag:
+                self.server.count('notModified')
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and len(body) > 512:
+            buf = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=1) as g:
+                g.write(body)
+            body = buf.getvalue()
+            encoded = True
+        else:
+            encoded = False
+
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        if encoded:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def proxy(self, method):
+        server = self.server
+        headers = dict((k, v) for k, v in self.headers.items() if k.lower().startswith('x-plex') or k.lower() == 'accept')
+        if server.token:
+            headers['X-Plex-Token'] = server.token
+
+        request = urllib2.Request(server.upstream + self.path, headers=headers, data=method in ('POST', 'PUT') and '' or None)
+        request.get_method = lambda: method
+        try:
+            response = urllib2.urlopen(request, timeout=30)
+            status, contentType, body = response.getcode(), response.info().get('Content-Type', 'application/xml'), response.read()
+        except urllib2.HTTPError as e:
+            status, contentType, body = e.code, e.info().get('Content-Type', 'text/plain'), e.read()
+        except urllib2.URLError as e:
+            return self.respond(502, 'text/plain', str(e))
+
+        if server.record:
+            server.record.save(method, self.path, status, contentType, body)
+
+        self.respond(status, contentType, body)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    # Routes
+
+    def route_root(self):
+        return self.server.library.root()
+
+    def route_identity(self):
+        return self.server.library.identity()
+
+    def route_library(self):
+        return self.server.library.library()
+
+    def route_sections(self):
+        return self.server.library.sections()
+
+    def route_all(self, section):
+        size = self.param('X-Plex-Container-Size')
+        return self.server.library.all(section, int(self.param('X-Plex-Container-Start', 0)), size is not None and int(size) or None)
+
+    def route_firstCharacter(self, section):
+        return self.server.library.firstCharacter(section)
+
+    def route_metadata(self, ratingKey):
+        return self.server.library.metadata(int(ratingKey))
+
+    def route_hubs(self, section=None):
+        return self.server.library.hubs(section)
+
+    def route_createPlayQueue(self):
+        return self.server.library.playQueue(self.server.nextPlayQueueID())
+
+    def route_playQueue(self, pqID):
+        return self.server.library.playQueue(int(pqID))
+
+    def route_timeline(self):
+        return self.server.library.empty()
+
+    def route_empty(self, *args):
+        return self.server.library.empty()
+
+    def route_photo(self):
+        return 200, 'image/png', PIXEL
+
+    def route_resources(self, *args):
+        return self.server.library.resources(self.server.url)
+
+    def route_homeUsers(self):
+        return self.server.library.homeUsers()
+
+    def route_account(self, *args):
+        return self.server.library.account()
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakePlexServer(object):
+    """
+    Run the fake server on a background thread:
+
+        with FakePlexServer(Config(items=10000, latency=0.05)) as fake:
+            server = fake.plexServer()
+            ...
+            print fake.counts
+    """
+
+    def __init__(self, config=None, host='127.0.0.1', port=0, upstream=None, token=None, record=None, replay=None, verbose=False):
+        self.httpd = HTTPServer((host, port), Handler)
+        self.httpd.config = config or Config()
+        self.httpd.library = Library(self.httpd.config)
+        self.httpd.upstream = upstream and upstream.rstrip('/') or None
+        self.httpd.token = token
+        self.httpd.record = record and Fixtures(record) or None
+        self.httpd.replay = replay and Fixtures(replay) or None
+        self.httpd.verbose = verbose
+        self.httpd.url = 'http://{0}:{1}'.format(host, self.httpd.server_port)
+        self.httpd.counts = {}
+        self.httpd.lock = threading.Lock()
+        self.httpd.playQueueID = 0
+        self.httpd.bodies = {}
+        self.httpd.count = self._count
+        self.httpd.cacheBody = self._cacheBody
+        self.httpd.nextPlayQueueID = self._nextPlayQueueID
+        self.thread = None
+
+    @property
+    def url(self):
+        return self.httpd.url
+
+    @property
+    def port(self):
+        return self.httpd.server_port
+
+    @property
+    def config(self):
+        return self.httpd.config
+
+    @property
+    def counts(self):
+        with self.httpd.lock:
+            return dict(self.httpd.counts)
+
+    def resetCounts(self):
+        with self.httpd.lock:
+            self.httpd.counts = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='FAKE-PLEX')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def plexServer(self):
+        """ A plexnet PlexServer already connected to us, lib/_included_packages has to be on sys.path. """
+        from plexnet import plexconnection
+        from plexnet import plexserver
+
+        conn = plexconnection.PlexConnection(plexconnection.PlexConnection.SOURCE_MANUAL, self.url, True, self.config.token)
+        server = plexserver.createPlexServerForConnection(conn)
+        server.uuid = self.config.machineID
+        server.name = self.config.name
+        server.owned = True
+        conn.state = plexconnection.PlexConnection.STATE_REACHABLE
+        server.activeConnection = conn
+        return server
+
+    def _count(self, key):
+        with self.httpd.lock:
+            self.httpd.counts[key] = self.httpd.counts.get(key, 0) + 1
+
+    def _cacheBody(self, key, body):
+        with self.httpd.lock:
+            if len(self.httpd.bodies) >= BODY_CACHE_SIZE:
+                self.httpd.bodies.clear()
+            self.httpd.bodies[key] = body
+
+    def _nextPlayQueueID(self):
+        with self.httpd.lock:
+            self.httpd.playQueueID += 1
+            return self.httpd.playQueueID
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=DEFAULT_PORT)
+    parser.add_option('--items', type='int', default=1000, help='movies in section 1')
+    parser.add_option('--shows', type='int', default=None, help='shows in section 2 (default items / 10)')
+    parser.add_option('--hubs', type='int', default=8)
+    parser.add_option('--hub-size', type='int', default=20)
+    parser.add_option('--latency', type='float', default=0, help='added to every response, in ms')
+    parser.add_option('--jitter', type='float', default=0, help='random extra latency up to this many ms')
+    parser.add_option('--fail-rate', type='float', default=0, help='fraction of requests that fail')
+    parser.add_option('--fail-status', type='int', default=500, help='status for failed requests, 0 drops the connection')
+    parser.add_option('--fail-path', default=None, help='only fail requests whose path matches this regex')
+    parser.add_option('--seed', type='int', default=None)
+    parser.add_option('--record', metavar='URL', default=None, help='proxy to this server and save its responses')
+    parser.add_option('--token', default=None, help='X-Plex-Token sent upstream when recording')
+    parser.add_option('--replay', metavar='DIR', default=None, help='serve responses recorded to DIR')
+    parser.add_option('--fixtures', metavar='DIR', default='fixtures', help='where --record saves responses')
+    parser.add_option('-v', '--verbose', action='store_true', default=False)
+    options, args = parser.parse_args(argv)
+
+    config = Config(
+        items=options.items, shows=options.shows, hubs=options.hubs, hubSize=options.hub_size, latency=options.latency / 1000.0,
+        jitter=options.jitter / 1000.0, failRate=options.fail_rate, failStatus=options.fail_status, failPath=options.fail_path,
+        seed=options.seed
+    )
+    fake = FakePlexServer(
+        config, options.host, options.port, upstream=options.record, token=options.token,
+        record=options.record and options.fixtures or None, replay=options.replay, verbose=options.verbose
+    )
+
+    print 'Fake Plex server listening on {0}'.format(fake.url)
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    print 'Requests: {0}'.format(json.dumps(fake.counts, sort_keys=True))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+Headless stand-ins for the xbmc, xbmcgui, xbmcaddon and xbmcvfs modules.
+
+Just enough of the Kodi API for lib/ to import and for windows to build and fill
+their lists outside of Kodi (see tools/bench.py). Nothing is drawn. List controls
+keep their items so the code under test does the same amount of work it would in
+Kodi, and anything not modelled here is a no-op.
+
+    import kodistubs
+    kodistubs.install()
+    from lib.windows import library
+"""
+import os
+import sys
+import types
+import tempfile
+import itertools
+import xml.etree.ElementTree as ET
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE = os.path.join(tempfile.gettempdir(), 'script.plex-bench')
+
+_constants = itertools.count(1000)
+
+
+class _Stub(object):
+    """ Accepts any arguments, every attribute is a no-op method. """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _noop
+
+
+def _noop(*args, **kwargs):
+    return None
+
+
+class StubModule(types.ModuleType):
+    """ Unknown CONSTANTS become unique ints, anything else a _Stub subclass. """
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        if name.isupper():
+            value = next(_constants)
+        else:
+            value = type(name, (_Stub,), {})
+
+        setattr(self, name, value)
+        return value
+
+
+# xbmc
+
+def _translatePath(path):
+    if path.startswith('special://'):
+        path = os.path.join(PROFILE, path[len('special://'):].lstrip('/'))
+    return path
+
+
+class Monitor(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=None):
+        return False
+
+
+class Player(_Stub):
+    def isPlaying(self):
+        return False
+
+    def isPlayingVideo(self):
+        return False
+
+    def isPlayingAudio(self):
+        return False
+
+
+def _xbmc():
+    m = StubModule('xbmc')
+    m.LOGDEBUG, m.LOGINFO, m.LOGNOTICE, m.LOGWARNING, m.LOGERROR, m.LOGSEVERE, m.LOGFATAL, m.LOGNONE = range(8)
+    m.LOG_LEVEL = m.LOGWARNING
+    m.abortRequested = False
+    m.Monitor = Monitor
+    m.Player = Player
+
+    def log(msg, level=m.LOGDEBUG):
+        if level >= m.LOG_LEVEL:
+            sys.stderr.write('{0}\n'.format(msg))
+
+    m.log = log
+    m.translatePath = _translatePath
+    m.getCondVisibility = lambda condition: False
+    m.getInfoLabel = lambda label: ''
+    m.getSkinDir = lambda: 'skin.estuary'
+    m.getLanguage = lambda *args: 'English'
+    m.executebuiltin = _noop
+    m.executeJSONRPC = lambda command: '{"id": 1, "jsonrpc": "2.0", "result": {}}'
+    m.sleep = lambda ms: None
+    return m
+
+
+# xbmcgui
+
+class ListItem(object):
+    def __init__(self, label='', label2='', iconImage='', thumbnailImage='', path=''):
+        self.label = label
+        self.label2 = label2
+        self.iconImage = iconImage
+        self.thumbnailImage = thumbnailImage
+        self.path = path
+        self.properties = {}
+
+    def getLabel(self):
+        return self.label
+
+    def getLabel2(self):
+        return self.label2
+
+    def setLabel(self, label):
+        self.label = label
+
+    def setLabel2(self, label):
+        self.label2 = label
+
+    def setIconImage(self, icon):
+        self.iconImage = icon
+
+    def setThumbnailImage(self, thumb):
+        self.thumbnailImage = thumb
+
+    def setPath(self, path):
+        self.path = path
+
+    def setProperty(self, key, value):
+        self.properties[key.lower()] = value
+
+    def getProperty(self, key):
+        return self.properties.get(key.lower(), '')
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _noop
+
+
+class ControlList(_Stub):
+    def __init__(self, *args, **kwargs):
+        self.items = []
+        self.selected = 0
+
+    def addItem(self, item):
+        self.items.append(item)
+
+    def addItems(self, items):
+        self.items.extend(items)
+
+    def getListItem(self, idx):
+        return self.items[idx]
+
+    def getSelectedPosition(self):
+        return self.selected
+
+    def getSelectedItem(self):
+        return self.items and self.items[self.selected] or None
+
+    def selectItem(self, idx):
+        self.selected = idx
+
+    def size(self):
+        return len(self.items)
+
+    def reset(self):
+        self.items = []
+        self.selected = 0
+
+    def getId(self):
+        return 0
+
+
+class Window(object):
+    # Kodi sets windows up in __new__, subclasses don't always call __init__
+    def __new__(cls, *args, **kwargs):
+        self = object.__new__(cls)
+        self.properties = {}
+        self.controls = {}
+        return self
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def getControl(self, controlID):
+        if controlID not in self.controls:
+            self.controls[controlID] = ControlList()
+        return self.controls[controlID]
+
+    def setProperty(self, key, value):
+        self.properties[key.lower()] = value
+
+    def getProperty(self, key):
+        return self.properties.get(key.lower(), '')
+
+    def clearProperty(self, key):
+        self.properties.pop(key.lower(), None)
+
+    def getFocusId(self):
+        return 0
+
+    # Called unbound on the base class (xbmcgui.WindowXML.show(self)), so __getattr__ won't do
+    def show(self):
+        pass
+
+    def close(self):
+        pass
+
+    def doModal(self):
+        pass
+
+    def setFocusId(self, controlID):
+        pass
+
+    def setFocus(self, control):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _noop
+
+
+def _xbmcgui():
+    m = StubModule('xbmcgui')
+    m.ListItem = ListItem
+    m.ControlList = ControlList
+    m.Window = Window
+    m.WindowDialog = Window
+    m.WindowXML = Window
+    m.WindowXMLDialog = Window
+    m.getCurrentWindowId = lambda: 10000
+    m.getCurrentWindowDialogId = lambda: 9999
+    return m
+
+
+# xbmcaddon
+
+def _addonInfo():
+    info = {'path': ROOT, 'profile': PROFILE, 'id': 'script.plex', 'name': 'Plex', 'version': '0.0.0'}
+    try:
+        addon = ET.parse(os.path.join(ROOT, 'addon.xml')).getroot()
+        info.update(id=addon.get('id'), name=addon.get('name'), version=addon.get('version'))
+    except (IOError, ET.ParseError):
+        pass
+
+    return info
+
+
+class Addon(object):
+    INFO = None
+    SETTINGS = {}
+
+    def __init__(self, id=None):
+        if Addon.INFO is None:
+            Addon.INFO = _addonInfo()
+
+    def getAddonInfo(self, key):
+        return Addon.INFO.get(key, '')
+
+    def getSetting(self, key):
+        return Addon.SETTINGS.get(key, '')
+
+    def setSetting(self, key, value):
+        Addon.SETTINGS[key] = value
+
+    def getLocalizedString(self, ID):
+        return u''
+
+    def openSettings(self):
+        pass
+
+
+def _xbmcaddon():
+    m = StubModule('xbmcaddon')
+    m.Addon = Addon
+    return m
+
+
+# xbmcvfs
+
+def _xbmcvfs():
+    m = StubModule('xbmcvfs')
+    m.exists = lambda path: os.path.exists(_translatePath(path))
+    m.mkdir = lambda path: os.mkdir(_translatePath(path)) or True
+    m.mkdirs = lambda path: os.makedirs(_translatePath(path)) or True
+    m.delete = lambda path: os.remove(_translatePath(path)) or True
+    return m
+
+
+def install():
+    """ Put the stubs in sys.modules and lib/ on the path, safe to call more than once. """
+    if 'xbmc' in sys.modules:
+        return
+
+    if not os.path.exists(PROFILE):
+        os.makedirs(PROFILE)
+
+    sys.modules['xbmc'] = _xbmc()
+    sys.modules['xbmcgui'] = _xbmcgui()
+    sys.modules['xbmcaddon'] = _xbmcaddon()
+    sys.modules['xbmcvfs'] = _xbmcvfs()
+    sys.modules['xbmcplugin'] = StubModule('xbmcplugin')
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)